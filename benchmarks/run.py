@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for buildpg.
+
+Run with:
+
+    python benchmarks/run.py [--output results.json] [--dsn postgresql://postgres@localhost/buildpg_test]
+
+Results are written as JSON so runs from different commits can be compared with:
+
+    python benchmarks/run.py --compare before.json after.json
+
+Database benchmarks are skipped if postgres can't be reached at the DSN given.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+THIS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(THIS_DIR.parent))
+
+from buildpg import MultipleValues, V, Values, clauses, funcs, render  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@benchmark
+def render_simple():
+    return lambda: render('SELECT * FROM users WHERE id=:id AND name=:name', id=123, name='testing')
+
+
+@benchmark
+def render_deep_and():
+    where = funcs.AND(*[V(f'c{i}') == i for i in range(100)])
+    return lambda: render('SELECT * FROM t WHERE :where', where=where)
+
+
+@benchmark
+def render_deep_or():
+    where = funcs.OR(*[V(f'c{i}') == i for i in range(100)])
+    return lambda: render('SELECT * FROM t WHERE :where', where=where)
+
+
+@benchmark
+def build_deep_and():
+    return lambda: funcs.AND(*[V(f'c{i}') == i for i in range(100)])
+
+
+@benchmark
+def render_multiple_values():
+    values = MultipleValues(*[Values(a=i, b=f'b {i}', c=i * 1.5, d=None) for i in range(1000)])
+    return lambda: render('INSERT INTO t (:values__names) VALUES :values', values=values)
+
+
+@benchmark
+def build_multiple_values():
+    return lambda: MultipleValues(*[Values(a=i, b=f'b {i}', c=i * 1.5, d=None) for i in range(1000)])
+
+
+@benchmark
+def render_clauses_joins():
+    def build():
+        return (
+            clauses.Select(['u.id', 'u.first_name', 'c.name'])
+            + clauses.From(V('users').as_('u'))
+            + clauses.Join(V('companies').as_('c'), V('c.id') == V('u.company'))
+            + clauses.LeftJoin(V('addresses').as_('a'), V('a.user') == V('u.id'))
+            + clauses.Where((V('u.value') > 10) & (V('c.name').ilike('%foo%')))
+            + clauses.OrderBy(V('u.created').desc(), 'u.id')
+            + clauses.Limit(20)
+        )
+
+    return lambda: render(':query', query=build())
+
+
+@benchmark
+def executemany_prepare():
+    rows = [Values(a=i, b=f'b {i}', c=i * 1.5) for i in range(1000)]
+
+    def prepare():
+        query, _ = render('INSERT INTO t (:values__names) VALUES :values', values=rows[0])
+        return query, [render.get_params(r) for r in rows]
+
+    return prepare
+
+
+def time_sync(func, min_time):
+    # warm up and find roughly how many loops take min_time
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        loops *= 2
+
+    loops = max(1, int(loops * min_time / 10 / elapsed))
+    timings = []
+    for _ in range(10):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops)
+    return loops, timings
+
+
+DB_BENCHMARKS = {
+    'fetch_b_row': lambda conn: conn.fetch_b('SELECT * FROM bench WHERE :where', where=V('id') == 42),
+    'fetch_b_1000': lambda conn: conn.fetch_b('SELECT * FROM bench WHERE :where', where=V('value') >= 0),
+}
+
+
+def selected(benchmarks, name_filter):
+    return {name: func for name, func in benchmarks.items() if not name_filter or name_filter in name}
+
+
+async def db_benchmarks(dsn, min_time, name_filter=None):
+    cases = selected(DB_BENCHMARKS, name_filter)
+    if not cases:
+        return {}
+
+    try:
+        from buildpg import asyncpg
+    except ImportError:
+        print('asyncpg not installed, skipping database benchmarks')
+        return {}
+
+    try:
+        conn = await asyncpg.connect_b(dsn)
+    except (OSError, asyncpg.PostgresError) as e:
+        print(f'unable to connect to "{dsn}", skipping database benchmarks: {e.__class__.__name__}: {e}')
+        return {}
+
+    results = {}
+    try:
+        await conn.execute('CREATE TEMPORARY TABLE bench (id int PRIMARY KEY, name text, value float8)')
+        await conn.executemany_b(
+            'INSERT INTO bench (:values__names) VALUES :values',
+            [Values(id=i, name=f'name {i}', value=i * 1.5) for i in range(1000)],
+        )
+        for name, func in cases.items():
+            await func(conn)
+            timings = []
+            loops = 0
+            end = time.perf_counter() + min_time
+            while time.perf_counter() < end or loops < 10:
+                start = time.perf_counter()
+                await func(conn)
+                timings.append(time.perf_counter() - start)
+                loops += 1
+            results[name] = summarise(timings, loops)
+    finally:
+        await conn.close()
+    return results
+
+
+def summarise(timings, loops):
+    timings = sorted(timings)
+    return {
+        'loops': loops,
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'max': timings[-1],
+    }
+
+
+def git_revision():
+    try:
+        p = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=THIS_DIR, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    else:
+        return p.stdout.strip()
+
+
+def run(args):
+    results = {}
+    for name, setup in selected(BENCHMARKS, args.filter).items():
+        loops, timings = time_sync(setup(), args.min_time)
+        results[name] = summarise(timings, loops)
+        print(f'{name:>30}: {results[name]["min"] * 1e6:10.2f}µs')
+
+    if args.dsn:
+        db_results = asyncio.run(db_benchmarks(args.dsn, args.min_time, args.filter))
+        for name, r in db_results.items():
+            print(f'{name:>30}: {r["min"] * 1e6:10.2f}µs')
+        results.update(db_results)
+
+    output = {
+        'revision': git_revision(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(output, indent=2))
+        print(f'results written to {args.output}')
+    return output
+
+
+def compare(before_file, after_file):
+    before = json.loads(Path(before_file).read_text())
+    after = json.loads(Path(after_file).read_text())
+    print(f'before: {before["revision"]}, after: {after["revision"]}')
+    for name, a in after['results'].items():
+        b = before['results'].get(name)
+        if b is None:
+            print(f'{name:>30}: {"new":>10}')
+        elif not b['min']:
+            # too fast for the timer to measure, there's no ratio to give
+            print(f'{name:>30}: {b["min"] * 1e6:10.2f}µs -> {a["min"] * 1e6:10.2f}µs {"n/a":>8}')
+        else:
+            change = (a['min'] - b['min']) / b['min'] * 100
+            print(f'{name:>30}: {b["min"] * 1e6:10.2f}µs -> {a["min"] * 1e6:10.2f}µs {change:+7.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run buildpg benchmarks.')
+    parser.add_argument('--output', '-o', help='file to write JSON results to')
+    parser.add_argument('--dsn', default='postgresql://postgres@localhost/buildpg_test', help='postgres DSN')
+    parser.add_argument('--no-db', dest='dsn', action='store_const', const=None, help='skip database benchmarks')
+    parser.add_argument('--min-time', type=float, default=0.5, help='minimum time to run each benchmark for')
+    parser.add_argument('--filter', '-k', help='only run benchmarks whose name contains this string')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two results files')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 # flake8: noqa
-from . import clauses, funcs
+from . import clauses, filters, funcs
 from .components import *
 from .logic import *
 from .main import *
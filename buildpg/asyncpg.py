@@ -1,11 +1,28 @@
+import asyncio
+import dataclasses
 import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import lru_cache
+from io import BytesIO
+from math import ceil
+from operator import index, itemgetter
 from textwrap import indent
+from time import monotonic, perf_counter
 
 from asyncpg import *  # noqa
 from asyncpg.pool import Pool
 from asyncpg.protocol import Record
 
-from .main import render
+from . import clauses
+from .bulk import prepare_copy_chunk
+from .components import UnnestValues, VarLiteral
+from .explain import PlanSummary, logger as explain_logger
+from .logic import Var, select_fields
+from .main import Renderer, render
+from .pool import DEFAULT_PRIORITY, PRIORITIES, CapacityLimiter, PoolAutoscaler, PoolMetrics  # noqa: F401
 
 try:
     import sqlparse
@@ -15,8 +32,292 @@ try:
 except ImportError:  # pragma: no cover
     sqlparse = None
 
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+# postgres types which are returned as compact arrays by fetch_columns_b, mapped to their array.array typecodes
+ARRAY_TYPECODES = {'int2': 'h', 'int4': 'i', 'int8': 'q', 'oid': 'I', 'float4': 'f', 'float8': 'd'}
+
+
+# absolute deadline (as time.monotonic()) for queries run by *_b methods, set by deadline()
+_deadline = ContextVar('buildpg_deadline', default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(timeout: float):
+    """
+    Set a deadline ``timeout`` seconds from now for the *_b methods called in this block (and in tasks started within
+    it), nested deadlines can shorten the deadline but not extend it.
+
+    Query timeouts are trimmed to the time remaining, connections aren't acquired once the deadline has passed
+    (DeadlineExceeded is raised instead) and transactions started by *_b methods set ``statement_timeout`` so
+    postgres stops running the query too.
+    """
+    at = monotonic() + timeout
+    current = _deadline.get()
+    if current is not None:
+        at = min(at, current)
+    token = _deadline.set(at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """
+    Seconds left before the current deadline, or None if no deadline is set.
+    """
+    at = _deadline.get()
+    return None if at is None else max(at - monotonic(), 0)
+
+
+def _deadline_timeout(timeout):
+    at = _deadline.get()
+    if at is None:
+        return timeout
+    remaining = at - monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded('query deadline exceeded')
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+async def _set_statement_timeout(conn):
+    # SET LOCAL via set_config so the timeout only lasts until the end of the transaction
+    remaining = _deadline_timeout(None)
+    if remaining is not None:
+        await conn.execute("SELECT set_config('statement_timeout', $1, true)", f'{ceil(remaining * 1000)}ms')
+
+
+@asynccontextmanager
+async def _transaction(conn, savepoint=False):
+    """
+    Start a transaction unless one is already in progress, with ``savepoint`` a savepoint is used in that case.
+    """
+    nested = conn.is_in_transaction()
+    if nested and not savepoint:
+        yield
+        return
+    async with conn.transaction():
+        if not nested:
+            await _set_statement_timeout(conn)
+        yield
+
+
+async def _fetch_batches(cursor, batch_size, timeout):
+    """
+    Yield lists of records from a cursor, the next batch is fetched while the current one is being processed.
+    """
+    next_batch = asyncio.ensure_future(cursor.fetch(batch_size, timeout=_deadline_timeout(timeout)))
+    try:
+        while next_batch is not None:
+            rows = await next_batch
+            # a short batch means the cursor is exhausted, no need for another round trip
+            next_batch = (
+                asyncio.ensure_future(cursor.fetch(batch_size, timeout=_deadline_timeout(timeout)))
+                if len(rows) == batch_size
+                else None
+            )
+            if rows:
+                yield rows
+    finally:
+        if next_batch is not None:
+            # let the fetch complete rather than cancelling it so the connection is left in a usable state
+            await asyncio.gather(next_batch, return_exceptions=True)
+
+
+class AdaptiveBatchSize:
+    """
+    Adjust batch sizes towards ``target_latency`` seconds per batch, within ``min_size`` and ``max_size``.
+
+    Pass as ``batch_size`` to ``executemany_b`` or ``chunk_size`` to ``upsert_many_b``, or use with
+    ``MultipleValues.chunks()`` and call ``record()`` after each batch. The time per row is tracked as an
+    exponentially weighted moving average (``smoothing`` is the weight of the latest batch) and the next size is
+    the number of rows expected to take ``target_latency``, changing by at most a factor of ``max_step`` each batch.
+
+    The same instance can be reused across calls so it keeps adapting, ``metrics()`` returns its current state.
+    """
+
+    __slots__ = (
+        'size',
+        'min_size',
+        'max_size',
+        'target_latency',
+        'smoothing',
+        'max_step',
+        'batches',
+        'rows',
+        'last_latency',
+        '_seconds_per_row',
+    )
+
+    def __init__(
+        self,
+        initial: int = 1000,
+        *,
+        min_size: int = 10,
+        max_size: int = 100_000,
+        target_latency: float = 0.5,
+        smoothing: float = 0.3,
+        max_step: float = 2.0,
+    ):
+        if not 1 <= min_size <= initial <= max_size:
+            raise ValueError('sizes must satisfy 1 <= min_size <= initial <= max_size')
+        self.size = initial
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.smoothing = smoothing
+        self.max_step = max_step
+        self.batches = 0
+        self.rows = 0
+        self.last_latency = None
+        self._seconds_per_row = None
+
+    def __index__(self):
+        return self.size
+
+    def record(self, rows: int, duration: float):
+        """
+        Record the time taken for a batch and update ``size``.
+        """
+        self.batches += 1
+        self.rows += rows
+        self.last_latency = duration
+        if not rows:
+            return
+        seconds_per_row = duration / rows
+        if self._seconds_per_row is None:
+            self._seconds_per_row = seconds_per_row
+        else:
+            self._seconds_per_row += self.smoothing * (seconds_per_row - self._seconds_per_row)
+
+        if self._seconds_per_row > 0:
+            ideal = self.target_latency / self._seconds_per_row
+        else:
+            ideal = self.max_size
+        ideal = min(max(ideal, self.size / self.max_step), self.size * self.max_step)
+        self.size = int(min(max(ideal, self.min_size), self.max_size))
+
+    @property
+    def rows_per_second(self):
+        if self._seconds_per_row:
+            return 1 / self._seconds_per_row
+
+    def metrics(self) -> dict:
+        return {
+            'size': self.size,
+            'batches': self.batches,
+            'rows': self.rows,
+            'last_latency': self.last_latency,
+            'rows_per_second': self.rows_per_second,
+        }
+
+    def __repr__(self):
+        return f'<AdaptiveBatchSize size={self.size} rows_per_second={self.rows_per_second}>'
+
+
+async def _timed_batch(batch_size, rows, coro):
+    if not isinstance(batch_size, AdaptiveBatchSize):
+        return await coro
+    start = perf_counter()
+    result = await coro
+    batch_size.record(rows, perf_counter() - start)
+    return result
+
+
+def _keyset_keys(order_by):
+    keys = []
+    for expr, *_ in clauses.order_by_terms(order_by):
+        if expr.op is not None or not isinstance(expr.v1, VarLiteral):
+            raise ValueError(f'unable to infer record key for "{expr}", "_keys" must be provided')
+        keys.append(expr.v1.rsplit('.', 1)[-1])
+    return keys
+
+
+@lru_cache(maxsize=None)
+def _model_fields(model):
+    """
+    Names of the fields set when creating an instance of a dataclass or namedtuple, and a select list of them.
+    """
+    if dataclasses.is_dataclass(model):
+        names = tuple(f.name for f in dataclasses.fields(model) if f.init)
+    elif hasattr(model, '_fields'):
+        names = model._fields
+    else:
+        raise TypeError(f'{model!r} is not a dataclass or namedtuple')
+    return names, select_fields(*names)
+
+
+@lru_cache(maxsize=1024)
+def _row_constructor(model, columns):
+    """
+    Build a function creating an instance of model from a record with the given column names.
+    """
+    names, _ = _model_fields(model)
+    if columns == names:
+        # the common case, records are iterable so can be passed straight through
+        return lambda r: model(*r)
+
+    present = [n for n in names if n in columns]
+    if not present:
+        raise ValueError(f'none of the fields of {model.__name__} are in the query result')
+    getter = itemgetter(*[columns.index(n) for n in present])
+    if len(present) == 1:
+        name = present[0]
+        return lambda r: model(**{name: getter(r)})
+    elif present == list(names):
+        return lambda r: model(*getter(r))
+    else:
+        # some fields are missing from the result, rely on their defaults
+        present = tuple(present)
+        return lambda r: model(**dict(zip(present, getter(r))))
+
+
+class _ColumnBuilder:
+    __slots__ = 'names', 'columns'
+
+    def __init__(self, attributes):
+        self.names = [a.name for a in attributes]
+        self.columns = [
+            array(ARRAY_TYPECODES[a.type.name]) if a.type.name in ARRAY_TYPECODES else [] for a in attributes
+        ]
+
+    def extend(self, rows):
+        for i, values in enumerate(zip(*rows)):
+            column = self.columns[i]
+            if isinstance(column, array):
+                length = len(column)
+                try:
+                    column.extend(values)
+                except (TypeError, OverflowError):
+                    # a null or out of range value, this column has to fall back to a list
+                    self.columns[i] = column[:length].tolist() + list(values)
+            else:
+                column.extend(values)
+
+    def finish(self):
+        if numpy is None:
+            columns = self.columns
+        else:
+            columns = [numpy.asarray(c) if isinstance(c, array) else c for c in self.columns]
+        return dict(zip(self.names, columns))
+
 
 class _BuildPgMixin:
+    # the Renderer used by *_b methods, override in a subclass to customise rendering
+    renderer = render
+    # used by copy_out_b since COPY can't take parameters
+    literal_renderer = Renderer(inline_literals=True)
+    # set to a buildpg.explain.PlanSampler to capture plans for slow queries
+    plan_sampler = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -28,6 +329,23 @@ class _BuildPgMixin:
         else:
             return sql.strip('\r\n ')
 
+    @asynccontextmanager
+    async def _connection(self, priority=None, tag=None, query_template=None):
+        if not isinstance(self, Pool):
+            yield self
+            return
+        # limits only apply while acquiring, not to other queries run while the connection is held
+        with self._limits(priority, tag, query_template):
+            conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    def _limits(self, priority, tag, query_template=None):
+        # connections are already acquired, see BuildPgPool
+        return nullcontext()
+
     def _print_query(self, print_, sql, args):
         if print_:
             if not callable(print_):
@@ -38,40 +356,357 @@ class _BuildPgMixin:
             print_(f'params: {args} query:\n{self._format_sql(sql, formatted)}')
 
     def print_b(self, query_template, *, print_=True, **kwargs):
-        query, args = render(query_template, **kwargs)
+        query, args = self.renderer(query_template, **kwargs)
         self._print_query(print_, query, args)
         return query, args
 
-    async def execute_b(self, query_template, *, _timeout: float = None, print_=False, **kwargs):
-        query, args = render(query_template, **kwargs)
+    async def _run_b(self, method, query, args, timeout, **kwargs):
+        timeout = _deadline_timeout(timeout)
+        sampler = self.plan_sampler
+        if sampler is None:
+            return await method(query, *args, timeout=timeout, **kwargs)
+
+        start = perf_counter()
+        result = await method(query, *args, timeout=timeout, **kwargs)
+        duration = perf_counter() - start
+        if sampler.should_sample(duration):
+            try:
+                summary = await self._explain(query, args, sampler.analyze, sampler.buffers, timeout)
+            except Exception:
+                explain_logger.exception('error explaining slow query')
+            else:
+                await sampler.record(query, args, duration, summary)
+        return result
+
+    async def _explain(self, query, args, analyze, buffers, timeout, priority=None, tag=None):
+        timeout = _deadline_timeout(timeout)
+        options = ['FORMAT JSON']
+        if analyze:
+            options.append('ANALYZE')
+        if buffers:
+            options.append('BUFFERS')
+        sql = f'EXPLAIN ({", ".join(options)}) {query}'
+        async with self._connection(priority, tag) as conn:
+            if analyze:
+                # ANALYZE executes the query, roll back so any changes it makes aren't kept
+                tr = conn.transaction()
+                await tr.start()
+                try:
+                    await _set_statement_timeout(conn)
+                    output = await conn.fetchval(sql, *args, timeout=timeout)
+                finally:
+                    await tr.rollback()
+            else:
+                output = await conn.fetchval(sql, *args, timeout=timeout)
+        return PlanSummary(output)
+
+    async def explain_b(
+        self,
+        query_template,
+        *,
+        _analyze=False,
+        _buffers=False,
+        _timeout: float = None,
+        _priority=None,
+        _tag=None,
+        print_=False,
+        **kwargs,
+    ) -> PlanSummary:
+        """
+        Render a query and run ``EXPLAIN (FORMAT JSON)`` on it with the same parameters, returning a PlanSummary.
+
+        With ``_analyze`` the query is executed to get actual row counts and timings, inside a transaction which is
+        rolled back so data modifying queries don't change anything. ``_buffers`` adds buffer usage to the plan.
+        """
+        query, args = self.renderer(query_template, **kwargs)
         self._print_query(print_, query, args)
-        return await self.execute(query, *args, timeout=_timeout)
+        return await self._explain(query, args, _analyze, _buffers, _timeout, _priority, _tag)
+
+    async def execute_b(
+        self, query_template, *, _timeout: float = None, _priority=None, _tag=None, print_=False, **kwargs
+    ):
+        query, args = self.renderer(query_template, **kwargs)
+        self._print_query(print_, query, args)
+        with self._limits(_priority, _tag, query_template):
+            return await self._run_b(self.execute, query, args, _timeout)
+
+    async def executemany_b(
+        self, query_template, args, *, timeout: float = None, batch_size=None, priority=None, tag=None, print_=False
+    ):
+        """
+        Execute a query for each of ``args`` which should be Values or similar components rendered as ``:values``.
 
-    async def executemany_b(self, query_template, args, *, timeout: float = None, print_=False):
-        query, _ = render(query_template, values=args[0])
-        args_ = [render.get_params(a) for a in args]
+        With ``batch_size`` (an int or an AdaptiveBatchSize) rows are sent in batches, all inside one transaction.
+        """
+        # parameters for each row must be in the same position, so values can't be deduplicated
+        query, _ = self.renderer._render(query_template, {'values': args[0]}, False)
+        args_ = [self.renderer.get_params(a) for a in args]
         self._print_query(print_, query, args)
-        return await self.executemany(query, args_, timeout=timeout)
+        timeout = _deadline_timeout(timeout)
+        if batch_size is None:
+            with self._limits(priority, tag, query_template):
+                return await self.executemany(query, args_, timeout=timeout)
+
+        async with self._connection(priority, tag, query_template) as conn, _transaction(conn):
+            start = 0
+            while start < len(args_):
+                end = start + index(batch_size)
+                batch = args_[start:end]
+                await _timed_batch(
+                    batch_size, len(batch), conn.executemany(query, batch, timeout=_deadline_timeout(timeout))
+                )
+                start = end
 
     def cursor_b(self, query_template, *, _timeout: float = None, _prefetch=None, print_=False, **kwargs):
-        query, args = render(query_template, **kwargs)
+        query, args = self.renderer(query_template, **kwargs)
         self._print_query(print_, query, args)
-        return self.cursor(query, *args, timeout=_timeout, prefetch=_prefetch)
+        return self.cursor(query, *args, timeout=_deadline_timeout(_timeout), prefetch=_prefetch)
 
-    async def fetch_b(self, query_template, *, _timeout: float = None, print_=False, **kwargs):
-        query, args = render(query_template, **kwargs)
+    async def fetch_b(
+        self, query_template, *, _timeout: float = None, _priority=None, _tag=None, print_=False, **kwargs
+    ):
+        query, args = self.renderer(query_template, **kwargs)
         self._print_query(print_, query, args)
-        return await self.fetch(query, *args, timeout=_timeout)
+        with self._limits(_priority, _tag, query_template):
+            return await self._run_b(self.fetch, query, args, _timeout)
 
-    async def fetchval_b(self, query_template, *, _timeout: float = None, _column=0, print_=False, **kwargs):
-        query, args = render(query_template, **kwargs)
+    async def fetchval_b(
+        self, query_template, *, _timeout: float = None, _column=0, _priority=None, _tag=None, print_=False, **kwargs
+    ):
+        query, args = self.renderer(query_template, **kwargs)
         self._print_query(print_, query, args)
-        return await self.fetchval(query, *args, timeout=_timeout, column=_column)
+        with self._limits(_priority, _tag, query_template):
+            return await self._run_b(self.fetchval, query, args, _timeout, column=_column)
 
-    async def fetchrow_b(self, query_template, *, _timeout: float = None, print_=False, **kwargs):
-        query, args = render(query_template, **kwargs)
+    async def fetchrow_b(
+        self, query_template, *, _timeout: float = None, _priority=None, _tag=None, print_=False, **kwargs
+    ):
+        query, args = self.renderer(query_template, **kwargs)
         self._print_query(print_, query, args)
-        return await self.fetchrow(query, *args, timeout=_timeout)
+        with self._limits(_priority, _tag, query_template):
+            return await self._run_b(self.fetchrow, query, args, _timeout)
+
+    async def fetch_as_b(
+        self, model, query_template, *, _timeout: float = None, _priority=None, _tag=None, print_=False, **kwargs
+    ):
+        """
+        Fetch the result of a query as a list of ``model`` instances, model should be a dataclass or namedtuple.
+
+        ``:fields`` in the template renders a select list of the model's fields unless ``fields`` is given. Columns
+        are matched to fields by name and the function creating instances is cached for each model and
+        column order, fields missing from the result must have defaults.
+        """
+        kwargs.setdefault('fields', _model_fields(model)[1])
+        rows = await self.fetch_b(
+            query_template, _timeout=_timeout, _priority=_priority, _tag=_tag, print_=print_, **kwargs
+        )
+        if not rows:
+            return []
+        return list(map(_row_constructor(model, tuple(rows[0].keys())), rows))
+
+    async def fetchrow_as_b(
+        self, model, query_template, *, _timeout: float = None, _priority=None, _tag=None, print_=False, **kwargs
+    ):
+        """
+        Fetch one row as an instance of ``model``, or None if the query returns no rows, see ``fetch_as_b``.
+        """
+        kwargs.setdefault('fields', _model_fields(model)[1])
+        row = await self.fetchrow_b(
+            query_template, _timeout=_timeout, _priority=_priority, _tag=_tag, print_=print_, **kwargs
+        )
+        if row is None:
+            return None
+        return _row_constructor(model, tuple(row.keys()))(row)
+
+    async def fetch_columns_b(
+        self,
+        query_template,
+        *,
+        _batch_size: int = 1000,
+        _timeout: float = None,
+        _priority=None,
+        _tag=None,
+        print_=False,
+        **kwargs,
+    ):
+        """
+        Fetch the result of a query as a dict of columns rather than a list of records.
+
+        Numeric columns are returned as numpy arrays if numpy is installed, otherwise as ``array.array``, other
+        columns (or numeric columns containing nulls) are returned as lists. Rows are read from a cursor in batches
+        of ``_batch_size`` so the full list of records is never held in memory.
+        """
+        query, args = self.renderer(query_template, **kwargs)
+        self._print_query(print_, query, args)
+        _timeout = _deadline_timeout(_timeout)
+        async with self._connection(_priority, _tag, query_template) as conn, _transaction(conn):
+            stmt = await conn.prepare(query, timeout=_timeout)
+            builder = _ColumnBuilder(stmt.get_attributes())
+            cursor = await stmt.cursor(*args, timeout=_timeout)
+            batches = _fetch_batches(cursor, _batch_size, _timeout)
+            try:
+                async for rows in batches:
+                    builder.extend(rows)
+            finally:
+                await batches.aclose()
+        return builder.finish()
+
+    async def iter_b(
+        self,
+        query_template,
+        *,
+        _batch_size: int = 1000,
+        _batches=False,
+        _timeout: float = None,
+        _priority=None,
+        _tag=None,
+        print_=False,
+        **kwargs,
+    ):
+        """
+        Iterate over the result of a query, rows are read from a cursor in batches of ``_batch_size`` with the next
+        batch fetched while the current one is processed.
+
+        Unlike ``cursor_b`` a connection is acquired (when called on a pool) and a transaction started (if one isn't
+        already in progress) for you. The connection can't be used for other queries until iteration is complete.
+
+        If ``_batches`` is true lists of records are yielded rather than individual records.
+        """
+        query, args = self.renderer(query_template, **kwargs)
+        self._print_query(print_, query, args)
+        _timeout = _deadline_timeout(_timeout)
+        async with self._connection(_priority, _tag, query_template) as conn, _transaction(conn):
+            cursor = await conn.cursor(query, *args, timeout=_timeout)
+            batches = _fetch_batches(cursor, _batch_size, _timeout)
+            try:
+                async for rows in batches:
+                    if _batches:
+                        yield rows
+                    else:
+                        for row in rows:
+                            yield row
+            finally:
+                # close explicitly so any prefetch in progress completes before the transaction ends
+                await batches.aclose()
+
+    async def paginate_b(
+        self,
+        query_template,
+        *,
+        _order_by,
+        _page_size: int = 1000,
+        _keys=None,
+        _timeout: float = None,
+        _priority=None,
+        _tag=None,
+        print_=False,
+        **kwargs,
+    ):
+        """
+        Walk through the result of a query page by page using keyset pagination, yielding lists of records.
+
+        The query template should use ``:keyset`` (a condition to include in ``WHERE``), ``:order_by`` and ``:limit``,
+        these are rendered using ``_order_by`` and ``_page_size``. Each page starts after the last row of the
+        previous page, values are taken from the record using ``_keys``, by default the column names from
+        ``_order_by`` without any table prefix.
+
+            async for page in conn.paginate_b(
+                'SELECT id, name FROM users WHERE active AND :keyset :order_by :limit', _order_by=OrderBy('id')
+            ):
+                ...
+        """
+        if not isinstance(_order_by, clauses.OrderBy):
+            _order_by = clauses.OrderBy(*_order_by)
+        keys = _keys or _keyset_keys(_order_by)
+        limit = clauses.Limit(_page_size)
+        last = None
+        while True:
+            query, args = self.renderer(
+                query_template, keyset=clauses.keyset(_order_by, last), order_by=_order_by, limit=limit, **kwargs
+            )
+            self._print_query(print_, query, args)
+            with self._limits(_priority, _tag, query_template):
+                rows = await self._run_b(self.fetch, query, args, _timeout)
+            if rows:
+                yield rows
+            if len(rows) < _page_size:
+                return
+            last = [rows[-1][k] for k in keys]
+
+    async def upsert_many_b(
+        self,
+        table,
+        values,
+        *,
+        conflict,
+        update=None,
+        types=None,
+        chunk_size=10_000,
+        timeout: float = None,
+        priority=None,
+        tag=None,
+        print_=False,
+    ):
+        """
+        Insert or update many rows using ``INSERT ... SELECT * FROM unnest(...) ON CONFLICT (...) DO UPDATE``.
+
+        ``values`` should be a list of named Values or an UnnestValues instance, ``types`` is required in the former
+        case, see UnnestValues. Rows are sent as array parameters in chunks of ``chunk_size`` rows (an int or an
+        AdaptiveBatchSize), all inside one transaction. ``conflict`` is the conflict column or a list of columns,
+        ``update`` are the columns to update on conflict - by default all columns not in ``conflict``, an empty list
+        means ``DO NOTHING``.
+
+        Each chunk must not contain the same conflict key twice. Returns the number of rows inserted or updated,
+        with no rows 0 is returned without a query.
+        """
+        if not isinstance(values, UnnestValues):
+            if not values:
+                return 0
+            values = UnnestValues(*values, types=types)
+        elif not len(values):
+            return 0
+        conflict = (conflict,) if isinstance(conflict, str) else tuple(conflict)
+        if update is None:
+            update = [n for n in values.names if n not in conflict]
+        on_conflict = clauses.OnConflict(*conflict, update=update or None)
+        template = 'INSERT INTO :table (:values__names) SELECT * FROM :values :on_conflict'
+        count = 0
+        timeout = _deadline_timeout(timeout)
+        async with self._connection(priority, tag) as conn, _transaction(conn, savepoint=True):
+            for chunk in values.chunks(chunk_size):
+                query, args = self.renderer(template, table=Var(table), values=chunk, on_conflict=on_conflict)
+                self._print_query(print_, query, args)
+                status = await _timed_batch(
+                    chunk_size, len(chunk), conn.execute(query, *args, timeout=_deadline_timeout(timeout))
+                )
+                count += int(status.rsplit(' ', 1)[-1])
+        return count
+
+    async def copy_out_b(
+        self,
+        query_template,
+        *,
+        output,
+        _timeout: float = None,
+        _copy_options: dict = None,
+        _priority=None,
+        _tag=None,
+        print_=False,
+        **kwargs,
+    ):
+        """
+        Run ``COPY (<query>) TO STDOUT`` and write the result to ``output``, which may be a path, file-like object or
+        coroutine function as with asyncpg's ``copy_from_query``. ``_copy_options`` are passed to
+        ``copy_from_query``, e.g. ``{'format': 'csv', 'header': True}``.
+
+        COPY can't take parameters, so values are rendered into the query as escaped literals, only the types
+        supported by ``quote_literal`` can be used.
+        """
+        query, _ = self.literal_renderer(query_template, **kwargs)
+        self._print_query(print_, query, [])
+        _timeout = _deadline_timeout(_timeout)
+        async with self._connection(_priority, _tag, query_template) as conn:
+            return await conn.copy_from_query(query, output=output, timeout=_timeout, **(_copy_options or {}))
 
 
 class BuildPgConnection(_BuildPgMixin, Connection):  # noqa
@@ -83,8 +718,354 @@ async def connect_b(*args, **kwargs):
     return await connect(*args, **kwargs)  # noqa
 
 
+async def _aiter(iterable):
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+def _raise_failed(tasks):
+    for task in [t for t in tasks if t.done()]:
+        tasks.discard(task)
+        if task.exception() is not None:
+            raise task.exception()
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _cancel_pipeline(tasks, queue):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # cancel chunks which were prepared (or are being prepared) but won't be used
+    while not queue.empty():
+        prepared = queue.get_nowait()
+        if prepared is not None:
+            prepared.cancel()
+
+
+# (priority, tag) used when BuildPgPool acquires connections, set by BuildPgPool.limits()
+_acquire_options = ContextVar('buildpg_acquire_options', default=(DEFAULT_PRIORITY, None))
+
+
 class BuildPgPool(_BuildPgMixin, Pool):
-    pass
+    """
+    asyncpg Pool with the *_b methods, acquire metrics and an optional autoscaler.
+
+    ``pool_metrics`` records how long callers wait to acquire connections, see ``metrics()`` for a snapshot.
+    ``capacity_limiter`` limits how many connections can be acquired at once, initially ``max_size``, if
+    ``autoscaler`` (a PoolAutoscaler) is given it adjusts the limit based on acquire wait times and idle capacity.
+
+    Callers waiting for a connection are served by priority class, see ``limits()``. ``tag_limits`` maps tags to
+    the maximum number of connections queries with that tag may hold at once, a query template may also be used
+    as a tag so queries with that template are limited without passing ``_tag``.
+    """
+
+    def __init__(self, *args, autoscaler=None, tag_limits=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if autoscaler is not None and self.get_min_size() >= self.get_max_size():
+            # connections up to min_size are always kept open, so there would be nothing to scale
+            raise ValueError('autoscaler requires min_size to be less than max_size')
+        self.pool_metrics = PoolMetrics()
+        self.capacity_limiter = CapacityLimiter(self.get_max_size())
+        self.tag_limiters = {tag: CapacityLimiter(limit) for tag, limit in (tag_limits or {}).items()}
+        self.autoscaler = autoscaler
+        self._autoscale_task = None
+        # acquired connections and the tag limiter they count against
+        self._acquired = {}
+
+    if not hasattr(Pool, 'get_max_size'):
+        # these were added to Pool in asyncpg 0.25
+
+        def get_min_size(self):
+            return self._minsize
+
+        def get_max_size(self):
+            return self._maxsize
+
+        def get_size(self):
+            return sum(h._con is not None and not h._con.is_closed() for h in self._holders)
+
+        def get_idle_size(self):
+            return sum(h._con is not None and not h._con.is_closed() and not h._in_use for h in self._holders)
+
+    async def _async__init__(self):
+        result = await super()._async__init__()
+        if self.autoscaler is not None and self._autoscale_task is None:
+            self._autoscale_task = asyncio.ensure_future(self.autoscaler.run(self))
+        return result
+
+    @contextmanager
+    def limits(self, priority=None, tag=None):
+        """
+        Acquire connections in this block (and in tasks started within it) with ``priority``, one of "high",
+        "normal" (the default) or "low", and count them against the concurrency limit for ``tag`` from
+        ``tag_limits``. The *_b methods take ``_priority`` and ``_tag`` (or ``priority`` and ``tag``) to do the same
+        for one call.
+        """
+        current_priority, current_tag = _acquire_options.get()
+        if priority is not None:
+            try:
+                current_priority = PRIORITIES[priority]
+            except KeyError:
+                raise ValueError(f'priority must be one of {", ".join(PRIORITIES)}, not "{priority}"') from None
+        token = _acquire_options.set((current_priority, current_tag if tag is None else tag))
+        try:
+            yield
+        finally:
+            _acquire_options.reset(token)
+
+    def _limits(self, priority, tag, query_template=None):
+        if tag is None and isinstance(query_template, str) and query_template in self.tag_limiters:
+            tag = query_template
+        if priority is None and tag is None:
+            return nullcontext()
+        return self.limits(priority, tag)
+
+    async def _acquire_capacity(self, tag_limiter, priority):
+        # wait for the tag's limit first so callers held back by it don't take capacity from other queries
+        if tag_limiter is not None:
+            await tag_limiter.acquire(priority)
+        try:
+            await self.capacity_limiter.acquire(priority)
+        except BaseException:
+            if tag_limiter is not None:
+                tag_limiter.release()
+            raise
+
+    def _release_capacity(self, tag_limiter):
+        self.capacity_limiter.release()
+        if tag_limiter is not None:
+            tag_limiter.release()
+
+    async def _acquire(self, timeout):
+        # fail before waiting for a connection if the deadline has already passed
+        timeout = _deadline_timeout(timeout)
+        priority, tag = _acquire_options.get()
+        tag_limiter = self.tag_limiters.get(tag)
+        start = perf_counter()
+        if timeout is None:
+            await self._acquire_capacity(tag_limiter, priority)
+        else:
+            await asyncio.wait_for(self._acquire_capacity(tag_limiter, priority), timeout=timeout)
+        try:
+            if timeout is not None:
+                timeout = max(timeout - (perf_counter() - start), 0)
+            conn = await super()._acquire(timeout)
+        except BaseException:
+            self._release_capacity(tag_limiter)
+            raise
+        self._acquired[conn] = tag_limiter
+        self.pool_metrics.record_acquire(perf_counter() - start, self.capacity_limiter.in_use)
+        return conn
+
+    async def release(self, connection, *, timeout=None):
+        try:
+            return await super().release(connection, timeout=timeout)
+        finally:
+            # connections may be released more than once, only the first release frees capacity
+            if connection in self._acquired:
+                self._release_capacity(self._acquired.pop(connection))
+
+    def metrics(self) -> dict:
+        """
+        Snapshot of pool metrics: acquire wait histogram, connections in use and idle, capacity and waiters.
+        """
+        return {
+            'acquire_wait': self.pool_metrics.acquire_wait.snapshot(),
+            'acquired': self.pool_metrics.acquired,
+            'in_use': self.capacity_limiter.in_use,
+            'idle': self.get_idle_size(),
+            'size': self.get_size(),
+            'capacity': self.capacity_limiter.limit,
+            'waiting': self.capacity_limiter.waiting,
+            'waiting_by_priority': dict(zip(PRIORITIES, self.capacity_limiter.waiting_by_priority())),
+            'tags': {
+                tag: {'limit': limiter.limit, 'in_use': limiter.in_use, 'waiting': limiter.waiting}
+                for tag, limiter in self.tag_limiters.items()
+            },
+        }
+
+    def _stop_autoscaler(self):
+        if self._autoscale_task is not None:
+            self._autoscale_task.cancel()
+            self._autoscale_task = None
+
+    async def close(self):
+        self._stop_autoscaler()
+        await super().close()
+
+    def terminate(self):
+        self._stop_autoscaler()
+        super().terminate()
+
+    async def ingest_b(
+        self,
+        table: str,
+        columns,
+        rows,
+        *,
+        batch_size: int = 1000,
+        max_in_flight: int = 2,
+        types: dict = None,
+        timeout: float = None,
+        priority=None,
+        tag=None,
+        print_=False,
+    ):
+        """
+        Insert rows from an async (or normal) iterable of tuples in batches of ``batch_size``, returning the number
+        of rows inserted.
+
+        Up to ``max_in_flight`` batches are sent concurrently using separate connections while the next batch is
+        built, after that the iterable isn't read until a batch completes, so at most ``max_in_flight + 1``
+        batches are held in memory. Batches are sent with ``COPY``, or if ``types`` is given with
+        ``INSERT ... SELECT * FROM unnest(...)`` (see UnnestValues).
+
+        Each batch is committed separately, if a batch fails no more batches are sent and the error is raised once
+        batches already in progress complete. Connections are acquired with ``priority`` and ``tag``, see
+        ``limits()``.
+        """
+        columns = tuple(columns)
+        semaphore = asyncio.Semaphore(max_in_flight)
+        tasks = set()
+
+        async def send(batch):
+            try:
+                async with self._connection(priority, tag) as conn:
+                    if types is None:
+                        await self._copy_batch(conn, table, columns, batch, _deadline_timeout(timeout))
+                    else:
+                        await self._unnest_batch(conn, table, columns, batch, types, _deadline_timeout(timeout), print_)
+            finally:
+                semaphore.release()
+
+        count = 0
+        try:
+            batch = []
+            async for row in _aiter(rows):
+                batch.append(row)
+                if len(batch) == batch_size:
+                    await semaphore.acquire()
+                    _raise_failed(tasks)
+                    tasks.add(asyncio.ensure_future(send(batch)))
+                    count += len(batch)
+                    batch = []
+            if batch:
+                await semaphore.acquire()
+                _raise_failed(tasks)
+                tasks.add(asyncio.ensure_future(send(batch)))
+                count += len(batch)
+        finally:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        for r in results:
+            if isinstance(r, BaseException):
+                raise r
+        return count
+
+    async def bulk_load_b(
+        self,
+        table: str,
+        columns,
+        source,
+        prepare=None,
+        *,
+        chunk_size: int = 10_000,
+        executor=None,
+        max_in_flight: int = 4,
+        ordered=False,
+        progress=None,
+        timeout: float = None,
+        priority=None,
+        tag=None,
+    ):
+        """
+        Load rows into a table using ``COPY``, with rows prepared in worker processes.
+
+        ``source`` is an iterable of objects split into chunks of ``chunk_size``, each chunk is sent to
+        ``executor`` (by default a new ``ProcessPoolExecutor``) where ``prepare`` converts each object to a row
+        tuple (if ``prepare`` is None objects should already be rows) and the rows are encoded as ``COPY`` data.
+        ``prepare`` and the source objects must be picklable. Chunks are copied using up to ``max_in_flight``
+        connections at once, or one connection in source order if ``ordered`` is true.
+
+        ``progress(rows, chunks)`` is called with running totals after each chunk is copied. Each chunk is committed
+        separately. Connections are acquired with ``priority`` and ``tag``, see ``limits()``. Returns the number of
+        rows loaded.
+        """
+        loop = asyncio.get_running_loop()
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor()
+        schema, _, table = table.rpartition('.')
+        columns = tuple(columns)
+        senders = 1 if ordered else max_in_flight
+        # chunks are prepared ahead of being copied, but only this far ahead so memory use is bounded
+        queue = asyncio.Queue(maxsize=senders * 2)
+        totals = [0, 0]
+
+        async def produce():
+            for chunk in _chunked(source, chunk_size):
+                await queue.put(loop.run_in_executor(executor, prepare_copy_chunk, prepare, chunk))
+            for _ in range(senders):
+                await queue.put(None)
+
+        async def send():
+            while True:
+                prepared = await queue.get()
+                if prepared is None:
+                    return
+                data, count = await prepared
+                async with self._connection(priority, tag) as conn:
+                    await conn.copy_to_table(
+                        table,
+                        source=BytesIO(data),
+                        columns=columns,
+                        schema_name=schema or None,
+                        format='text',
+                        timeout=_deadline_timeout(timeout),
+                    )
+                totals[0] += count
+                totals[1] += 1
+                if progress:
+                    progress(*totals)
+
+        tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(send()) for _ in range(senders)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            await _cancel_pipeline(tasks, queue)
+            raise
+        finally:
+            if own_executor:
+                await loop.run_in_executor(None, executor.shutdown)
+        return totals[0]
+
+    @staticmethod
+    async def _copy_batch(conn, table, columns, batch, timeout):
+        schema, _, table = table.rpartition('.')
+        await conn.copy_records_to_table(
+            table, records=batch, columns=columns, schema_name=schema or None, timeout=timeout
+        )
+
+    async def _unnest_batch(self, conn, table, columns, batch, types, timeout, print_):
+        values = UnnestValues.from_columns(types=types, **{c: list(v) for c, v in zip(columns, zip(*batch))})
+        query, args = self.renderer(
+            'INSERT INTO :table (:values__names) SELECT * FROM :values', table=Var(table), values=values
+        )
+        self._print_query(print_, query, args)
+        await self._run_b(conn.execute, query, args, timeout)
 
 
 def create_pool_b(
@@ -99,6 +1080,8 @@ def create_pool_b(
     loop=None,
     connection_class=BuildPgConnection,
     record_class=Record,
+    autoscaler=None,
+    tag_limits=None,
     **connect_kwargs,
 ):
     """
@@ -109,7 +1092,7 @@ def create_pool_b(
     Identical to ``asyncpg.create_pool`` except that both the pool and connection have the *_b varients of
     ``execute``, ``fetch``, ``fetchval``, ``fetchrow`` etc
 
-    Arguments are exactly the same as ``asyncpg.create_pool``.
+    Arguments are the same as ``asyncpg.create_pool`` plus ``autoscaler`` and ``tag_limits``, see BuildPgPool.
     """
     return BuildPgPool(
         dsn,
@@ -122,5 +1105,7 @@ def create_pool_b(
         init=init,
         max_inactive_connection_lifetime=max_inactive_connection_lifetime,
         record_class=record_class,
+        autoscaler=autoscaler,
+        tag_limits=tag_limits,
         **connect_kwargs,
     )
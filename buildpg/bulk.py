@@ -0,0 +1,80 @@
+import math
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from uuid import UUID
+
+from .main import adapt_param
+
+__all__ = ('encode_copy_value', 'encode_copy_rows', 'prepare_copy_chunk')
+
+NULL = '\\N'
+_ESCAPES = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+
+def _float(v):
+    if math.isnan(v):
+        return 'NaN'
+    elif math.isinf(v):
+        return 'Infinity' if v > 0 else '-Infinity'
+    return repr(v)
+
+
+def _array_element(v):
+    if v is None:
+        return 'NULL'
+    s = _encode(v)
+    return '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _encode(v):
+    # bool must come before int since it's a subclass
+    if isinstance(v, str):
+        return v
+    elif isinstance(v, bool):
+        return 't' if v else 'f'
+    elif isinstance(v, (int, Decimal, UUID)):
+        return str(v)
+    elif isinstance(v, float):
+        return _float(v)
+    elif isinstance(v, (datetime, date, time)):
+        return v.isoformat()
+    elif isinstance(v, timedelta):
+        return f'{v.days} days {v.seconds} seconds {v.microseconds} microseconds'
+    elif isinstance(v, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(v).hex()
+    elif isinstance(v, (list, tuple)):
+        return '{' + ','.join(_array_element(e) for e in v) + '}'
+    adapted = adapt_param(v)
+    if adapted is not v:
+        # numpy scalars and arrays or array.array, converted to python values
+        return _encode(adapted)
+    raise TypeError(f'unable to encode {type(v).__name__} for COPY')
+
+
+def encode_copy_value(v) -> str:
+    """
+    Encode a value for COPY's text format, one dimensional lists and tuples are encoded as arrays. numpy values
+    and ``array.array`` are converted with ``adapt_param``.
+    """
+    if v is None:
+        return NULL
+    return _encode(v).translate(_ESCAPES)
+
+
+def encode_copy_rows(rows) -> bytes:
+    """
+    Encode an iterable of row tuples as COPY text format data.
+    """
+    lines = ['\t'.join([encode_copy_value(v) for v in row]) for row in rows]
+    lines.append('')
+    return '\n'.join(lines).encode()
+
+
+def prepare_copy_chunk(prepare, chunk):
+    """
+    Convert a chunk of source objects to rows using ``prepare`` (or use them as rows if it's None) and encode them,
+    returns ``(data, row_count)``. Run in worker processes by ``bulk_load_b``, this module doesn't import asyncpg
+    so is cheap to import in workers.
+    """
+    rows = chunk if prepare is None else [prepare(item) for item in chunk]
+    return encode_copy_rows(rows), len(rows)
@@ -1,19 +1,35 @@
+import re
+from copy import copy
+
 from . import funcs, logic
-from .components import Component, RawDangerous, yield_sep
+from .components import (
+    Component,
+    RawDangerous,
+    SetValues,
+    UnnestValues,
+    Values,
+    check_type,
+    check_word,
+    check_word_many,
+    yield_sep,
+)
 
 
 class Clauses(Component):
     __slots__ = 'clauses'
 
     def __init__(self, *clauses):
-        self.clauses = list(clauses)
+        self.clauses = clauses
 
     def render(self):
         yield from yield_sep(self.clauses, sep=RawDangerous('\n'))
 
     def __add__(self, other):
-        self.clauses.append(other)
-        return self
+        # return new Clauses so a base query can be extended without modifying it
+        return Clauses(*self.clauses, other)
+
+    def simplify(self):
+        return Clauses(*(logic.simplify(c) for c in self.clauses))
 
 
 class Clause(Component):
@@ -30,6 +46,14 @@ class Clause(Component):
     def __add__(self, other):
         return Clauses(self, other)
 
+    def simplify(self):
+        simplified = logic.simplify(self.logic)
+        if simplified is self.logic:
+            return self
+        clause = copy(self)
+        clause.logic = simplified
+        return clause
+
 
 def component_or_var(v):
     return v if isinstance(v, Component) else logic.Var(v)
@@ -99,3 +123,353 @@ class Offset(Clause):
 
     def __init__(self, offset_value):
         super().__init__(offset_value)
+
+
+class Returning(CommaClause):
+    base = 'RETURNING'
+
+
+class OnConflict(Clause):
+    """
+    ``ON CONFLICT`` for ``INSERT`` statements, ``target`` are the conflict columns.
+
+    ``update`` may be a list of column names to update from ``EXCLUDED``, a SetValues instance, or None
+    to ``DO NOTHING``.
+    """
+
+    __slots__ = 'update', 'where'
+    base = 'ON CONFLICT'
+
+    def __init__(self, *target, update=None, where=None):
+        if update is not None and not target:
+            raise ValueError('a conflict target is required with "update"')
+        super().__init__(funcs.comma_sep(*[component_or_var(f) for f in target]) if target else None)
+        if update is not None and not isinstance(update, SetValues):
+            check_word_many(update)
+            update = RawDangerous(', '.join(f'{c} = EXCLUDED.{c}' for c in update))
+        self.update = update
+        self.where = where
+
+    def render(self):
+        if self.logic is None:
+            yield RawDangerous(self.base)
+        else:
+            yield RawDangerous(self.base + ' (')
+            yield self.logic
+            yield RawDangerous(')')
+        if self.update is None:
+            yield RawDangerous(' DO NOTHING')
+        else:
+            yield RawDangerous(' DO UPDATE SET ')
+            yield self.update
+            if self.where is not None:
+                yield RawDangerous(' WHERE ')
+                yield self.where
+
+
+class Merge(Clause):
+    """
+    ``MERGE INTO <target> USING <source> ON <on>``, follow it with ``WhenMatched`` and ``WhenNotMatched`` clauses.
+    """
+
+    __slots__ = 'using', 'on'
+    base = 'MERGE INTO'
+
+    def __init__(self, target, using, on):
+        super().__init__(logic.as_var(target))
+        self.using = component_or_var(using)
+        self.on = on
+
+    def render(self):
+        yield from super().render()
+        yield RawDangerous(' USING ')
+        yield self.using
+        yield RawDangerous(' ON ')
+        yield self.on
+
+
+class _When(Clause):
+    __slots__ = ('condition',)
+    actions = NotImplemented
+
+    def __init__(self, then, condition=None):
+        if isinstance(then, str):
+            if then not in self.actions:
+                raise ValueError(f'"then" must be one of {", ".join(self.actions)} or a component')
+            then = RawDangerous(then)
+        super().__init__(then)
+        self.condition = condition
+
+    def render(self):
+        yield RawDangerous(self.base)
+        if self.condition is not None:
+            yield RawDangerous(' AND ')
+            yield self.condition
+        yield RawDangerous(' THEN ')
+        yield from self.render_action()
+
+    def render_action(self):
+        yield self.logic
+
+
+class WhenMatched(_When):
+    """
+    ``WHEN MATCHED [AND <condition>] THEN ...`` for ``Merge``, ``then`` may be a SetValues instance,
+    "DELETE" or "DO NOTHING".
+    """
+
+    base = 'WHEN MATCHED'
+    actions = 'DELETE', 'DO NOTHING'
+
+    def render_action(self):
+        if isinstance(self.logic, SetValues):
+            yield RawDangerous('UPDATE SET ')
+        yield self.logic
+
+
+class WhenNotMatched(_When):
+    """
+    ``WHEN NOT MATCHED [AND <condition>] THEN ...`` for ``Merge``, ``then`` may be a named Values instance or
+    "DO NOTHING".
+    """
+
+    base = 'WHEN NOT MATCHED'
+    actions = ('DO NOTHING',)
+
+    def render_action(self):
+        if isinstance(self.logic, Values):
+            yield RawDangerous('INSERT (')
+            yield from self.logic.render_names()
+            yield RawDangerous(') VALUES ')
+        yield self.logic
+
+
+class _Rendered(Component):
+    """
+    A statement already rendered to ``(sql, params)``, the ``$n`` placeholders are replaced with the values
+    they refer to so they're numbered again when this component is rendered. ``$n`` inside string literals,
+    quoted identifiers, dollar-quoted strings and comments is left alone.
+    """
+
+    __slots__ = 'sql', 'params'
+    # quoted regions and comments are matched (with group 2 empty) so they're skipped
+    param_regex = re.compile(
+        r"""(?:[Ee]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|"(?:[^"]|"")*"|\$((?:[A-Za-z_]\w*)?)\$.*?\$\1\$"""
+        r'|--[^\n]*|/\*.*?\*/)|\$(\d+)',
+        flags=re.S,
+    )
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+
+    def render(self):
+        pos = 0
+        for m in self.param_regex.finditer(self.sql):
+            if m.group(2) is None:
+                continue
+            start, end = m.span()
+            yield RawDangerous(self.sql[pos:start])
+            index = int(m.group(2))
+            if not 0 < index <= len(self.params):
+                raise ValueError(f'parameter "${index}" not found in rendered statement params')
+            yield self.params[index - 1]
+            pos = end
+        yield RawDangerous(self.sql[pos:])
+
+
+def _as_statement(v):
+    if isinstance(v, Component):
+        return v
+    elif isinstance(v, tuple) and len(v) == 2:
+        return _Rendered(*v)
+    else:
+        raise TypeError('statements must be components or (sql, params) tuples as returned by render()')
+
+
+class With(Component):
+    """
+    Combine several statements into one using common table expressions, so dependent inserts or updates
+    can be run in one round trip::
+
+        With(
+            render('SELECT * FROM new_items'),
+            new_order=render('INSERT INTO orders (customer) VALUES (:c) RETURNING id', c=123),
+            new_items=render(
+                'INSERT INTO items (order_id, sku) SELECT id, :sku FROM new_order RETURNING *', sku='xyz'
+            ),
+        )
+
+    The main statement and common table expressions may be components or ``(sql, params)`` tuples returned
+    by ``render()``, parameters from each rendered statement are renumbered when the ``With`` is rendered.
+    """
+
+    __slots__ = 'body', 'ctes'
+
+    def __init__(self, body, **ctes):
+        if not ctes:
+            raise ValueError('at least one common table expression is required')
+        check_word_many(ctes)
+        self.body = _as_statement(body)
+        self.ctes = [(name, _as_statement(v)) for name, v in ctes.items()]
+
+    def render(self):
+        for i, (name, statement) in enumerate(self.ctes):
+            yield RawDangerous(f'{", " if i else "WITH "}{name} AS (')
+            yield statement
+            yield RawDangerous(')')
+        yield RawDangerous('\n')
+        yield self.body
+
+
+class UpdateFrom(Component):
+    """
+    Update many rows, each with different values, in one statement, e.g.::
+
+        UPDATE users SET name = v.name FROM (VALUES ($1, $2), ($3, $4)) AS v (id, name) WHERE users.id = v.id
+
+    ``values`` may be MultipleValues or UnnestValues, with UnnestValues the values are sent as one array per column
+    and the query doesn't depend on the number of rows. ``types`` can be used to set the types of MultipleValues
+    columns (they're applied to the first row), otherwise postgres will assume they're text.
+
+    Use ``chunks()`` to split large updates into several statements.
+    """
+
+    __slots__ = 'table', 'values', 'key', 'alias', 'types'
+
+    def __init__(self, table, values, *, key='id', alias='v', types=None):
+        check_word(table)
+        check_word(alias)
+        self.key = (key,) if isinstance(key, str) else tuple(key)
+        check_word_many(self.key)
+        if not values.names:
+            raise ValueError('UpdateFrom requires named values')
+        missing = [k for k in self.key if k not in values.names]
+        if missing:
+            raise ValueError(f'key columns missing from values: {missing}')
+        if all(n in self.key for n in values.names):
+            raise ValueError('UpdateFrom requires at least one column to update as well as the key columns')
+        self.types = types or {}
+        for t in self.types.values():
+            check_type(t)
+        self.table = table
+        self.values = values
+        self.alias = alias
+
+    def render(self):
+        names = self.values.names
+        alias = self.alias
+        yield RawDangerous(f'UPDATE {self.table} SET ')
+        yield RawDangerous(', '.join(f'{n} = {alias}.{n}' for n in names if n not in self.key))
+        yield RawDangerous(' FROM ')
+        if isinstance(self.values, UnnestValues):
+            yield self.values
+        else:
+            yield RawDangerous('(VALUES ')
+            yield from self._render_rows()
+            yield RawDangerous(')')
+        yield RawDangerous(f' AS {alias} ({", ".join(names)}) WHERE ')
+        yield RawDangerous(' AND '.join(f'{self.table}.{k} = {alias}.{k}' for k in self.key))
+
+    def _render_rows(self):
+        first, *rows = self.values.rows
+        yield RawDangerous('(')
+        for i, (name, value) in enumerate(zip(first.names, first.values)):
+            if i:
+                yield RawDangerous(', ')
+            yield value
+            type_ = self.types.get(name)
+            if type_:
+                yield RawDangerous(f'::{type_}')
+        yield RawDangerous(')')
+        for row in rows:
+            yield RawDangerous(', ')
+            yield row
+
+    def chunks(self, size):
+        for values in self.values.chunks(size):
+            yield UpdateFrom(self.table, values, key=self.key, alias=self.alias, types=self.types)
+
+
+class _Row(Component):
+    __slots__ = ('items',)
+
+    def __init__(self, items):
+        self.items = items
+
+    def render(self):
+        yield RawDangerous('(')
+        yield from yield_sep(self.items)
+        yield RawDangerous(')')
+
+
+_DIRECTION_OPS = {logic.Operator.asc, logic.Operator.desc, logic.Operator.nulls_first, logic.Operator.nulls_last}
+
+
+def order_by_terms(order_by):
+    """
+    Split an OrderBy clause into (expression, descending, nulls_first, nulls_explicit) tuples, nulls_first
+    defaults to postgres's behaviour of nulls sorting as larger than any other value.
+    """
+    for item in order_by.logic.items:
+        descending = False
+        nulls_first = None
+        while isinstance(item, logic.SqlBlock) and item.op in _DIRECTION_OPS:
+            if item.op == logic.Operator.desc:
+                descending = True
+            elif item.op == logic.Operator.nulls_first:
+                nulls_first = True
+            elif item.op == logic.Operator.nulls_last:
+                nulls_first = False
+            item = logic.as_sql_block(item.v1)
+        yield item, descending, descending if nulls_first is None else nulls_first, nulls_first is not None
+
+
+def keyset(order_by, last=None):
+    """
+    Build the condition for keyset (aka seek) pagination: rows which come after ``last`` when sorted by ``order_by``.
+
+    ``last`` should be the values of the ``order_by`` columns from the last row of the previous page, or None for
+    the first page. Where all columns are sorted in the same direction a row comparison is used, e.g.
+    ``(a, b) > ($1, $2)``, so postgres can use a multicolumn index, the row comparison assumes the columns are
+    ``NOT NULL``. Otherwise, or if ``nulls_first`` or ``nulls_last`` are used or a value in ``last`` is null, the
+    comparison is expanded to take nulls into account, with postgres's default of nulls sorting last with ``ASC``
+    and first with ``DESC`` - give ``nulls_first`` or ``nulls_last`` to paginate nullable columns sorted in one
+    direction.
+    """
+    if not isinstance(order_by, OrderBy):
+        order_by = OrderBy(*order_by)
+    terms = list(order_by_terms(order_by))
+    if last is None:
+        return logic.SqlBlock(RawDangerous('TRUE'))
+    last = list(last)
+    if len(last) != len(terms):
+        raise ValueError(f'{len(terms)} values required for keyset, got {len(last)}')
+
+    if len({t[1] for t in terms}) == 1 and not any(t[3] for t in terms) and all(v is not None for v in last):
+        row = logic.SqlBlock(_Row([t[0] for t in terms]))
+        return row < _Row(last) if terms[0][1] else row > _Row(last)
+
+    options = []
+    equal = []
+    for (expr, descending, nulls_first, _), value in zip(terms, last):
+        # expressions are wrapped in new blocks so the OrderBy isn't modified
+        if value is None:
+            after = logic.SqlBlock(expr).is_not(RawDangerous('NULL')) if nulls_first else None
+            same = logic.SqlBlock(expr).is_(RawDangerous('NULL'))
+        else:
+            after = logic.SqlBlock(expr) < value if descending else logic.SqlBlock(expr) > value
+            if not nulls_first:
+                after |= logic.SqlBlock(expr).is_(RawDangerous('NULL'))
+            same = logic.SqlBlock(expr) == value
+        if after is not None:
+            options.append(funcs.AND(*equal, after) if equal else after)
+        equal.append(same)
+    if not options:
+        return logic.SqlBlock(RawDangerous('FALSE'))
+    return funcs.OR(*options)
+
+
+class Keyset(Where):
+    def __init__(self, order_by, last=None):
+        super().__init__(keyset(order_by, last))
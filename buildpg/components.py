@@ -1,4 +1,9 @@
 import re
+from array import array
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from operator import index
+from uuid import UUID
 
 __all__ = (
     'check_word',
@@ -11,11 +16,15 @@ __all__ = (
     'Component',
     'Values',
     'MultipleValues',
+    'UnnestValues',
     'SetValues',
     'JoinComponent',
+    'Typed',
+    'infer_type',
 )
 
 NOT_WORD = re.compile(r'[^\w.*]', flags=re.A)
+TYPE_NAME = re.compile(r'^[a-z_][\w.]*(?: [a-z_]\w*)*(?:\(\d+(?:, ?\d+)?\))?(?:\[\])*$', flags=re.A | re.I)
 
 
 def check_word(s):
@@ -25,6 +34,13 @@ def check_word(s):
         raise UnsafeError(f'str contain unsafe (non word) characters: "{s}"')
 
 
+def check_type(s):
+    if not isinstance(s, str):
+        raise TypeError('type is not a string')
+    if not TYPE_NAME.match(s):
+        raise UnsafeError(f'invalid type name: "{s}"')
+
+
 def check_word_many(args):
     if any(not isinstance(a, str) or NOT_WORD.search(a) for a in args):
         unsafe = [a for a in args if not isinstance(a, str) or NOT_WORD.search(a)]
@@ -107,6 +123,13 @@ class Values(Component):
         yield RawDangerous(', '.join(self.names))
 
 
+def _chunk_size(size):
+    size = index(size)
+    if size < 1:
+        raise ValueError('chunk size must be at least 1')
+    return size
+
+
 class MultipleValues(Component):
     __slots__ = 'values', 'names'
 
@@ -128,6 +151,88 @@ class MultipleValues(Component):
     def render(self):
         yield from yield_sep(self.rows)
 
+    def chunks(self, size):
+        # size is read for each chunk so it may change between chunks, e.g. with AdaptiveBatchSize
+        start = 0
+        while start < len(self.rows):
+            end = start + _chunk_size(size)
+            yield MultipleValues(*self.rows[start:end])
+            start = end
+
+
+class UnnestValues(Component):
+    """
+    Rows of values sent as one array parameter per column and expanded with ``unnest()``, e.g.
+    ``unnest($1::int[], $2::text[])``. Unlike MultipleValues the query and number of parameters don't depend on the
+    number of rows.
+
+    ``types`` is a dict of postgres types for each column, they're required since arrays of unknown type can't be
+    used.
+    """
+
+    __slots__ = 'names', 'columns', 'types'
+
+    def __init__(self, *args, types=None):
+        if not args:
+            raise ValueError('UnnestValues requires at least one row')
+        first = args[0]
+        if not first.names:
+            raise ValueError('UnnestValues requires named Values')
+        for r in args[1:]:
+            if not isinstance(r, Values):
+                raise ValueError('either all or no arguments should be Values()')
+            if r.names != first.names:
+                raise ValueError(f'names of different rows do not match {r.names} != {first.names}')
+        self._init(first.names, [list(c) for c in zip(*(r.values for r in args))], types)
+
+    @classmethod
+    def from_columns(cls, *, types=None, **columns):
+        """
+        Create UnnestValues directly from columns of values, e.g. ``from_columns(id=[1, 2], name=['a', 'b'])``.
+        """
+        self = cls.__new__(cls)
+        check_word_many(columns)
+        names, columns = zip(*columns.items())
+        if len({len(c) for c in columns}) != 1:
+            raise ValueError('all columns must be the same length')
+        self._init(names, columns, types)
+        return self
+
+    def _init(self, names, columns, types):
+        self.names = names
+        self.columns = columns
+        if types is None:
+            raise ValueError('UnnestValues requires types, a dict of the postgres type of each column')
+        missing = [n for n in names if n not in types]
+        if missing:
+            raise ValueError(f'types missing for columns: {missing}')
+        self.types = [types[n] for n in names]
+        for t in self.types:
+            check_type(t)
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def render(self):
+        yield RawDangerous('unnest(')
+        for i, (column, type_) in enumerate(zip(self.columns, self.types)):
+            if i:
+                yield RawDangerous(', ')
+            yield column
+            yield RawDangerous(f'::{type_}[]')
+        yield RawDangerous(')')
+
+    def render_names(self):
+        yield RawDangerous(', '.join(self.names))
+
+    def chunks(self, size):
+        types = dict(zip(self.names, self.types))
+        start = 0
+        while start < len(self):
+            end = start + _chunk_size(size)
+            yield UnnestValues.from_columns(types=types, **{n: c[start:end] for n, c in zip(self.names, self.columns)})
+            start = end
+
 
 class SetValues(Component):
     __slots__ = ('kwargs',)
@@ -158,3 +263,79 @@ class JoinComponent(Component):
 
     def render(self):
         yield from yield_sep(self.items, self.sep)
+
+
+class Typed(Component):
+    """
+    A parameter with an explicit postgres type, rendered as ``$1::<type>``, e.g. ``Typed(value, 'uuid')``
+    or ``Typed([1, 2, 3], 'int8[]')``.
+    """
+
+    __slots__ = 'value', 'type'
+
+    def __init__(self, value, type_):
+        check_type(type_)
+        self.value = value
+        self.type = type_
+
+    def render(self):
+        yield self.value
+        yield RawDangerous('::' + self.type)
+
+
+# postgres types for python types, used by infer_type, order matters since bool is a subclass of int and
+# datetime a subclass of date. str is deliberately missing, strings are used for json, enums, dates etc. so
+# casting them to text would break those columns
+PG_TYPES = (
+    (bool, 'bool'),
+    (int, 'int8'),
+    (float, 'float8'),
+    (Decimal, 'numeric'),
+    (bytes, 'bytea'),
+    (UUID, 'uuid'),
+    (datetime, 'timestamp'),
+    (date, 'date'),
+    (time, 'time'),
+    (timedelta, 'interval'),
+)
+# postgres types for numpy dtype kinds, itemsize is used to distinguish float4 and float8
+NUMPY_KIND_TYPES = {'b': 'bool', 'i': 'int8', 'u': 'int8', 'f': 'float8'}
+
+
+def _infer_buffer_type(v):
+    if isinstance(v, array):
+        if v.typecode in 'fd':
+            return 'float4[]' if v.typecode == 'f' else 'float8[]'
+        return 'int8[]' if v.typecode != 'u' else None
+    # numpy array or scalar
+    kind = v.dtype.kind
+    pg_type = 'float4' if kind == 'f' and v.dtype.itemsize == 4 else NUMPY_KIND_TYPES.get(kind)
+    if pg_type and v.ndim:
+        return pg_type + '[]'
+    return pg_type
+
+
+def infer_type(v):
+    """
+    Find the postgres type for a python value, or None if it can't be inferred.
+
+    Integers are always int8 so the query doesn't depend on their value, strings aren't typed since they're also
+    used for json, enums, dates etc. - use ``Typed`` for those. Lists and tuples are arrays of the type of their
+    first non-null value, the types of ``array.array`` and numpy arrays come from their typecode or dtype.
+    """
+    if isinstance(v, array) or type(v).__module__ == 'numpy':
+        return _infer_buffer_type(v)
+    elif isinstance(v, (list, tuple)):
+        item_type = next((infer_type(i) for i in v if i is not None), None)
+        if item_type is None:
+            return None
+        if item_type.endswith('[]'):
+            # multidimensional arrays have the same type as one-dimensional arrays
+            return item_type
+        return item_type + '[]'
+    for type_, pg_type in PG_TYPES:
+        if isinstance(v, type_):
+            if type_ in (datetime, time) and v.tzinfo is not None:
+                return pg_type + 'tz'
+            return pg_type
+    return None
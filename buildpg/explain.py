@@ -0,0 +1,139 @@
+import inspect
+import json
+import logging
+import random
+from collections import Counter
+
+__all__ = ('PlanNode', 'PlanSummary', 'PlanSampler')
+
+logger = logging.getLogger('buildpg.explain')
+
+
+class PlanNode:
+    """
+    One node from a query plan, ``actual_rows`` and ``loops`` are only set if the plan was generated with ANALYZE.
+    """
+
+    __slots__ = 'node_type', 'relation', 'depth', 'total_cost', 'estimated_rows', 'actual_rows', 'loops'
+
+    def __init__(self, node: dict, depth: int):
+        self.node_type = node['Node Type']
+        self.relation = node.get('Relation Name')
+        self.depth = depth
+        self.total_cost = node.get('Total Cost')
+        self.estimated_rows = node.get('Plan Rows')
+        self.actual_rows = node.get('Actual Rows')
+        self.loops = node.get('Actual Loops')
+
+    @property
+    def misestimate(self):
+        """
+        Ratio of actual to estimated rows (always >= 1), or None if the plan wasn't analyzed.
+        """
+        if self.actual_rows is None or not self.loops:
+            return None
+        # both are per loop, avoid dividing by zero since postgres estimates at least 1 row but may find none
+        estimated, actual = max(self.estimated_rows, 1), max(self.actual_rows, 1)
+        return max(estimated / actual, actual / estimated)
+
+    def __repr__(self):
+        rel = f' on {self.relation}' if self.relation else ''
+        actual = '' if self.actual_rows is None else f' actual_rows={self.actual_rows}'
+        return f'<PlanNode {self.node_type}{rel} estimated_rows={self.estimated_rows}{actual}>'
+
+
+class PlanSummary:
+    """
+    Summary of the output of ``EXPLAIN (FORMAT JSON)``, the full plan is available as ``plan``.
+    """
+
+    __slots__ = 'plan', 'nodes', 'planning_time', 'execution_time'
+
+    def __init__(self, explain_output):
+        if isinstance(explain_output, (str, bytes)):
+            explain_output = json.loads(explain_output)
+        if isinstance(explain_output, list):
+            explain_output = explain_output[0]
+        self.plan = explain_output['Plan']
+        self.planning_time = explain_output.get('Planning Time')
+        self.execution_time = explain_output.get('Execution Time')
+        self.nodes = []
+        self._walk(self.plan, 0)
+
+    def _walk(self, node, depth):
+        self.nodes.append(PlanNode(node, depth))
+        for child in node.get('Plans', ()):
+            self._walk(child, depth + 1)
+
+    @property
+    def root(self) -> PlanNode:
+        return self.nodes[0]
+
+    @property
+    def total_cost(self):
+        return self.root.total_cost
+
+    @property
+    def estimated_rows(self):
+        return self.root.estimated_rows
+
+    @property
+    def actual_rows(self):
+        return self.root.actual_rows
+
+    @property
+    def analyzed(self):
+        return self.root.actual_rows is not None
+
+    @property
+    def node_types(self) -> Counter:
+        return Counter(n.node_type for n in self.nodes)
+
+    @property
+    def seq_scans(self):
+        """
+        Names of relations read by sequential scans.
+        """
+        return [n.relation for n in self.nodes if n.node_type == 'Seq Scan']
+
+    def misestimates(self, factor=10):
+        """
+        Nodes where actual and estimated rows differ by more than ``factor``, empty if the plan wasn't analyzed.
+        """
+        return [n for n in self.nodes if n.misestimate is not None and n.misestimate > factor]
+
+    def __repr__(self):
+        return f'<PlanSummary total_cost={self.total_cost} nodes={len(self.nodes)} seq_scans={self.seq_scans}>'
+
+
+class PlanSampler:
+    """
+    Capture query plans for slow queries, set as ``plan_sampler`` on a connection or pool from ``buildpg.asyncpg``.
+
+    When ``execute_b``, ``fetch_b``, ``fetchval_b`` or ``fetchrow_b`` take at least ``threshold`` seconds the query
+    is explained with the same parameters and ``callback(query, args, duration, summary)`` is called, the callback
+    may be a coroutine function. ``sample_rate`` limits the proportion of slow queries explained.
+
+    The plan is generated after the query completes and before the *_b method returns, so it adds latency to slow
+    queries, with ``analyze=True`` the query is run a second time (in a transaction which is rolled back).
+    """
+
+    __slots__ = 'callback', 'threshold', 'sample_rate', 'analyze', 'buffers'
+
+    def __init__(self, callback, *, threshold: float = 1.0, sample_rate: float = 1.0, analyze=False, buffers=False):
+        self.callback = callback
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.analyze = analyze
+        self.buffers = buffers
+
+    def should_sample(self, duration: float) -> bool:
+        return duration >= self.threshold and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    async def record(self, query, args, duration, summary):
+        try:
+            r = self.callback(query, args, duration, summary)
+            if inspect.isawaitable(r):
+                await r
+        except Exception:
+            logger.exception('error in plan sampler callback')
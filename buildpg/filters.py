@@ -0,0 +1,115 @@
+from functools import lru_cache
+
+from .components import Component
+from .logic import as_var
+from .main import Template, render
+
+__all__ = ('FilterError', 'FilterSet', 'LOOKUPS')
+
+
+class FilterError(ValueError):
+    pass
+
+
+def _like_prefix(v):
+    return v.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _as_list(v):
+    return v if isinstance(v, list) else list(v)
+
+
+# lookup name: (SQL with "{c}" for the column and "{p}" for the parameter, function to prepare the value)
+LOOKUPS = {
+    'eq': ('{c} = {p}', None),
+    'ne': ('{c} != {p}', None),
+    'lt': ('{c} < {p}', None),
+    'lte': ('{c} <= {p}', None),
+    'gt': ('{c} > {p}', None),
+    'gte': ('{c} >= {p}', None),
+    'in': ('{c} = any({p})', _as_list),
+    'not_in': ('{c} != all({p})', _as_list),
+    'like': ('{c} LIKE {p}', None),
+    'ilike': ('{c} ILIKE {p}', None),
+    'startswith': ('{c} LIKE {p}', _like_prefix),
+    'contains': ('{c} @> {p}', None),
+    'overlap': ('{c} && {p}', None),
+    # the SQL depends on the value, so the value is part of the key for cached plans
+    'isnull': (None, None),
+}
+
+
+class FilterSet:
+    """
+    Compile dicts of filters such as ``{'created__gte': ..., 'status__in': [...]}`` into a Template, for use as
+    a ``WHERE`` condition.
+
+    ``fields`` maps filter names to columns, e.g. ``{'created': 'u.created'}``, or is a list of names which are
+    used as columns. Keys are ``<field>`` or ``<field>__<lookup>`` where lookup is one of ``LOOKUPS``, filters are
+    combined with ``AND``. ``lookups`` restricts the lookups which may be used.
+
+    The SQL for each combination of filter keys is built once and cached, so filters with the same keys render
+    the same query with only parameter values changing. ``__in`` and ``__not_in`` take a single array parameter
+    however many values are given.
+    """
+
+    __slots__ = 'columns', 'lookups', 'sep', '_compile'
+
+    def __init__(self, fields, *, lookups=None, sep='__', cache_size=256):
+        if not isinstance(fields, dict):
+            fields = {f: f for f in fields}
+        self.columns = {name: self._render_column(column) for name, column in fields.items()}
+        self.lookups = set(LOOKUPS if lookups is None else lookups)
+        unknown = self.lookups - LOOKUPS.keys()
+        if unknown:
+            raise FilterError(f'unknown lookups: {", ".join(sorted(unknown))}')
+        self.sep = sep
+        self._compile = lru_cache(maxsize=cache_size)(self.compile)
+
+    @staticmethod
+    def _render_column(column):
+        if not isinstance(column, Component):
+            column = as_var(column)
+        sql, params = render(':c', c=column)
+        if params:
+            raise FilterError(f'filter columns may not contain parameters: "{sql}"')
+        return sql
+
+    def _split_key(self, key):
+        field, sep, lookup = key.partition(self.sep)
+        if not sep:
+            lookup = 'eq'
+        try:
+            column = self.columns[field]
+        except KeyError:
+            raise FilterError(f'unknown filter field "{field}"') from None
+        if lookup not in self.lookups:
+            raise FilterError(f'invalid lookup "{lookup}" for "{field}"')
+        return column, lookup
+
+    def compile(self, plan_key):
+        """
+        Build the template and value preparation functions for a plan key as generated by ``__call__``,
+        prefer calling the FilterSet which caches compiled plans.
+        """
+        conditions = []
+        prepare = []
+        for key, isnull in plan_key:
+            column, lookup = self._split_key(key)
+            if lookup == 'isnull':
+                conditions.append(f'{column} IS NULL' if isnull else f'{column} IS NOT NULL')
+                continue
+            sql, prepare_value = LOOKUPS[lookup]
+            conditions.append(sql.format(c=column, p=f':v{len(prepare)}'))
+            prepare.append((key, prepare_value))
+        return ' AND '.join(conditions) or 'TRUE', tuple(prepare)
+
+    def __call__(self, filters: dict) -> Template:
+        isnull = self.sep + 'isnull'
+        plan_key = tuple(sorted((k, bool(v) if k.endswith(isnull) else None) for k, v in filters.items()))
+        template, prepare = self._compile(plan_key)
+        ctx = {}
+        for i, (key, prepare_value) in enumerate(prepare):
+            v = filters[key]
+            ctx[f'v{i}'] = v if prepare_value is None else prepare_value(v)
+        return Template(template, **ctx)
@@ -1,9 +1,12 @@
+import copyreg
+from copy import copy
 from enum import Enum, unique
+from functools import lru_cache
 from typing import Union
 
 from .components import Component, JoinComponent, RawDangerous, VarLiteral, check_word, yield_sep
 
-__all__ = ('LogicError', 'SqlBlock', 'Func', 'Not', 'Var', 'S', 'V', 'select_fields', 'Empty')
+__all__ = ('LogicError', 'SqlBlock', 'Func', 'Not', 'Var', 'S', 'V', 'select_fields', 'Empty', 'simplify')
 
 
 class LogicError(RuntimeError):
@@ -100,6 +103,12 @@ PRECEDENCE = {
 }
 
 
+@lru_cache(maxsize=None)
+def _extra_slots(cls):
+    # slots of SqlBlock subclasses other than those SqlBlock.__copy__ copies directly
+    return tuple(n for n in copyreg._slotnames(cls) if n not in SqlBlock.__slots__)
+
+
 class SqlBlock(Component):
     __slots__ = 'v1', 'op', 'v2'
 
@@ -108,14 +117,32 @@ class SqlBlock(Component):
         self.op = op
         self.v2 = v2
 
+    def __copy__(self):
+        # faster than copy's generic reduce based copy, blocks are copied for every operator
+        cls = self.__class__
+        block = object.__new__(cls)
+        block.v1, block.op, block.v2 = self.v1, self.op, self.v2
+        for name in _extra_slots(cls):
+            try:
+                setattr(block, name, getattr(self, name))
+            except AttributeError:
+                pass
+        attrs = getattr(self, '__dict__', None)
+        if attrs:
+            block.__dict__.update(attrs)
+        return block
+
     def operate(self, op: Union[RawDangerous, Operator], v2=None):
         if self.op:
             # op already completed
             return SqlBlock(self, op=op, v2=v2)
         else:
-            self.op = op
-            self.v2 = v2
-            return self
+            # create a new block (sharing v1) rather than modifying this one, so expressions can be reused,
+            # copied so subclasses keep any other attributes
+            block = copy(self)
+            block.op = op
+            block.v2 = v2
+            return block
 
     def __and__(self, other):
         return self.operate(Operator.and_, other)
@@ -325,5 +352,111 @@ class Empty(SqlBlock):
         super().__init__(VarLiteral(''), op=op, v2=v2)
 
 
+def _is_empty(v):
+    while isinstance(v, SqlBlock) and v.op is None:
+        v = v.v1
+    return isinstance(v, RawDangerous) and v == ''
+
+
+def _constant(v):
+    """
+    True or False if v is a boolean constant, otherwise None.
+    """
+    while isinstance(v, SqlBlock) and v.op is None:
+        v = v.v1
+    if isinstance(v, bool):
+        return v
+    elif isinstance(v, RawDangerous) and v.upper() in ('TRUE', 'FALSE'):
+        return v.upper() == 'TRUE'
+
+
+def _is_not(v):
+    return isinstance(v, Func) and v.func.lower() == 'not' and len(v.v1) == 1
+
+
+def _as_constant(value: bool):
+    return SqlBlock(RawDangerous('TRUE' if value else 'FALSE'))
+
+
+def _bool_operands(v, op, operands):
+    if isinstance(v, SqlBlock) and not isinstance(v, Func) and v.op == op:
+        # v1 may be a raw string (e.g. for Var) which would render as a parameter on its own
+        _bool_operands(as_sql_block(v.v1), op, operands)
+        _bool_operands(v.v2, op, operands)
+    else:
+        operands.append(v)
+
+
+def _simplify_bool(v):
+    op = v.op
+    leaves = []
+    _bool_operands(v, op, leaves)
+    # TRUE makes an OR chain TRUE, FALSE makes an AND chain FALSE, the other constant has no effect
+    absorbing = op == Operator.or_
+    operands = []
+    dropped_constant = False
+    for leaf in leaves:
+        leaf = simplify(leaf)
+        if _is_empty(leaf):
+            continue
+        c = _constant(leaf)
+        if c is None:
+            # simplifying may have produced a chain with the same operator, e.g. from a double negation
+            _bool_operands(leaf, op, operands)
+        elif c is absorbing:
+            return _as_constant(c)
+        else:
+            dropped_constant = True
+
+    if not operands:
+        return _as_constant(not absorbing) if dropped_constant else Empty()
+    result = operands[0]
+    for operand in operands[1:]:
+        result = SqlBlock(result, op=op, v2=operand)
+    return result
+
+
+def simplify(v):
+    """
+    Return a simplified copy of a logic tree, the original is not modified:
+    * ``AND`` and ``OR`` chains are flattened, ``TRUE``/``FALSE`` constants folded and ``Empty()`` dropped
+    * double negation (``NOT(NOT(x))``) is removed and ``NOT`` of a constant folded
+    * single item JoinComponents are replaced by their item
+
+    Note that ``Empty() & x`` renders as `` AND x`` but simplifies to ``x``. Other values are returned unchanged.
+    """
+    if isinstance(v, Func):
+        args = tuple(simplify(a) for a in v.v1)
+        if v.func.lower() == 'not' and len(args) == 1:
+            c = _constant(args[0])
+            if c is not None:
+                return _as_constant(not c)
+            elif _is_not(args[0]):
+                return args[0].v1[0]
+        if all(a is b for a, b in zip(args, v.v1)):
+            return v
+        new = copy(v)
+        new.v1 = args
+        return new
+    elif isinstance(v, SqlBlock):
+        if v.op is None:
+            return v
+        elif v.op in (Operator.and_, Operator.or_):
+            return _simplify_bool(v)
+        v1, v2 = simplify(v.v1), simplify(v.v2)
+        if v1 is v.v1 and v2 is v.v2:
+            return v
+        new = copy(v)
+        new.v1, new.v2 = v1, v2
+        return new
+    elif isinstance(v, JoinComponent):
+        items = [simplify(item) for item in v.items]
+        return items[0] if len(items) == 1 else JoinComponent(items, v.sep)
+    elif isinstance(v, Component) and hasattr(v, 'simplify'):
+        return v.simplify()
+    else:
+        return v
+
+
 S = SqlBlock
 V = Var
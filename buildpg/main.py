@@ -1,71 +1,301 @@
+import math
 import re
-from functools import partial
+from array import array
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from uuid import UUID
 
-from .components import BuildError, Component, ComponentError, RawDangerous
+from .components import BuildError, Component, ComponentError, JoinComponent, RawDangerous, Typed, infer_type
+from .logic import SqlBlock, simplify
 
-__all__ = ('Renderer', 'render')
+__all__ = ('Renderer', 'Template', 'render', 'quote_literal')
+
+
+def adapt_param(v):
+    """
+    Convert numpy arrays, numpy scalars and ``array.array`` to python lists and values so they can be sent as
+    parameters, conversion is done in bulk by ``tolist()`` rather than element by element. numpy isn't imported.
+    """
+    module = type(v).__module__
+    if module != 'builtins' and (module == 'numpy' or isinstance(v, array)):
+        return v.tolist()
+    return v
+
+
+def _quote_str(s):
+    if '\x00' in s:
+        raise ValueError("strings containing null characters can't be used as literals")
+    # not str(s) which for a (str, Enum) member gives its name rather than its value
+    s = s.replace("'", "''")
+    if '\\' in s:
+        # an escape string literal so backslashes are treated the same whatever standard_conforming_strings is set to
+        return "E'" + s.replace('\\', '\\\\') + "'"
+    return "'" + s + "'"
+
+
+def _number(s):
+    # a leading space on negative numbers as psycopg2 does, otherwise "x -:a" with a=-1 would be "x --1", a comment
+    return ' ' + s if s.startswith('-') else s
+
+
+def _quote_float(v):
+    if math.isfinite(v):
+        return _number(repr(v))
+    return f"'{'NaN' if math.isnan(v) else ('-Infinity' if v < 0 else 'Infinity')}'::float8"
+
+
+def _quote_tz(v, type_):
+    return f"'{v.isoformat()}'::{type_ if v.tzinfo is None else type_ + 'tz'}"
+
+
+# functions to generate literals for supported types, order matters since bool is a subclass of int and
+# datetime a subclass of date
+LITERALS = (
+    (bool, lambda v: 'TRUE' if v else 'FALSE'),
+    (int, lambda v: _number(str(int(v)))),
+    (float, _quote_float),
+    (Decimal, lambda v: _number(str(v)) if v.is_finite() else f"'{v}'::numeric"),
+    (str, _quote_str),
+    ((bytes, bytearray, memoryview), lambda v: f"E'\\\\x{bytes(v).hex()}'::bytea"),
+    (UUID, lambda v: f"'{v}'::uuid"),
+    (datetime, lambda v: _quote_tz(v, 'timestamp')),
+    (date, lambda v: f"'{v.isoformat()}'::date"),
+    (time, lambda v: _quote_tz(v, 'time')),
+    (timedelta, lambda v: f"'{v.days} days {v.seconds} seconds {v.microseconds} microseconds'::interval"),
+)
+
+
+def quote_literal(v):
+    """
+    Convert a value to an escaped postgres literal, only None, lists, tuples and the types in LITERALS are
+    supported, anything else raises a TypeError.
+    """
+    v = adapt_param(v)
+    if v is None:
+        return 'NULL'
+    elif isinstance(v, (list, tuple)):
+        return 'ARRAY[' + ', '.join(quote_literal(i) for i in v) + ']' if v else "'{}'"
+    for type_, func in LITERALS:
+        if isinstance(v, type_):
+            return func(v)
+    raise TypeError(f'unable to use {type(v).__name__} as a literal')
+
+
+def _simplifies_children(v):
+    """
+    Whether ``simplify(v)`` simplifies the components ``v`` renders, so they needn't be simplified again.
+    """
+    return isinstance(v, JoinComponent) or (isinstance(v, SqlBlock) and v.op is not None) or hasattr(v, 'simplify')
+
+
+def _value_key(v):
+    """
+    Key used to find identical values when deduplicating parameters, None if the value shouldn't be deduplicated.
+
+    The type is included so values which are equal but would be sent differently (e.g. 1 and True) aren't merged.
+    """
+    if isinstance(v, (tuple, frozenset)):
+        # equality of items isn't type aware, e.g. (1,) == (True,)
+        return None
+    try:
+        hash(v)
+    except TypeError:
+        return None
+    if isinstance(v, (Decimal, datetime, time)):
+        # equal values may differ in precision or timezone
+        return type(v), str(v)
+    return type(v), v
 
 
 class Renderer:
-    __slots__ = 'regex', 'sep'
+    """
+    Render templates to a query and list of parameters.
+
+    By default parameters are only reused when the same variable is used more than once, with ``dedup_values=True``
+    identical hashable values are also sent as one parameter wherever they occur.
+
+    With ``typed=True`` parameters are rendered with a type cast inferred from their python type, e.g. ``$1::int4``,
+    see ``infer_type``. Use ``Typed`` to set the type of an individual parameter with or without ``typed=True``.
 
-    def __init__(self, regex=r'(?<!:):([a-z][a-z\d_]*)', sep='__'):
+    With ``inline_literals=True`` values are rendered into the query as escaped literals (see ``quote_literal``)
+    and the parameter list is always empty, this is for statements like ``COPY`` which can't take parameters,
+    prefer parameters wherever possible.
+
+    With ``simplify=True`` values are passed through ``simplify`` before rendering, including values in Templates
+    and components nested in other components.
+    """
+
+    __slots__ = 'regex', 'sep', 'dedup_values', 'typed', 'inline_literals', 'simplify', '_parse'
+
+    def __init__(
+        self,
+        regex=r'(?<!:):([a-z][a-z\d_]*)',
+        sep='__',
+        *,
+        dedup_values=False,
+        typed=False,
+        inline_literals=False,
+        simplify=False,
+    ):
         self.regex = re.compile(regex, flags=re.A)
         self.sep = sep
+        self.dedup_values = dedup_values
+        self.typed = typed
+        self.inline_literals = inline_literals
+        self.simplify = simplify
+        self._parse = lru_cache(maxsize=1024)(self.parse)
 
     def __call__(self, query_template, **ctx):
+        return self._render(query_template, ctx, self.dedup_values)
+
+    def _render(self, query_template, ctx, dedup_values):
         params = []
+        if self.inline_literals:
+            add_param = self._add_literal
+        else:
+            add_param = self._param_adder(params, dedup_values)
+
+        query = ''.join(
+            s if isinstance(s, str) else self.render_var(*s, ctx=ctx, add_param=add_param)
+            for s in self._parse(query_template)
+        )
+        return query, params
+
+    def _param_adder(self, params, dedup_values):
         existing_params = {}
+        if not (dedup_values or self.typed):
+            # the default, kept as simple as possible since it's called for every parameter
+            def add_plain_param(p, *var_parts, type_=None):
+                try:
+                    index = existing_params[var_parts]
+                except KeyError:
+                    params.append(adapt_param(p))
+                    index = len(params)
+                    existing_params[var_parts] = index
+                return f'${index}::{type_}' if type_ else f'${index}'
 
-        def add_param(p, *var_parts):
+            return add_plain_param
+
+        existing_values = {} if dedup_values else None
+        typed = self.typed
+
+        def add_param(p, *var_parts, type_=None):
+            if typed and type_ is None:
+                type_ = infer_type(p)
             try:
                 index = existing_params[var_parts]
             except KeyError:
-                params.append(p)
-                index = len(params)
+                p = adapt_param(p)
+                value_key = None if existing_values is None else _value_key(p)
+                if value_key is not None:
+                    # a cast changes how postgres types the parameter, so values with different casts aren't merged
+                    value_key = type_, value_key
+                index = None if value_key is None else existing_values.get(value_key)
+                if index is None:
+                    params.append(p)
+                    index = len(params)
+                    if value_key is not None:
+                        existing_values[value_key] = index
                 existing_params[var_parts] = index
-            return f'${index}'
+            return f'${index}::{type_}' if type_ else f'${index}'
 
-        repl = partial(self.replace, ctx=ctx, add_param=add_param)
-        return self.regex.sub(repl, query_template), params
+        return add_param
 
-    def replace(self, m, *, ctx, add_param):
-        var_name = m.group(1)
+    @staticmethod
+    def _add_literal(p, *var_parts, type_=None):
+        literal = quote_literal(p)
+        return f'{literal}::{type_}' if type_ else literal
+
+    def parse(self, query_template):
+        """
+        Split a template into literal strings and (var_name, extra_name) tuples for each variable,
+        results are cached so templates are only parsed once.
+        """
+        segments = []
+        pos = 0
+        for m in self.regex.finditer(query_template):
+            start, end = m.span()
+            if start > pos:
+                segments.append(query_template[pos:start])
+            segments.append(self.split_var(m.group(1)))
+            pos = end
+        if pos < len(query_template):
+            segments.append(query_template[pos:])
+        return tuple(segments)
+
+    def split_var(self, var_name):
         if self.sep in var_name:
-            var_name, extra_name = var_name.split(self.sep, 1)
+            return tuple(var_name.split(self.sep, 1))
         else:
-            extra_name = None
+            return var_name, None
+
+    def replace(self, m, *, ctx, add_param):
+        return self.render_var(*self.split_var(m.group(1)), ctx=ctx, add_param=add_param)
 
+    def render_var(self, var_name, extra_name, *, ctx, add_param):
         try:
             v = ctx[var_name]
         except KeyError:
             raise BuildError(f'variable "{var_name}" not found in context') from None
 
         try:
-            render_gen = None
             if extra_name:
-                render_gen = getattr(v, 'render_' + extra_name)
-            elif isinstance(v, Component):
-                render_gen = v.render
-
-            if render_gen:
-                return ''.join(self.add_chunk(render_gen(), add_param, var_name))
+                gen = getattr(v, 'render_' + extra_name)()
+                return ''.join(self.add_chunk(gen, add_param, var_name, simplify_chunks=self.simplify))
             else:
-                return add_param(v, var_name)
+                return ''.join(self.add_value(v, add_param, var_name))
         except ComponentError as exc:
             raise BuildError(f'"{var_name}": {exc}') from exc
         except Exception as exc:
             raise BuildError(f'"{var_name}": error building content, {exc.__class__.__name__}: {exc}') from exc
 
-    @classmethod
-    def add_chunk(cls, gen, add_param, *var_parts):
+    def add_chunk(self, gen, add_param, *var_parts, simplify_chunks=False):
+        simplify_ = self.simplify
         for i, chunk in enumerate(gen):
             if isinstance(chunk, RawDangerous):
                 yield chunk
-            elif isinstance(chunk, Component):
-                yield from cls.add_chunk(chunk.render(), add_param, *var_parts, i)
-            else:
+            elif not isinstance(chunk, Component):
                 yield add_param(chunk, *var_parts, i)
+            elif simplify_chunks or isinstance(chunk, (Template, Typed)):
+                yield from self.add_value(chunk, add_param, *var_parts, i)
+            else:
+                # recurse directly rather than via add_value, each generator layer adds to the cost of every chunk
+                yield from self.add_chunk(
+                    chunk.render(),
+                    add_param,
+                    *var_parts,
+                    i,
+                    simplify_chunks=simplify_ and not _simplifies_children(chunk),
+                )
+
+    def add_value(self, v, add_param, *var_parts):
+        if self.simplify:
+            v = simplify(v)
+        if isinstance(v, Template):
+            yield from self.add_template(v, add_param, *var_parts)
+        elif isinstance(v, Typed):
+            yield add_param(v.value, *var_parts, type_=v.type)
+        elif isinstance(v, Component):
+            simplify_chunks = self.simplify and not _simplifies_children(v)
+            yield from self.add_chunk(v.render(), add_param, *var_parts, simplify_chunks=simplify_chunks)
+        else:
+            yield add_param(v, *var_parts)
+
+    def add_template(self, template, add_param, *var_parts):
+        # variables are identified by name so they're only added once if used more than once in the template,
+        # the template is parsed with this renderer's regex and separator, not those of the default renderer
+        for segment in self._parse(template.template):
+            if isinstance(segment, str):
+                yield segment
+                continue
+            var_name, extra_name = segment
+            v = template.get(var_name)
+            if extra_name:
+                gen = getattr(v, 'render_' + extra_name)()
+                yield from self.add_chunk(gen, add_param, *var_parts, var_name, simplify_chunks=self.simplify)
+            else:
+                yield from self.add_value(v, add_param, *var_parts, var_name)
 
     def get_params(self, component: Component):
         return list(self._get_params(component.render()))
@@ -76,7 +306,46 @@ class Renderer:
             if isinstance(chunk, Component):
                 yield from cls._get_params(chunk.render())
             elif not isinstance(chunk, RawDangerous):
-                yield chunk
+                yield adapt_param(chunk)
+
+
+class Template(Component):
+    """
+    A template with its own context which can be used as a value when rendering another template, e.g.
+
+        active = Template('status = :status AND deleted IS NULL', status='active')
+        render('SELECT * FROM users WHERE :active AND company = :co', active=active, co=1)
+        >> 'SELECT * FROM users WHERE status = $1 AND deleted IS NULL AND company = $2', ['active', 1]
+
+    Parameters are numbered as part of the template the Template is used in. Templates are parsed by the renderer
+    they're used with, so its regex and separator apply, and the result cached so the same template string can be
+    used repeatedly without being parsed again.
+    """
+
+    __slots__ = 'template', 'ctx'
+
+    def __init__(self, template, **ctx):
+        self.template = template
+        self.ctx = ctx
+
+    def get(self, var_name):
+        try:
+            return self.ctx[var_name]
+        except KeyError:
+            raise ComponentError(f'variable "{var_name}" not found in template context') from None
+
+    def render(self):
+        # rendering outside a renderer, e.g. by get_params, uses the default syntax
+        for segment in render._parse(self.template):
+            if isinstance(segment, str):
+                yield RawDangerous(segment)
+            else:
+                var_name, extra_name = segment
+                v = self.get(var_name)
+                if extra_name:
+                    yield from getattr(v, 'render_' + extra_name)()
+                else:
+                    yield v
 
 
 render = Renderer()
@@ -0,0 +1,207 @@
+import asyncio
+import math
+from bisect import bisect_left
+from collections import deque
+
+__all__ = ('PRIORITIES', 'Histogram', 'CapacityLimiter', 'PoolMetrics', 'PoolAutoscaler')
+
+# priority classes for acquiring connections, served in this order
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+DEFAULT_PRIORITY = PRIORITIES['normal']
+
+# upper bounds in seconds of the buckets for acquire wait times
+WAIT_BUCKETS = 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10
+
+
+class Histogram:
+    """
+    Histogram with fixed bucket upper bounds, observations larger than the last bound go in an overflow bucket.
+    """
+
+    __slots__ = 'bounds', 'counts', 'count', 'sum'
+
+    def __init__(self, bounds=WAIT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float):
+        """
+        Upper bound of the bucket containing the ``q`` quantile, inf if it's in the overflow bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            total += count
+            if total >= rank:
+                return bound
+
+    def snapshot(self) -> dict:
+        return {
+            'buckets': dict(zip(self.bounds + (math.inf,), self.counts)),
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+class CapacityLimiter:
+    """
+    Limit the number of connections acquired concurrently, unlike a semaphore the limit can be changed at any time.
+
+    Waiters are served in order of ``priority`` (0 first) then in the order they started waiting, so under sustained
+    load lower priority waiters only get a slot once no higher priority waiters remain.
+    """
+
+    __slots__ = 'limit', 'in_use', '_waiters'
+
+    def __init__(self, limit: int, *, priorities: int = len(PRIORITIES)):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters = tuple(deque() for _ in range(priorities))
+
+    @property
+    def waiting(self) -> int:
+        return sum(map(len, self._waiters))
+
+    def waiting_by_priority(self):
+        return [len(w) for w in self._waiters]
+
+    async def acquire(self, priority: int = 0):
+        if self.in_use < self.limit and not self.waiting:
+            self.in_use += 1
+            return
+        waiters = self._waiters[priority]
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as we were cancelled, pass it on
+                self.release()
+            elif waiter in waiters:
+                waiters.remove(waiter)
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def set_limit(self, limit: int):
+        self.limit = limit
+        self._wake()
+
+    def _wake(self):
+        for waiters in self._waiters:
+            while waiters and self.in_use < self.limit:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self.in_use += 1
+                    waiter.set_result(None)
+
+
+class PoolMetrics:
+    """
+    Metrics for connection acquisition, ``acquire_wait`` is a histogram of the time callers wait in ``acquire``
+    (including waiting for a capacity limit), the ``window_*`` values are reset by the autoscaler after each interval.
+    """
+
+    __slots__ = 'acquire_wait', 'acquired', 'window_wait_sum', 'window_wait_count', 'window_peak_in_use'
+
+    def __init__(self):
+        self.acquire_wait = Histogram()
+        self.acquired = 0
+        self.reset_window()
+
+    def reset_window(self):
+        self.window_wait_sum = 0.0
+        self.window_wait_count = 0
+        self.window_peak_in_use = 0
+
+    def record_acquire(self, wait: float, in_use: int):
+        self.acquire_wait.observe(wait)
+        self.acquired += 1
+        self.window_wait_sum += wait
+        self.window_wait_count += 1
+        self.window_peak_in_use = max(self.window_peak_in_use, in_use)
+
+
+class PoolAutoscaler:
+    """
+    Adjust how many connections a BuildPgPool may use between the pool's ``min_size`` (or ``min_size`` here if
+    that's larger) and its ``max_size``, the pool must be created with ``min_size`` less than ``max_size``.
+
+    Every ``interval`` seconds the average acquire wait and the peak number of connections in use are checked:
+    if the average wait is above ``wait_threshold`` seconds for ``sustained`` intervals in a row capacity grows by
+    ``scale_up``; if the fraction of capacity left idle at the peak is above ``idle_ratio`` for ``sustained``
+    intervals capacity shrinks by ``scale_down``.
+
+    The pool opens connections as they're needed up to the current capacity. asyncpg closes connections above the
+    pool's ``min_size`` once they've been idle for ``max_inactive_connection_lifetime`` (300 seconds by default),
+    so that controls how soon backend memory is released after capacity shrinks. Capacity never drops below the
+    pool's ``min_size`` since those connections are kept open anyway.
+    """
+
+    __slots__ = 'min_size', 'interval', 'wait_threshold', 'idle_ratio', 'sustained', 'scale_up', 'scale_down', '_streak'
+
+    def __init__(
+        self,
+        *,
+        min_size: int = 1,
+        interval: float = 5.0,
+        wait_threshold: float = 0.01,
+        idle_ratio: float = 0.5,
+        sustained: int = 3,
+        scale_up: float = 1.5,
+        scale_down: float = 0.75,
+    ):
+        self.min_size = min_size
+        self.interval = interval
+        self.wait_threshold = wait_threshold
+        self.idle_ratio = idle_ratio
+        self.sustained = sustained
+        self.scale_up = scale_up
+        self.scale_down = scale_down
+        # positive for consecutive intervals needing more capacity, negative for intervals with too much
+        self._streak = 0
+
+    def decide(self, capacity: int, max_size: int, avg_wait: float, peak_in_use: int, min_size: int = None) -> int:
+        """
+        Return the new capacity given the stats for the last interval, ``min_size`` defaults to ``self.min_size``.
+        """
+        if min_size is None:
+            min_size = self.min_size
+        if avg_wait > self.wait_threshold:
+            self._streak = max(self._streak, 0) + 1
+        elif capacity and 1 - peak_in_use / capacity > self.idle_ratio:
+            self._streak = min(self._streak, 0) - 1
+        else:
+            self._streak = 0
+
+        if self._streak >= self.sustained:
+            self._streak = 0
+            return min(max_size, max(capacity + 1, math.ceil(capacity * self.scale_up)))
+        elif self._streak <= -self.sustained:
+            self._streak = 0
+            return max(min_size, min(capacity - 1, math.floor(capacity * self.scale_down)))
+        return capacity
+
+    async def run(self, pool):
+        limiter, metrics = pool.capacity_limiter, pool.pool_metrics
+        min_size = max(self.min_size, pool.get_min_size())
+        while True:
+            await asyncio.sleep(self.interval)
+            count = metrics.window_wait_count
+            avg_wait = metrics.window_wait_sum / count if count else 0
+            # connections held since before the window started count too
+            peak = max(metrics.window_peak_in_use, limiter.in_use)
+            metrics.reset_window()
+            limiter.set_limit(self.decide(limiter.limit, pool.get_max_size(), avg_wait, peak, min_size))
@@ -0,0 +1,382 @@
+import asyncio
+import heapq
+import zlib
+from bisect import bisect_right
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from itertools import islice
+
+from . import clauses
+from .asyncpg import _deadline_timeout, _keyset_keys, create_pool_b
+
+__all__ = (
+    'RoutingPool',
+    'create_routing_pool_b',
+    'HashShardMap',
+    'RangeShardMap',
+    'ShardedPool',
+    'create_sharded_pool_b',
+)
+
+STRATEGIES = 'round_robin', 'least_busy'
+# ids of RoutingPools sending all queries to the primary, set by RoutingPool.use_primary()
+_use_primary = ContextVar('buildpg_use_primary', default=frozenset())
+
+
+class _MultiPool:
+    pools = ()
+
+    async def _init(self):
+        await asyncio.gather(*self.pools)
+        return self
+
+    def __await__(self):
+        return self._init().__await__()
+
+    async def __aenter__(self):
+        return await self._init()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await asyncio.gather(*(p.close() for p in self.pools))
+
+    def terminate(self):
+        for p in self.pools:
+            p.terminate()
+
+
+class RoutingPool(_MultiPool):
+    """
+    Wraps a primary pool and any number of replica pools, read queries (``fetch_b``, ``fetchrow_b``, ``fetchval_b``,
+    ``fetch_columns_b``, ``fetch_as_b``, ``fetchrow_as_b``, ``iter_b``, ``paginate_b``, ``copy_out_b`` and
+    ``explain_b`` without ``_analyze``) are sent to a replica, everything else to the primary.
+
+    ``strategy`` decides how replicas are chosen: ``round_robin`` or ``least_busy`` - the replica with the fewest
+    queries in progress through this object. If there are no replicas reads go to the primary.
+
+    For read-your-writes, pass ``_primary=True`` to any read method or wrap a block in ``with pool.use_primary():``.
+    """
+
+    def __init__(self, primary, replicas=(), *, strategy='round_robin'):
+        if strategy not in STRATEGIES:
+            raise ValueError(f'strategy must be one of {", ".join(STRATEGIES)}, not "{strategy}"')
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self._in_flight = [0] * len(self.replicas)
+        self._next = 0
+
+    @property
+    def pools(self):
+        return [self.primary] + self.replicas
+
+    @contextmanager
+    def use_primary(self):
+        """
+        Send all queries in this block (and tasks started within it) to the primary.
+        """
+        # pools are identified by id so use_primary() on one pool doesn't affect others
+        token = _use_primary.set(_use_primary.get() | {id(self)})
+        try:
+            yield
+        finally:
+            _use_primary.reset(token)
+
+    def _choose_replica(self, primary):
+        if primary or not self.replicas or id(self) in _use_primary.get():
+            return None
+        start = self._next
+        n = len(self.replicas)
+        self._next = (start + 1) % n
+        if self.strategy == 'least_busy':
+            # ties are broken starting from the next replica in turn, so idle replicas are still used evenly
+            return min(range(n), key=lambda i: (self._in_flight[i], (i - start) % n))
+        else:
+            return start
+
+    @contextmanager
+    def _route(self, primary):
+        index = self._choose_replica(primary)
+        if index is None:
+            yield self.primary
+        else:
+            self._in_flight[index] += 1
+            try:
+                yield self.replicas[index]
+            finally:
+                self._in_flight[index] -= 1
+
+    async def _read(self, method, primary, args, kwargs):
+        with self._route(primary) as pool:
+            return await getattr(pool, method)(*args, **kwargs)
+
+    async def _read_iter(self, method, primary, args, kwargs):
+        with self._route(primary) as pool:
+            gen = getattr(pool, method)(*args, **kwargs)
+            try:
+                async for item in gen:
+                    yield item
+            finally:
+                # close explicitly so the connection is released when iteration stops early
+                await gen.aclose()
+
+    @asynccontextmanager
+    async def acquire(self, *, readonly=False, _primary=False, timeout: float = None):
+        """
+        Acquire a connection, from a replica if ``readonly`` is true otherwise from the primary. Use this where a
+        connection is required, e.g. for ``cursor_b``.
+        """
+        with self._route(_primary or not readonly) as pool:
+            async with pool.acquire(timeout=timeout) as conn:
+                yield conn
+
+    def print_b(self, query_template, **kwargs):
+        return self.primary.print_b(query_template, **kwargs)
+
+    async def fetch_b(self, query_template, *, _primary=False, **kwargs):
+        return await self._read('fetch_b', _primary, (query_template,), kwargs)
+
+    async def fetchval_b(self, query_template, *, _primary=False, **kwargs):
+        return await self._read('fetchval_b', _primary, (query_template,), kwargs)
+
+    async def fetchrow_b(self, query_template, *, _primary=False, **kwargs):
+        return await self._read('fetchrow_b', _primary, (query_template,), kwargs)
+
+    async def fetch_columns_b(self, query_template, *, _primary=False, **kwargs):
+        return await self._read('fetch_columns_b', _primary, (query_template,), kwargs)
+
+    async def fetch_as_b(self, model, query_template, *, _primary=False, **kwargs):
+        return await self._read('fetch_as_b', _primary, (model, query_template), kwargs)
+
+    async def fetchrow_as_b(self, model, query_template, *, _primary=False, **kwargs):
+        return await self._read('fetchrow_as_b', _primary, (model, query_template), kwargs)
+
+    async def copy_out_b(self, query_template, *, _primary=False, **kwargs):
+        return await self._read('copy_out_b', _primary, (query_template,), kwargs)
+
+    def iter_b(self, query_template, *, _primary=False, **kwargs):
+        return self._read_iter('iter_b', _primary, (query_template,), kwargs)
+
+    def paginate_b(self, query_template, *, _primary=False, **kwargs):
+        return self._read_iter('paginate_b', _primary, (query_template,), kwargs)
+
+    async def explain_b(self, query_template, *, _primary=False, _analyze=False, **kwargs):
+        # with _analyze the statement is executed, it may modify data so can't be run on a replica
+        kwargs['_analyze'] = _analyze
+        return await self._read('explain_b', _primary or _analyze, (query_template,), kwargs)
+
+    async def execute_b(self, query_template, **kwargs):
+        return await self.primary.execute_b(query_template, **kwargs)
+
+    async def executemany_b(self, query_template, args, **kwargs):
+        return await self.primary.executemany_b(query_template, args, **kwargs)
+
+    async def upsert_many_b(self, table, values, **kwargs):
+        return await self.primary.upsert_many_b(table, values, **kwargs)
+
+
+def create_routing_pool_b(dsn=None, replica_dsns=(), *, strategy='round_robin', **kwargs):
+    """
+    Create a RoutingPool with a BuildPgPool for the primary at ``dsn`` and one for each of ``replica_dsns``.
+
+    Other arguments are passed to ``create_pool_b`` for every pool. As with ``create_pool_b`` the result can be
+    used with ``async with`` or awaited.
+    """
+    primary = create_pool_b(dsn, **kwargs)
+    replicas = [create_pool_b(replica_dsn, **kwargs) for replica_dsn in replica_dsns]
+    return RoutingPool(primary, replicas, strategy=strategy)
+
+
+class HashShardMap:
+    """
+    Map shard keys to one of ``shards`` shards by hash, integer keys are mapped by modulo, other keys using crc32 of
+    their string representation so the mapping is the same in every process.
+    """
+
+    __slots__ = ('shards',)
+
+    def __init__(self, shards: int):
+        self.shards = shards
+
+    def __call__(self, key) -> int:
+        if not isinstance(key, int):
+            key = zlib.crc32(str(key).encode())
+        return key % self.shards
+
+
+class RangeShardMap:
+    """
+    Map shard keys to shards by range, ``bounds`` are the sorted lower bounds of all shards after the first, e.g.
+    ``RangeShardMap([1000, 2000])`` maps keys below 1000 to shard 0, 1000 to 1999 to shard 1 and the rest to shard 2.
+    """
+
+    __slots__ = ('bounds',)
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        if self.bounds != sorted(self.bounds):
+            raise ValueError('bounds must be sorted')
+
+    def __call__(self, key) -> int:
+        return bisect_right(self.bounds, key)
+
+
+class _Descending:
+    __slots__ = ('v',)
+
+    def __init__(self, v):
+        self.v = v
+
+    def __lt__(self, other):
+        return other.v < self.v
+
+    def __eq__(self, other):
+        return self.v == other.v
+
+
+def _sort_key(order_by, keys):
+    """
+    Build a function returning the sort key of a record, matching how postgres sorts by ``order_by``.
+    """
+    terms = clauses.order_by_terms(order_by)
+    columns = [(key, descending, nulls_first) for key, (_, descending, nulls_first, _) in zip(keys, terms)]
+
+    def sort_key(record):
+        return tuple(
+            ((record[k] is None) != nulls_first, _Descending(record[k]) if descending else record[k])
+            for k, descending, nulls_first in columns
+        )
+
+    return sort_key
+
+
+class ShardedPool(_MultiPool):
+    """
+    Route queries to one of ``pools`` using a shard key from the render context.
+
+    ``shard_key`` is the name of the context variable used to choose the shard, ``shard_map`` is any callable
+    mapping a key to the index of a pool - by default HashShardMap. Methods taking a render context use the
+    value of ``shard_key`` from it, ``_shard`` may be passed instead to give the key explicitly (it's required
+    for ``executemany_b`` and ``upsert_many_b``).
+
+    ``scatter_fetch_b`` runs a query on all shards.
+    """
+
+    def __init__(self, pools, *, shard_key, shard_map=None):
+        self.pools = list(pools)
+        self.shard_key = shard_key
+        self.shard_map = shard_map or HashShardMap(len(self.pools))
+
+    def pool_for(self, key):
+        """
+        Get the pool for a shard key.
+        """
+        return self.pools[self.shard_map(key)]
+
+    def _pool(self, shard, ctx):
+        if shard is None:
+            try:
+                shard = ctx[self.shard_key]
+            except KeyError:
+                msg = f'shard key "{self.shard_key}" not found in the render context and "_shard" not given'
+                raise ValueError(msg) from None
+        return self.pool_for(shard)
+
+    def acquire(self, shard, *, timeout: float = None):
+        return self.pool_for(shard).acquire(timeout=timeout)
+
+    def print_b(self, query_template, *, _shard=None, **kwargs):
+        return self._pool(_shard, kwargs).print_b(query_template, **kwargs)
+
+    async def execute_b(self, query_template, *, _shard=None, **kwargs):
+        return await self._pool(_shard, kwargs).execute_b(query_template, **kwargs)
+
+    async def fetch_b(self, query_template, *, _shard=None, **kwargs):
+        return await self._pool(_shard, kwargs).fetch_b(query_template, **kwargs)
+
+    async def fetchval_b(self, query_template, *, _shard=None, **kwargs):
+        return await self._pool(_shard, kwargs).fetchval_b(query_template, **kwargs)
+
+    async def fetchrow_b(self, query_template, *, _shard=None, **kwargs):
+        return await self._pool(_shard, kwargs).fetchrow_b(query_template, **kwargs)
+
+    async def fetch_columns_b(self, query_template, *, _shard=None, **kwargs):
+        return await self._pool(_shard, kwargs).fetch_columns_b(query_template, **kwargs)
+
+    async def fetch_as_b(self, model, query_template, *, _shard=None, **kwargs):
+        return await self._pool(_shard, kwargs).fetch_as_b(model, query_template, **kwargs)
+
+    async def fetchrow_as_b(self, model, query_template, *, _shard=None, **kwargs):
+        return await self._pool(_shard, kwargs).fetchrow_as_b(model, query_template, **kwargs)
+
+    def iter_b(self, query_template, *, _shard=None, **kwargs):
+        return self._pool(_shard, kwargs).iter_b(query_template, **kwargs)
+
+    def paginate_b(self, query_template, *, _shard=None, **kwargs):
+        return self._pool(_shard, kwargs).paginate_b(query_template, **kwargs)
+
+    async def executemany_b(self, query_template, args, *, _shard, **kwargs):
+        return await self.pool_for(_shard).executemany_b(query_template, args, **kwargs)
+
+    async def upsert_many_b(self, table, values, *, _shard, **kwargs):
+        return await self.pool_for(_shard).upsert_many_b(table, values, **kwargs)
+
+    async def scatter_fetch_b(
+        self,
+        query_template,
+        *,
+        _order_by=None,
+        _keys=None,
+        _limit: int = None,
+        _timeout: float = None,
+        _priority=None,
+        _tag=None,
+        print_=False,
+        **kwargs,
+    ):
+        """
+        Run a query on every shard concurrently and combine the results, each shard's query is run with that pool's
+        ``fetch_b`` so its renderer, limits and plan sampler apply.
+
+        If ``_order_by`` is given, each shard's result must already be sorted by it (generally the query should
+        include the same ``ORDER BY``), and the results are merged in order. Values are taken from records using
+        ``_keys``, by default the column names from ``_order_by`` as with ``paginate_b``. Otherwise results are
+        concatenated in shard order. ``_limit`` limits the number of records returned, each shard's query should
+        include the same limit.
+        """
+        # checked here so no shard's query is started once the deadline has passed
+        timeout = _deadline_timeout(_timeout)
+        results = await asyncio.gather(
+            *(
+                # the query is only printed once
+                p.fetch_b(
+                    query_template,
+                    _timeout=timeout,
+                    _priority=_priority,
+                    _tag=_tag,
+                    print_=print_ if i == 0 else False,
+                    **kwargs,
+                )
+                for i, p in enumerate(self.pools)
+            )
+        )
+        if _order_by is None:
+            rows = (r for shard_rows in results for r in shard_rows)
+        else:
+            if not isinstance(_order_by, clauses.OrderBy):
+                _order_by = clauses.OrderBy(*_order_by)
+            rows = heapq.merge(*results, key=_sort_key(_order_by, _keys or _keyset_keys(_order_by)))
+        return list(islice(rows, _limit))
+
+
+def create_sharded_pool_b(dsns, *, shard_key, shard_map=None, **kwargs):
+    """
+    Create a ShardedPool with a BuildPgPool for each of ``dsns``, in shard order.
+
+    Other arguments are passed to ``create_pool_b`` for every pool. As with ``create_pool_b`` the result can be
+    used with ``async with`` or awaited.
+    """
+    pools = [create_pool_b(dsn, **kwargs) for dsn in dsns]
+    return ShardedPool(pools, shard_key=shard_key, shard_map=shard_map)
@@ -5,6 +5,8 @@ import pytest
 from buildpg import asyncpg
 
 DB_NAME = 'buildpg_test'
+# empty databases standing in for read replicas
+REPLICA_DB_NAMES = 'buildpg_test_replica_1', 'buildpg_test_replica_2'
 
 # some simple data to use in queries
 POPULATE_DB = """
@@ -44,8 +46,9 @@ JOIN companies AS c ON company_name_=c.name;
 async def _reset_db():
     conn = await asyncpg.connect('postgresql://postgres@localhost')
     try:
-        if not await conn.fetchval('SELECT 1 from pg_database WHERE datname=$1;', DB_NAME):
-            await conn.execute(f'CREATE DATABASE {DB_NAME};')
+        for name in (DB_NAME,) + REPLICA_DB_NAMES:
+            if not await conn.fetchval('SELECT 1 from pg_database WHERE datname=$1;', name):
+                await conn.execute(f'CREATE DATABASE {name};')
     finally:
         await conn.close()
     conn = await asyncpg.connect(f'postgresql://postgres@localhost/{DB_NAME}')
@@ -0,0 +1,134 @@
+import asyncio
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from uuid import UUID
+
+import pytest
+
+from buildpg import asyncpg
+from buildpg.bulk import encode_copy_rows, encode_copy_value, prepare_copy_chunk
+
+
+@pytest.mark.parametrize(
+    'value,expected',
+    [
+        (None, '\\N'),
+        ('foobar', 'foobar'),
+        ('tab\tnew\nline\rback\\slash', 'tab\\tnew\\nline\\rback\\\\slash'),
+        (True, 't'),
+        (False, 'f'),
+        (123, '123'),
+        (1.5, '1.5'),
+        (float('inf'), 'Infinity'),
+        (float('-inf'), '-Infinity'),
+        (float('nan'), 'NaN'),
+        (Decimal('1.23'), '1.23'),
+        (UUID('12345678-1234-5678-1234-567812345678'), '12345678-1234-5678-1234-567812345678'),
+        (date(2020, 1, 2), '2020-01-02'),
+        (datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc), '2020-01-02T03:04:05+00:00'),
+        (time(12, 30), '12:30:00'),
+        (timedelta(days=1, seconds=2, microseconds=3), '1 days 2 seconds 3 microseconds'),
+        (b'\x00\xff', '\\\\x00ff'),
+        ([1, None, 3], '{"1",NULL,"3"}'),
+        (['a"b', 'c\\d'], '{"a\\\\"b","c\\\\\\\\d"}'),
+    ],
+)
+def test_encode_copy_value(value, expected):
+    assert encode_copy_value(value) == expected
+
+
+def test_encode_copy_value_numpy():
+    np = pytest.importorskip('numpy')
+    assert encode_copy_value(np.int64(1)) == '1'
+    assert encode_copy_value(np.float32(1.5)) == '1.5'
+    assert encode_copy_value(np.bool_(True)) == 't'
+    assert encode_copy_value(np.array([1, 2], dtype=np.int32)) == '{"1","2"}'
+    assert encode_copy_rows([(np.int64(2), array('q', [3]))]) == b'2\t{"3"}\n'
+
+
+def test_encode_copy_value_error():
+    with pytest.raises(TypeError, match='unable to encode dict for COPY'):
+        encode_copy_value({'a': 1})
+
+
+def test_encode_copy_rows():
+    assert encode_copy_rows([(1, 'a'), (2, None)]) == b'1\ta\n2\t\\N\n'
+    assert encode_copy_rows([]) == b''
+
+
+def prepare_row(i):
+    return i, f'name {i}'
+
+
+def test_prepare_copy_chunk():
+    assert prepare_copy_chunk(prepare_row, [1, 2]) == (b'1\tname 1\n2\tname 2\n', 2)
+    assert prepare_copy_chunk(None, [(1,)]) == (b'1\n', 1)
+
+
+class FakePool:
+    bulk_load_b = asyncpg.BuildPgPool.bulk_load_b
+
+    def __init__(self, fail=False):
+        self.copies = []
+        self.limits = set()
+        self.fail = fail
+
+    @asynccontextmanager
+    async def _connection(self, priority=None, tag=None, query_template=None):
+        self.limits.add((priority, tag))
+        yield self
+
+    async def copy_to_table(self, table, *, source, columns, schema_name, format, timeout):
+        await asyncio.sleep(0.001)
+        if self.fail:
+            raise RuntimeError('copy failed')
+        self.copies.append((schema_name, table, columns, format, source.read()))
+
+
+@pytest.mark.asyncio
+async def test_bulk_load_ordered():
+    pool = FakePool()
+    progress = []
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        count = await pool.bulk_load_b(
+            'public.users',
+            ['id', 'name'],
+            range(10),
+            prepare_row,
+            chunk_size=3,
+            executor=executor,
+            ordered=True,
+            progress=lambda *args: progress.append(args),
+            priority='low',
+            tag='loads',
+        )
+    assert count == 10
+    assert pool.limits == {('low', 'loads')}
+    assert progress == [(3, 1), (6, 2), (9, 3), (10, 4)]
+    assert [c[:4] for c in pool.copies] == [('public', 'users', ('id', 'name'), 'text')] * 4
+    data = b''.join(c[4] for c in pool.copies)
+    assert data == b''.join(f'{i}\tname {i}\n'.encode() for i in range(10))
+
+
+@pytest.mark.asyncio
+async def test_bulk_load_parallel():
+    pool = FakePool()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        count = await pool.bulk_load_b('t', ['a'], [(i,) for i in range(100)], chunk_size=7, executor=executor)
+    assert count == 100
+    assert pool.limits == {(None, None)}
+    assert len(pool.copies) == 15
+    assert {c[1:4] for c in pool.copies} == {('t', ('a',), 'text')}
+    assert pool.copies[0][0] is None
+    assert sorted(int(v) for c in pool.copies for v in c[4].split()) == list(range(100))
+
+
+@pytest.mark.asyncio
+async def test_bulk_load_error():
+    pool = FakePool(fail=True)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with pytest.raises(RuntimeError, match='copy failed'):
+            await pool.bulk_load_b('t', ['a'], [(i,) for i in range(100)], chunk_size=7, executor=executor)
@@ -1,6 +1,20 @@
 import pytest
 
-from buildpg import V, clauses, render
+from buildpg import (
+    BuildError,
+    Empty,
+    MultipleValues,
+    RawDangerous,
+    Renderer,
+    SetValues,
+    Template,
+    UnnestValues,
+    V,
+    Values,
+    clauses,
+    funcs,
+    render,
+)
 
 
 @pytest.mark.parametrize(
@@ -20,6 +34,31 @@ from buildpg import V, clauses, render
         (lambda: clauses.Limit(20), 'LIMIT $1', [20]),
         (lambda: clauses.Offset(20), 'OFFSET $1', [20]),
         (lambda: clauses.Join('foobar', V('x.value') == 0), 'JOIN foobar ON x.value = $1', [0]),
+        (lambda: clauses.Returning('id', V('x').as_('y')), 'RETURNING id, x AS y', []),
+        (lambda: clauses.OnConflict('a', 'b'), 'ON CONFLICT (a, b) DO NOTHING', []),
+        (lambda: clauses.OnConflict(), 'ON CONFLICT DO NOTHING', []),
+        (
+            lambda: clauses.OnConflict('a', update=['b', 'c']),
+            'ON CONFLICT (a) DO UPDATE SET b = EXCLUDED.b, c = EXCLUDED.c',
+            [],
+        ),
+        (
+            lambda: clauses.OnConflict('a', update=SetValues(b=V('EXCLUDED.b') + 1), where=V('t.b') < 10),
+            'ON CONFLICT (a) DO UPDATE SET b = EXCLUDED.b + $1 WHERE t.b < $2',
+            [1, 10],
+        ),
+        (lambda: clauses.WhenMatched('DELETE'), 'WHEN MATCHED THEN DELETE', []),
+        (
+            lambda: clauses.WhenMatched(SetValues(a=V('s.a')), V('s.a') > 1),
+            'WHEN MATCHED AND s.a > $1 THEN UPDATE SET a = s.a',
+            [1],
+        ),
+        (lambda: clauses.WhenNotMatched('DO NOTHING'), 'WHEN NOT MATCHED THEN DO NOTHING', []),
+        (
+            lambda: clauses.WhenNotMatched(Values(a=V('s.a'), b=2)),
+            'WHEN NOT MATCHED THEN INSERT (a, b) VALUES (s.a, $1)',
+            [2],
+        ),
     ],
 )
 def test_simple_blocks(block, expected_query, expected_params):
@@ -47,3 +86,217 @@ def test_args():
     assert query == 'WHERE a = $1'
     assert params == [True]
     assert params[0] is True
+
+
+@pytest.mark.parametrize(
+    'order_by,last,expected_query,expected_params',
+    [
+        (lambda: clauses.OrderBy('a', 'b'), None, 'WHERE TRUE', []),
+        (lambda: clauses.OrderBy('a', 'b'), (1, 2), 'WHERE (a, b) > ($1, $2)', [1, 2]),
+        (lambda: clauses.OrderBy(V('a').desc(), V('b').desc()), (1, 2), 'WHERE (a, b) < ($1, $2)', [1, 2]),
+        (
+            lambda: clauses.OrderBy(V('a').desc(), 'b'),
+            (1, 2),
+            'WHERE a < $1 OR a = $2 AND (b > $3 OR b is NULL)',
+            [1, 1, 2],
+        ),
+        (
+            lambda: clauses.OrderBy(V('a').nulls_last(), 'b'),
+            (1, 2),
+            'WHERE a > $1 OR a is NULL OR a = $2 AND (b > $3 OR b is NULL)',
+            [1, 1, 2],
+        ),
+        (lambda: clauses.OrderBy('a', 'b'), (None, 2), 'WHERE a is NULL AND (b > $1 OR b is NULL)', [2]),
+        (
+            lambda: clauses.OrderBy(V('a').desc(), 'b'),
+            (None, 2),
+            'WHERE a is not NULL OR a is NULL AND (b > $1 OR b is NULL)',
+            [2],
+        ),
+        (lambda: clauses.OrderBy('a'), (None,), 'WHERE FALSE', []),
+        (
+            lambda: clauses.OrderBy('a', V('b').desc().nulls_last()),
+            (1, 2),
+            'WHERE a > $1 OR a is NULL OR a = $2 AND (b < $3 OR b is NULL)',
+            [1, 1, 2],
+        ),
+    ],
+)
+def test_keyset(order_by, last, expected_query, expected_params):
+    ob = order_by()
+    query, params = render(':v', v=clauses.Keyset(ob, last))
+    assert expected_query == query
+    assert expected_params == params
+    # the OrderBy clause is unchanged
+    assert render(':v', v=ob)[0].startswith('ORDER BY a')
+
+
+def test_keyset_wrong_length():
+    with pytest.raises(ValueError, match='2 values required for keyset, got 1'):
+        clauses.keyset(clauses.OrderBy('a', 'b'), [1])
+
+
+def test_update_from():
+    values = MultipleValues(Values(id=1, name='a'), Values(id=2, name='b'), Values(id=3, name='c'))
+    update = clauses.UpdateFrom('users', values, types={'id': 'int'})
+    query, params = render(':u', u=update)
+    assert query == (
+        'UPDATE users SET name = v.name FROM (VALUES ($1::int, $2), ($3, $4), ($5, $6)) AS v (id, name) '
+        'WHERE users.id = v.id'
+    )
+    assert params == [1, 'a', 2, 'b', 3, 'c']
+
+    chunks = [render(':u', u=u) for u in update.chunks(2)]
+    assert [p for _, p in chunks] == [[1, 'a', 2, 'b'], [3, 'c']]
+    assert chunks[1][0].startswith('UPDATE users SET name = v.name FROM (VALUES ($1::int, $2)) AS v')
+
+
+def test_update_from_unnest():
+    values = UnnestValues(
+        Values(id=1, x=3, name='a'), Values(id=2, x=4, name='b'), types={'id': 'int', 'x': 'int', 'name': 'text'}
+    )
+    update = clauses.UpdateFrom('users', values, key=('id', 'x'), alias='u2')
+    query, params = render(':u', u=update)
+    assert query == (
+        'UPDATE users SET name = u2.name FROM unnest($1::int[], $2::int[], $3::text[]) AS u2 (id, x, name) '
+        'WHERE users.id = u2.id AND users.x = u2.x'
+    )
+    assert params == [[1, 2], [3, 4], ['a', 'b']]
+    assert [render(':u', u=u) for u in update.chunks(1)][1] == (query, [[2], [4], ['b']])
+
+
+@pytest.mark.parametrize(
+    'func,msg',
+    [
+        (lambda: clauses.UpdateFrom('t', MultipleValues(Values(1, 2))), 'UpdateFrom requires named values'),
+        (lambda: clauses.UpdateFrom('t', MultipleValues(Values(a=1))), "key columns missing from values: ['id']"),
+        (
+            lambda: clauses.UpdateFrom('t', MultipleValues(Values(id=1, x=2)), key=('id', 'x')),
+            'UpdateFrom requires at least one column to update as well as the key columns',
+        ),
+    ],
+)
+def test_update_from_errors(func, msg):
+    with pytest.raises(ValueError) as exc_info:
+        func()
+    assert msg == str(exc_info.value)
+
+
+def test_merge():
+    query, params = render(
+        ':v',
+        v=(
+            clauses.Merge('users', V('new_users').as_('n'), V('users.id') == V('n.id'))
+            + clauses.WhenMatched(SetValues(name=V('n.name')))
+            + clauses.WhenNotMatched(Values(id=V('n.id'), name=V('n.name'), value=0))
+            + clauses.Returning('id')
+        ),
+    )
+    assert query == (
+        'MERGE INTO users USING new_users AS n ON users.id = n.id\n'
+        'WHEN MATCHED THEN UPDATE SET name = n.name\n'
+        'WHEN NOT MATCHED THEN INSERT (id, name, value) VALUES (n.id, n.name, $1)\n'
+        'RETURNING id'
+    )
+    assert params == [0]
+
+
+@pytest.mark.parametrize(
+    'func,msg',
+    [
+        (lambda: clauses.OnConflict(update=['a']), 'a conflict target is required with "update"'),
+        (lambda: clauses.WhenMatched('DROP TABLE users'), '"then" must be one of DELETE, DO NOTHING or a component'),
+        (lambda: clauses.WhenNotMatched('DELETE'), '"then" must be one of DO NOTHING or a component'),
+    ],
+)
+def test_clause_errors(func, msg):
+    with pytest.raises(ValueError) as exc_info:
+        func()
+    assert msg == str(exc_info.value)
+
+
+def test_with():
+    w = clauses.With(
+        render('SELECT * FROM new_items WHERE x = :x', x=9),
+        new_order=render('INSERT INTO orders (customer) VALUES (:c) RETURNING id', c=123),
+        new_items=render(
+            'INSERT INTO items (order_id, sku, n) SELECT id, :sku, :n FROM new_order RETURNING *', sku='x', n=2
+        ),
+        other=clauses.Select(['a']) + clauses.Where(V('a') == 4),
+    )
+    query, params = render('-- :c\n:w', c=clauses.Limit(0), w=w)
+    assert query == (
+        '-- LIMIT $1\n'
+        'WITH new_order AS (INSERT INTO orders (customer) VALUES ($2) RETURNING id), '
+        'new_items AS (INSERT INTO items (order_id, sku, n) SELECT id, $3, $4 FROM new_order RETURNING *), '
+        'other AS (SELECT a\nWHERE a = $5)\n'
+        'SELECT * FROM new_items WHERE x = $6'
+    )
+    assert params == [0, 123, 'x', 2, 4, 9]
+
+
+@pytest.mark.parametrize(
+    'func,exc,msg',
+    [
+        (lambda: clauses.With(render('SELECT 1')), ValueError, 'at least one common table expression is required'),
+        (
+            lambda: clauses.With('SELECT 1', a=render('SELECT 1')),
+            TypeError,
+            'statements must be components or (sql, params) tuples as returned by render()',
+        ),
+    ],
+)
+def test_with_errors(func, exc, msg):
+    with pytest.raises(exc) as exc_info:
+        func()
+    assert msg == str(exc_info.value)
+
+
+def test_with_missing_param():
+    with pytest.raises(BuildError, match='parameter "\\$2" not found in rendered statement params'):
+        render(':w', w=clauses.With(('SELECT $2', [1]), a=render('SELECT 1')))
+
+
+def test_with_quoted_placeholders():
+    sql = (
+        "SELECT 'costs $1', E'it\\'s $1', \"col$1\", $$ $1 $$, $fn$ it's $1 $fn$, $1 -- $1\n"
+        '/* $1 */ FROM t WHERE x = $2'
+    )
+    query, params = render(':w', w=clauses.With((sql, [5, 6]), a=render('SELECT :x', x=4)))
+    assert query == (
+        'WITH a AS (SELECT $1)\n'
+        "SELECT 'costs $1', E'it\\'s $1', \"col$1\", $$ $1 $$, $fn$ it's $1 $fn$, $2 -- $1\n"
+        '/* $1 */ FROM t WHERE x = $3'
+    )
+    assert params == [4, 5, 6]
+
+    query, params = render(':w', w=clauses.With(("SELECT 'costs $1'", []), a=render('SELECT 1')))
+    assert query == "WITH a AS (SELECT 1)\nSELECT 'costs $1'"
+    assert params == []
+
+
+def test_reuse_clauses():
+    base = clauses.Select(['id', 'name']) + clauses.From('users')
+    q1 = base + clauses.Where(V('id') == 1)
+    q2 = base + clauses.Limit(10)
+    assert render(':q', q=base) == ('SELECT id, name\nFROM users', [])
+    assert render(':q', q=q1) == ('SELECT id, name\nFROM users\nWHERE id = $1', [1])
+    assert render(':q', q=q2) == ('SELECT id, name\nFROM users\nLIMIT $1', [10])
+
+
+def test_simplify():
+    r = Renderer(simplify=True)
+    q = clauses.Select(['a']) + clauses.Where(Empty() & (V('a') == 1) & RawDangerous('TRUE')) + clauses.Limit(2)
+    assert r(':q', q=q) == ('SELECT a\nWHERE a = $1\nLIMIT $2', [1, 2])
+    assert render(':q', q=q) == ('SELECT a\nWHERE  AND a = $1 AND TRUE\nLIMIT $2', [1, 2])
+    where = clauses.Where(V('a') == 1)
+    assert where.simplify() is where
+
+
+def test_simplify_nested():
+    r = Renderer(simplify=True)
+    where = clauses.Where(Empty() & (V('a') == 1))
+    assert r(':t', t=Template('SELECT 1 :q', q=where)) == ('SELECT 1 WHERE a = $1', [1])
+    q = clauses.With(clauses.Select(['a']) + where, x=clauses.Where((V('b') == 2) & Empty()))
+    assert r(':q', q=q) == ('WITH x AS (WHERE b = $1)\nSELECT a\nWHERE a = $2', [2, 1])
+    assert r(':v', v=Values(a=funcs.NOT(funcs.NOT(V('a'))))) == ('(a)', [])
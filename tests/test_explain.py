@@ -0,0 +1,145 @@
+import json
+
+import pytest
+
+from buildpg import V, asyncpg
+from buildpg.explain import PlanSampler, PlanSummary
+
+PLAN = [
+    {
+        'Plan': {
+            'Node Type': 'Hash Join',
+            'Total Cost': 45.5,
+            'Plan Rows': 10,
+            'Actual Rows': 250,
+            'Actual Loops': 1,
+            'Plans': [
+                {
+                    'Node Type': 'Seq Scan',
+                    'Relation Name': 'users',
+                    'Total Cost': 20.0,
+                    'Plan Rows': 1000,
+                    'Actual Rows': 1000,
+                    'Actual Loops': 1,
+                },
+                {
+                    'Node Type': 'Hash',
+                    'Total Cost': 12.0,
+                    'Plan Rows': 5,
+                    'Actual Rows': 5,
+                    'Actual Loops': 1,
+                    'Plans': [
+                        {
+                            'Node Type': 'Seq Scan',
+                            'Relation Name': 'companies',
+                            'Total Cost': 11.0,
+                            'Plan Rows': 5,
+                            'Actual Rows': 5,
+                            'Actual Loops': 1,
+                        }
+                    ],
+                },
+            ],
+        },
+        'Planning Time': 0.1,
+        'Execution Time': 1.5,
+    }
+]
+
+
+def test_plan_summary():
+    summary = PlanSummary(json.dumps(PLAN))
+    assert summary.total_cost == 45.5
+    assert summary.estimated_rows == 10
+    assert summary.actual_rows == 250
+    assert summary.analyzed is True
+    assert summary.planning_time == 0.1
+    assert summary.execution_time == 1.5
+    assert summary.node_types == {'Hash Join': 1, 'Seq Scan': 2, 'Hash': 1}
+    assert summary.seq_scans == ['users', 'companies']
+    assert [n.depth for n in summary.nodes] == [0, 1, 1, 2]
+    assert [n.node_type for n in summary.misestimates()] == ['Hash Join']
+    assert summary.misestimates(factor=100) == []
+    assert repr(summary) == "<PlanSummary total_cost=45.5 nodes=4 seq_scans=['users', 'companies']>"
+    assert repr(summary.nodes[1]) == '<PlanNode Seq Scan on users estimated_rows=1000 actual_rows=1000>'
+
+
+def test_plan_summary_not_analyzed():
+    summary = PlanSummary({'Plan': {'Node Type': 'Result', 'Total Cost': 0.01, 'Plan Rows': 1}})
+    assert summary.analyzed is False
+    assert summary.actual_rows is None
+    assert summary.execution_time is None
+    assert summary.seq_scans == []
+    assert summary.misestimates() == []
+    assert repr(summary.root) == '<PlanNode Result estimated_rows=1>'
+
+
+def test_should_sample():
+    sampler = PlanSampler(print, threshold=0.5)
+    assert sampler.should_sample(0.5) is True
+    assert sampler.should_sample(0.1) is False
+    assert PlanSampler(print, threshold=0, sample_rate=0).should_sample(10) is False
+
+
+class FakeConnection(asyncpg._BuildPgMixin):
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    async def fetch(self, query, *args, timeout=None):
+        self.queries.append((query, args))
+        return []
+
+    async def fetchval(self, query, *args, timeout=None, column=0):
+        self.queries.append((query, args))
+        return json.dumps(PLAN)
+
+
+@pytest.mark.asyncio
+async def test_sampler():
+    sampled = []
+
+    async def callback(query, args, duration, summary):
+        sampled.append((query, args, summary.seq_scans))
+
+    conn = FakeConnection()
+    conn.plan_sampler = PlanSampler(callback, threshold=0)
+    assert await conn.fetch_b('SELECT * FROM users WHERE :where', where=V('id') == 4) == []
+    assert conn.queries == [
+        ('SELECT * FROM users WHERE id = $1', (4,)),
+        ('EXPLAIN (FORMAT JSON) SELECT * FROM users WHERE id = $1', (4,)),
+    ]
+    assert sampled == [('SELECT * FROM users WHERE id = $1', [4], ['users', 'companies'])]
+
+
+@pytest.mark.asyncio
+async def test_sampler_paginate():
+    sampled = []
+
+    async def callback(query, args, duration, summary):
+        sampled.append(query)
+
+    conn = FakeConnection()
+    conn.plan_sampler = PlanSampler(callback, threshold=0)
+    assert [p async for p in conn.paginate_b('SELECT id FROM users WHERE :keyset :order_by', _order_by=['id'])] == []
+    assert sampled == ['SELECT id FROM users WHERE TRUE ORDER BY id']
+
+
+@pytest.mark.asyncio
+async def test_sampler_below_threshold():
+    conn = FakeConnection()
+    conn.plan_sampler = PlanSampler(print, threshold=60)
+    await conn.fetch_b('SELECT 1')
+    assert conn.queries == [('SELECT 1', ())]
+
+
+@pytest.mark.asyncio
+async def test_sampler_callback_error(caplog):
+    def callback(*args):
+        raise RuntimeError('boom')
+
+    conn = FakeConnection()
+    conn.plan_sampler = PlanSampler(callback, threshold=0)
+    await conn.fetch_b('SELECT 1')
+    assert len(conn.queries) == 2
+    assert 'error in plan sampler callback' in caplog.text
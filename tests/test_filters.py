@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+
+from buildpg import V, filters, funcs, render
+from buildpg.filters import FilterError, FilterSet
+
+
+@pytest.fixture(name='user_filters')
+def fix_user_filters():
+    return FilterSet({'created': 'u.created', 'status': 'u.status', 'name': funcs.lower(V('u.name')), 'tags': 'u.tags'})
+
+
+@pytest.mark.parametrize(
+    'filters_,expected_query,expected_params',
+    [
+        ({}, 'TRUE', []),
+        ({'status': 'active'}, 'u.status = $1', ['active']),
+        ({'status__ne': 'active'}, 'u.status != $1', ['active']),
+        ({'created__lt': datetime(2020, 1, 1)}, 'u.created < $1', [datetime(2020, 1, 1)]),
+        ({'created__lte': 1, 'created__gt': 2}, 'u.created > $1 AND u.created <= $2', [2, 1]),
+        ({'created__gte': 1}, 'u.created >= $1', [1]),
+        ({'status__in': ('a', 'b')}, 'u.status = any($1)', [['a', 'b']]),
+        ({'status__in': {'a'}}, 'u.status = any($1)', [['a']]),
+        ({'status__not_in': ['a', 'b']}, 'u.status != all($1)', [['a', 'b']]),
+        ({'name__like': '%x%'}, 'lower(u.name) LIKE $1', ['%x%']),
+        ({'name__ilike': '%x%'}, 'lower(u.name) ILIKE $1', ['%x%']),
+        ({'name__startswith': 'a_b%c\\'}, 'lower(u.name) LIKE $1', ['a\\_b\\%c\\\\%']),
+        ({'tags__contains': ['x']}, 'u.tags @> $1', [['x']]),
+        ({'tags__overlap': ['x']}, 'u.tags && $1', [['x']]),
+        ({'status__isnull': True}, 'u.status IS NULL', []),
+        ({'status__isnull': False, 'name': 'x'}, 'lower(u.name) = $1 AND u.status IS NOT NULL', ['x']),
+    ],
+)
+def test_filters(user_filters, filters_, expected_query, expected_params):
+    assert render(':where', where=user_filters(filters_)) == (expected_query, expected_params)
+
+
+def test_plan_cache(user_filters):
+    q1 = render('SELECT * FROM users u WHERE :w', w=user_filters({'status__in': ['a'], 'created__gte': 1}))
+    q2 = render('SELECT * FROM users u WHERE :w', w=user_filters({'created__gte': 2, 'status__in': ['b', 'c']}))
+    assert q1[0] == q2[0] == 'SELECT * FROM users u WHERE u.created >= $1 AND u.status = any($2)'
+    assert q2[1] == [2, ['b', 'c']]
+    info = user_filters._compile.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+
+def test_field_list():
+    assert render(':w', w=FilterSet(['a', 'b'])({'b': 2, 'a': 1})) == ('a = $1 AND b = $2', [1, 2])
+
+
+@pytest.mark.parametrize(
+    'filters_,msg',
+    [
+        ({'foobar': 1}, 'unknown filter field "foobar"'),
+        ({'status__foobar': 1}, 'invalid lookup "foobar" for "status"'),
+        ({'status__like': 1}, 'invalid lookup "like" for "status"'),
+    ],
+)
+def test_filter_errors(filters_, msg):
+    with pytest.raises(FilterError, match=msg):
+        FilterSet(['status'], lookups=['eq', 'in'])(filters_)
+
+
+def test_invalid_filter_set():
+    with pytest.raises(FilterError, match='unknown lookups: foo'):
+        FilterSet(['a'], lookups=['eq', 'foo'])
+    with pytest.raises(FilterError, match=r'filter columns may not contain parameters: "lower\(\$1\)"'):
+        FilterSet({'a': funcs.lower('x')})
+    assert filters.FilterSet is FilterSet
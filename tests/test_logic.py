@@ -1,6 +1,6 @@
 import pytest
 
-from buildpg import Empty, Func, RawDangerous, S, SqlBlock, V, Var, funcs, render, select_fields
+from buildpg import Empty, Func, RawDangerous, S, SqlBlock, V, Var, funcs, render, select_fields, simplify
 
 args = 'template', 'var', 'expected_query', 'expected_params'
 TESTS = [
@@ -174,3 +174,66 @@ def test_recursion():
     assert query.startswith('$1, $2')
     assert query.endswith('$4998, $4999, $5000')
     assert len(query_args) == 5000
+
+
+def test_reuse_expression():
+    a = V('a')
+    eq = a == 1
+    gt = a > 2
+    assert render(':a, :eq, :gt', a=a, eq=eq, gt=gt) == ('a, a = $1, a > $2', [1, 2])
+    assert isinstance(eq, V)
+
+    both = eq & gt
+    assert render(':both :eq', both=both, eq=eq) == ('a = $1 AND a > $2 a = $3', [1, 2, 1])
+
+
+@pytest.mark.parametrize(
+    'block,expected_query,expected_params',
+    [
+        (lambda: Empty() & (V('a') == 1), 'a = $1', [1]),
+        (lambda: (V('a') == 1) & RawDangerous('TRUE'), 'a = $1', [1]),
+        (lambda: (V('a') == 1) & True, 'a = $1', [1]),
+        (lambda: (V('a') == 1) & False, 'FALSE', []),
+        (lambda: V('a') | S(RawDangerous('true')), 'TRUE', []),
+        (lambda: V('a') & (V('b') & (V('c') | False)), 'a AND b AND c', []),
+        (lambda: (V('a') & S(False)) | V('b'), 'b', []),
+        (lambda: (V('a') | V('b')) & V('c'), '(a OR b) AND c', []),
+        (lambda: funcs.AND(Empty(), Empty()), '', []),
+        (lambda: funcs.AND(True, True), 'TRUE', []),
+        (lambda: funcs.NOT(funcs.NOT(V('x') == 2)), 'x = $1', [2]),
+        (lambda: funcs.NOT(funcs.NOT(V('a') & V('b'))) & V('c'), 'a AND b AND c', []),
+        (lambda: ~S(True), 'FALSE', []),
+        (lambda: V('x') + funcs.upper(funcs.NOT(S(False))), 'x + upper(TRUE)', []),
+        (lambda: V('x') == 4, 'x = $1', [4]),
+        (lambda: select_fields('a'), 'a', []),
+        (lambda: select_fields('a', 'b'), 'a, b', []),
+        (lambda: 42, '$1', [42]),
+    ],
+)
+def test_simplify(block, expected_query, expected_params):
+    assert render(':v', v=simplify(block())) == (expected_query, expected_params)
+
+
+class Column(Var):
+    def __init__(self, table, name):
+        super().__init__(f'{table}.{name}')
+        self.table = table
+
+
+def test_operate_subclass():
+    c = Column('users', 'id')
+    for v in (c == 1, simplify(funcs.NOT(funcs.NOT(c == 1)))):
+        assert isinstance(v, Column)
+        assert v.table == 'users'
+        assert render(':v', v=v) == ('users.id = $1', [1])
+    assert c.op is None
+
+
+def test_simplify_unchanged():
+    a = V('a') == 1
+    b = V('b') > 2
+    both = a & Empty()
+    assert simplify(both) is a
+    assert render(':v', v=both) == ('a = $1 AND ', [1])
+    v = funcs.upper(V('x') == b)
+    assert simplify(v) is v
@@ -1,6 +1,28 @@
+from array import array
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from enum import Enum, IntEnum
+from uuid import UUID
+
 import pytest
 
-from buildpg import BuildError, MultipleValues, Renderer, SetValues, UnsafeError, Values, VarLiteral, render
+from buildpg import (
+    BuildError,
+    MultipleValues,
+    Renderer,
+    SetValues,
+    Template,
+    Typed,
+    UnnestValues,
+    UnsafeError,
+    V,
+    Values,
+    VarLiteral,
+    funcs,
+    infer_type,
+    quote_literal,
+    render,
+)
 
 args = 'template', 'ctx', 'expected_query', 'expected_params'
 TESTS = [
@@ -29,6 +51,38 @@ TESTS = [
         'expected_query': 'multiple values: ($1, $2, $3), ($4, $5, $6)',
         'expected_params': [3, 2, 1, 'i', 'j', 'k'],
     },
+    {
+        'template': 'unnest values: :a :a__names',
+        'ctx': lambda: dict(a=UnnestValues(Values(a=1, b='x'), Values(a=2, b='y'), types={'a': 'int', 'b': 'text'})),
+        'expected_query': 'unnest values: unnest($1::int[], $2::text[]) a, b',
+        'expected_params': [[1, 2], ['x', 'y']],
+    },
+    {
+        'template': 'unnest columns: :a',
+        'ctx': lambda: dict(
+            a=UnnestValues.from_columns(a=[1, 2], b=[3, 4], types={'a': 'int8', 'b': 'numeric(10, 2)'})
+        ),
+        'expected_query': 'unnest columns: unnest($1::int8[], $2::numeric(10, 2)[])',
+        'expected_params': [[1, 2], [3, 4]],
+    },
+    {
+        'template': 'template: :a, :b',
+        'ctx': lambda: dict(a=Template('x = :x AND y = :x AND :z', x=1, z=V('foo') > 2), b=3),
+        'expected_query': 'template: x = $1 AND y = $1 AND foo > $2, $3',
+        'expected_params': [1, 2, 3],
+    },
+    {
+        'template': 'nested template: :a :a',
+        'ctx': lambda: dict(a=Template('(:b, :v__names)', b=Template(':c + :c', c=4), v=Values(a=1))),
+        'expected_query': 'nested template: ($1 + $1, a) ($1 + $1, a)',
+        'expected_params': [4],
+    },
+    {
+        'template': 'template in component: :a',
+        'ctx': lambda: dict(a=V('x') & Template(':c::int = :c', c=4)),
+        'expected_query': 'template in component: x AND $1::int = $1',
+        'expected_params': [4],
+    },
     {
         'template': 'set values: :a',
         'ctx': lambda: dict(a=SetValues(foo=123, bar='b', c='this is a value')),
@@ -100,10 +154,18 @@ def test_different_regex():
     assert params == [1, 2]
 
 
+def test_different_regex_template():
+    r = Renderer(r'(?<![:{])\{([a-z]+)\}')
+    q, params = r('x {a} AND {c}', a=Template('y = {b} AND z = {b}', b=1), c=2)
+    assert q == 'x y = $1 AND z = $1 AND $2'
+    assert params == [1, 2]
+
+
 @pytest.mark.parametrize(
     'query,ctx,msg',
     [
         (':a :b', dict(a=1), 'variable "b" not found in context'),
+        (':a', dict(a=Template(':b')), '"a": variable "b" not found in template context'),
         (':a__names', dict(a=Values(1, 2)), '"a": "names" are not available for nameless values'),
         (
             ':a__missing',
@@ -128,8 +190,204 @@ def test_errors(query, ctx, msg):
         (lambda: MultipleValues(Values(1), 42), ValueError),
         (lambda: MultipleValues(Values(a=1, b=2), Values(b=1, a=2)), ValueError),
         (lambda: MultipleValues(Values(1), Values(1, 2)), ValueError),
+        (lambda: UnnestValues(Values(1), types={}), ValueError),
+        (lambda: UnnestValues(Values(a=1), types={}), ValueError),
+        (lambda: UnnestValues(Values(a=1), Values(b=1), types={'a': 'int'}), ValueError),
+        (lambda: UnnestValues(Values(a=1), types={'a': 'int; drop table x'}), UnsafeError),
+        (lambda: UnnestValues(types={'a': 'int'}), ValueError),
+        (lambda: Typed(1, 'int)'), UnsafeError),
+        (lambda: Typed(1, None), TypeError),
+        (lambda: UnnestValues.from_columns(a=[1], b=[1, 2], types={'a': 'int', 'b': 'int'}), ValueError),
     ],
 )
 def test_other_errors(func, exc):
     with pytest.raises(exc):
         func()
+
+
+def test_unnest_values_no_types():
+    with pytest.raises(ValueError, match='UnnestValues requires types'):
+        UnnestValues(Values(a=1), Values(a=2))
+    with pytest.raises(ValueError, match='UnnestValues requires types'):
+        UnnestValues.from_columns(a=[1, 2])
+
+
+def test_template_str():
+    t = Template('x = :x AND :y AND :v__names', x=1, y=V('a') > 2, v=Values(b=1, c=2))
+    assert str(t) == 'x = 1 AND a > 2 AND b, c'
+
+
+def test_parse_cached():
+    r = Renderer()
+    assert r.parse('a :b c :d__names') == ('a ', ('b', None), ' c ', ('d', 'names'))
+    r('x :a', a=1)
+    r('x :a', a=2)
+    assert r._parse.cache_info().hits == 1
+
+
+@pytest.mark.parametrize(
+    'template,ctx,expected_query,expected_params',
+    [
+        (':a :b :c', dict(a=1, b=1, c=2), '$1 $1 $2', [1, 2]),
+        (':a :b', dict(a=1, b=True), '$1 $2', [1, True]),
+        (':a :b', dict(a=1, b=1.0), '$1 $2', [1, 1.0]),
+        (':a :b', dict(a=Decimal('1.0'), b=Decimal('1.00')), '$1 $2', [Decimal('1.0'), Decimal('1.00')]),
+        (':a :b', dict(a=(1,), b=(1,)), '$1 $2', [(1,), (1,)]),
+        (':a :b', dict(a=[1], b=[1]), '$1 $2', [[1], [1]]),
+        (':a :b', dict(a=V('x') == 't', b=Values('t', 'u', 't')), 'x = $1 ($1, $2, $1)', ['t', 'u']),
+    ],
+)
+def test_dedup_values(template, ctx, expected_query, expected_params):
+    query, params = Renderer(dedup_values=True)(template, **ctx)
+    assert expected_query == query
+    assert expected_params == params
+
+
+@pytest.mark.parametrize(
+    'value,expected',
+    [
+        (True, 'bool'),
+        (1, 'int8'),
+        (2**31, 'int8'),
+        (1.5, 'float8'),
+        (Decimal('1.5'), 'numeric'),
+        ('x', None),
+        (b'x', 'bytea'),
+        (UUID(int=1), 'uuid'),
+        (datetime(2032, 1, 1), 'timestamp'),
+        (datetime(2032, 1, 1, tzinfo=timezone.utc), 'timestamptz'),
+        (date(2032, 1, 1), 'date'),
+        ([1, 2], 'int8[]'),
+        ((None, 'x'), None),
+        ((None, 2), 'int8[]'),
+        ([[1.5], [2.5]], 'float8[]'),
+        ([], None),
+        (array('i', [1]), 'int8[]'),
+        (array('f', [1]), 'float4[]'),
+        (array('d', [1]), 'float8[]'),
+        ([None], None),
+        (None, None),
+        ({'a': 1}, None),
+    ],
+)
+def test_infer_type(value, expected):
+    assert infer_type(value) == expected
+
+
+def test_typed():
+    query, params = render(':a :b', a=Typed([1], 'int8[]'), b=V('x') == Typed(2, 'varchar(20)'))
+    assert query == '$1::int8[] x = $2::varchar(20)'
+    assert params == [[1], 2]
+
+
+def test_typed_renderer():
+    query, params = Renderer(typed=True)(
+        ':a :b :c :d :a', a=1, b=Typed('{}', 'jsonb'), c=None, d=V('x') == funcs.any(['a', 'b'])
+    )
+    assert query == '$1::int8 $2::jsonb $3 x = any($4) $1::int8'
+    assert params == [1, '{}', None, ['a', 'b']]
+
+
+def test_dedup_typed():
+    u = UUID(int=1)
+    query, params = Renderer(dedup_values=True)('SELECT :a, :b, :c', a=Typed(u, 'uuid'), b=u, c=Typed(u, 'uuid'))
+    assert query == 'SELECT $1::uuid, $2, $1::uuid'
+    assert params == [u, u]
+
+
+def test_typed_renderer_stable():
+    # the query doesn't depend on values, so can be rendered once for many rows as executemany_b does
+    r = Renderer(typed=True)
+    assert r(':a :b', a=1, b='x')[0] == r(':a :b', a=2**40, b='2032-01-01')[0] == '$1::int8 $2'
+
+
+def test_array_params():
+    query, params = render(
+        ':a :b', a=array('q', [1, 2, 3]), b=UnnestValues.from_columns(x=array('d', [1.5]), types={'x': 'float8'})
+    )
+    assert query == '$1 unnest($2::float8[])'
+    assert params == [[1, 2, 3], [1.5]]
+    assert type(params[0]) is list
+    assert render.get_params(Values(array('h', [1]))) == [[1]]
+
+
+def test_numpy_params():
+    np = pytest.importorskip('numpy')
+    query, params = Renderer(typed=True)(
+        ':a :b :c :d',
+        a=np.arange(3),
+        b=np.float32(1.5),
+        c=np.zeros((2, 2), dtype=np.float32),
+        d=V('x') == funcs.any(np.array([True, False])),
+    )
+    assert query == '$1::int8[] $2::float4 $3::float4[] x = any($4::bool[])'
+    assert params == [[0, 1, 2], 1.5, [[0.0, 0.0], [0.0, 0.0]], [True, False]]
+    assert type(params[0][0]) is int
+
+
+@pytest.mark.parametrize(
+    'value,expected',
+    [
+        (None, 'NULL'),
+        (True, 'TRUE'),
+        (42, '42'),
+        (-42, ' -42'),
+        (-0.0, ' -0.0'),
+        (Decimal('-1.5'), ' -1.5'),
+        ([-1, 2], 'ARRAY[ -1, 2]'),
+        (1.5, '1.5'),
+        (float('nan'), "'NaN'::float8"),
+        (float('-inf'), "'-Infinity'::float8"),
+        (Decimal('1.50'), '1.50'),
+        ("it's", "'it''s'"),
+        ("back\\slash '", "E'back\\\\slash '''"),
+        (b'\x00\xff', "E'\\\\x00ff'::bytea"),
+        (UUID(int=1), "'00000000-0000-0000-0000-000000000001'::uuid"),
+        (datetime(2032, 1, 1, 12), "'2032-01-01T12:00:00'::timestamp"),
+        (datetime(2032, 1, 1, tzinfo=timezone.utc), "'2032-01-01T00:00:00+00:00'::timestamptz"),
+        (date(2032, 1, 1), "'2032-01-01'::date"),
+        (time(12, 30), "'12:30:00'::time"),
+        (timedelta(days=1, seconds=2), "'1 days 2 seconds 0 microseconds'::interval"),
+        ([1, 'x', None], "ARRAY[1, 'x', NULL]"),
+        ([[1], [2]], 'ARRAY[ARRAY[1], ARRAY[2]]'),
+        ([], "'{}'"),
+        (array('i', [1, 2]), 'ARRAY[1, 2]'),
+    ],
+)
+def test_quote_literal(value, expected):
+    assert quote_literal(value) == expected
+
+
+@pytest.mark.parametrize('value,exc', [(object(), TypeError), ({'a': 1}, TypeError), ('a\x00b', ValueError)])
+def test_quote_literal_errors(value, exc):
+    with pytest.raises(exc):
+        quote_literal(value)
+
+
+class Colour(str, Enum):
+    red = 'red'
+    quote = "it's"
+
+
+class Size(IntEnum):
+    big = 10
+
+
+def test_quote_literal_enum():
+    assert quote_literal(Colour.red) == "'red'"
+    assert quote_literal(Colour.quote) == "'it''s'"
+    assert quote_literal(Size.big) == '10'
+
+
+def test_inline_negative_literal():
+    query, params = Renderer(inline_literals=True)('SELECT 5 -:a, x-:b', a=-1, b=Decimal('-2.5'))
+    assert query == 'SELECT 5 - -1, x- -2.5'
+    assert params == []
+
+
+def test_inline_literals():
+    query, params = Renderer(inline_literals=True)(
+        'SELECT :a FROM t WHERE :b AND c = :c', a=Typed(1, 'int8'), b=V('x').in_(Values('a', "b'")), c="'; drop"
+    )
+    assert query == "SELECT 1::int8 FROM t WHERE x in ('a', 'b''') AND c = '''; drop'"
+    assert params == []
@@ -0,0 +1,184 @@
+import asyncio
+import math
+
+import pytest
+
+from buildpg.pool import CapacityLimiter, Histogram, PoolAutoscaler, PoolMetrics
+
+
+def test_histogram():
+    h = Histogram((1, 5, 10))
+    assert h.quantile(0.5) is None
+    for v in (0.5, 1, 2, 3, 7, 20):
+        h.observe(v)
+    assert h.counts == [2, 2, 1, 1]
+    assert h.count == 6
+    assert h.sum == 33.5
+    assert h.quantile(0.3) == 1
+    assert h.quantile(0.5) == 5
+    assert h.quantile(0.99) == math.inf
+    assert h.snapshot() == {'buckets': {1: 2, 5: 2, 10: 1, math.inf: 1}, 'count': 6, 'sum': 33.5}
+
+
+def test_pool_metrics():
+    m = PoolMetrics()
+    m.record_acquire(0.002, 3)
+    m.record_acquire(0.004, 2)
+    assert m.acquired == 2
+    assert m.window_wait_count == 2
+    assert m.window_wait_sum == pytest.approx(0.006)
+    assert m.window_peak_in_use == 3
+    m.reset_window()
+    assert (m.window_wait_sum, m.window_wait_count, m.window_peak_in_use) == (0, 0, 0)
+    assert m.acquire_wait.count == 2
+
+
+@pytest.mark.asyncio
+async def test_capacity_limiter():
+    limiter = CapacityLimiter(2)
+    await limiter.acquire()
+    await limiter.acquire()
+    assert limiter.in_use == 2
+
+    order = []
+
+    async def waiter(n):
+        await limiter.acquire()
+        order.append(n)
+
+    tasks = [asyncio.ensure_future(waiter(n)) for n in range(3)]
+    await asyncio.sleep(0)
+    assert limiter.waiting == 3
+    limiter.release()
+    await asyncio.sleep(0)
+    assert order == [0]
+    limiter.set_limit(4)
+    await asyncio.sleep(0)
+    assert order == [0, 1, 2]
+    assert limiter.in_use == 4
+    await asyncio.gather(*tasks)
+
+    limiter.set_limit(2)
+    limiter.release()
+    limiter.release()
+    assert limiter.in_use == 2
+    t = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.waiting == 1
+    limiter.release()
+    await t
+    assert limiter.in_use == 2
+
+
+@pytest.mark.asyncio
+async def test_capacity_limiter_priority():
+    limiter = CapacityLimiter(1)
+    await limiter.acquire()
+    order = []
+
+    async def waiter(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+
+    tasks = [
+        asyncio.ensure_future(waiter(name, priority))
+        for name, priority in [('low1', 2), ('normal1', 1), ('low2', 2), ('high', 0), ('normal2', 1)]
+    ]
+    await asyncio.sleep(0)
+    assert limiter.waiting == 5
+    assert limiter.waiting_by_priority() == [1, 2, 2]
+    for _ in range(5):
+        limiter.release()
+        await asyncio.sleep(0)
+    assert order == ['high', 'normal1', 'normal2', 'low1', 'low2']
+    await asyncio.gather(*tasks)
+    assert limiter.in_use == 1
+
+
+@pytest.mark.asyncio
+async def test_capacity_limiter_cancel():
+    limiter = CapacityLimiter(1)
+    await limiter.acquire()
+    t = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    t.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await t
+    assert limiter.waiting == 0
+    limiter.release()
+    assert limiter.in_use == 0
+
+    await limiter.acquire()
+    t = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    # the slot is handed to the waiter, then it's cancelled before it runs
+    limiter.release()
+    t.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await t
+    assert limiter.in_use == 0
+
+
+def test_autoscaler_scale_up():
+    a = PoolAutoscaler(sustained=2, wait_threshold=0.01)
+    assert a.decide(4, 10, 0.05, 4) == 4
+    assert a.decide(4, 10, 0.05, 4) == 6
+    assert a.decide(6, 10, 0.05, 6) == 6
+    assert a.decide(6, 10, 0.05, 6) == 9
+    a.decide(9, 10, 0.05, 9)
+    assert a.decide(9, 10, 0.05, 9) == 10
+
+
+def test_autoscaler_scale_down():
+    a = PoolAutoscaler(sustained=2, min_size=2, idle_ratio=0.5)
+    assert a.decide(10, 10, 0, 2) == 10
+    assert a.decide(10, 10, 0, 2) == 7
+    a.decide(3, 10, 0, 0)
+    assert a.decide(3, 10, 0, 0) == 2
+    a.decide(2, 10, 0, 0)
+    assert a.decide(2, 10, 0, 0) == 2
+
+
+def test_autoscaler_min_size():
+    a = PoolAutoscaler(sustained=1, min_size=2)
+    assert a.decide(8, 10, 0, 0, min_size=6) == 6
+    assert a.decide(6, 10, 0, 0, min_size=6) == 6
+
+
+def test_autoscaler_streak_reset():
+    a = PoolAutoscaler(sustained=2)
+    assert a.decide(4, 10, 0.05, 4) == 4
+    # busy but no waiting resets the streak
+    assert a.decide(4, 10, 0, 4) == 4
+    assert a.decide(4, 10, 0.05, 4) == 4
+    assert a.decide(4, 10, 0, 0) == 4
+    assert a.decide(4, 10, 0.05, 4) == 4
+
+
+class FakePool:
+    def __init__(self, capacity):
+        self.capacity_limiter = CapacityLimiter(capacity)
+        self.pool_metrics = PoolMetrics()
+
+    def get_min_size(self):
+        return 5
+
+    def get_max_size(self):
+        return 10
+
+
+@pytest.mark.asyncio
+async def test_autoscaler_run():
+    pool = FakePool(4)
+    a = PoolAutoscaler(interval=0.05, sustained=1)
+    task = asyncio.ensure_future(a.run(pool))
+    try:
+        pool.pool_metrics.record_acquire(0.5, 4)
+        await asyncio.sleep(0.07)
+        assert pool.capacity_limiter.limit == 6
+        assert pool.pool_metrics.window_wait_count == 0
+        # nothing in use in the next interval, capacity doesn't go below the pool's min_size
+        await asyncio.sleep(0.05)
+        assert pool.capacity_limiter.limit == 5
+    finally:
+        task.cancel()
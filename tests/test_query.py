@@ -1,10 +1,29 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime
+from io import BytesIO
+from typing import NamedTuple
 
 import pytest
 
-from buildpg import MultipleValues, S, V, Values, asyncpg, funcs, render, select_fields
-
-from .conftest import DB_NAME
+from buildpg import (
+    MultipleValues,
+    Renderer,
+    S,
+    UnnestValues,
+    V,
+    Values,
+    asyncpg,
+    clauses,
+    filters,
+    funcs,
+    render,
+    select_fields,
+)
+from buildpg.routing import RangeShardMap, create_routing_pool_b, create_sharded_pool_b
+
+from .conftest import DB_NAME, REPLICA_DB_NAMES
 
 pytestmark = pytest.mark.asyncio
 
@@ -74,6 +93,22 @@ async def test_values_executemany_default(conn):
     assert 6 == await conn.fetchval('SELECT COUNT(*) FROM users')
 
 
+async def test_typed_renderer(conn):
+    conn.renderer = Renderer(typed=True)
+    await conn.execute("CREATE TYPE mood AS ENUM ('happy', 'sad')")
+    await conn.execute('CREATE TABLE typed (id BIGINT, mood mood, data JSONB)')
+    # ints are always int8, so the query rendered from the first row works for larger values in later rows
+    v = [Values(id=1, mood='happy', data='{"a": 1}'), Values(id=2**40, mood='sad', data='[]')]
+    await conn.executemany_b('INSERT INTO typed (:values__names) VALUES :values', v)
+    rows = await conn.fetch_b('SELECT id, data FROM typed WHERE mood = :m ORDER BY id', m='sad')
+    assert [tuple(r) for r in rows] == [(2**40, '[]')]
+
+
+async def test_inline_negative_literal(conn):
+    query, _ = Renderer(inline_literals=True)('SELECT 5 -:a -- comment', a=-1)
+    assert await conn.fetchval(query) == 6
+
+
 async def test_position(conn):
     result = await conn.fetch_b('SELECT :a', a=funcs.position('xx', 'testing xx more'))
     assert [dict(r) for r in result] == [{'position': 9}]
@@ -150,8 +185,612 @@ async def test_coloured_callable(conn):
     assert '\x1b[' in logged_message
 
 
+async def test_pool_metrics():
+    dsn = f'postgresql://postgres@localhost/{DB_NAME}'
+    async with asyncpg.create_pool_b(dsn, min_size=1, max_size=4) as pool:
+        pool.capacity_limiter.set_limit(2)
+
+        async def query():
+            return await pool.fetchval_b('SELECT pg_sleep(0.05)::text || :v', v='x')
+
+        assert await asyncio.gather(*[query() for _ in range(4)]) == ['x'] * 4
+
+        m = pool.metrics()
+        assert m['acquired'] == 4
+        assert m['acquire_wait']['count'] == 4
+        # two queries had to wait for the first two to finish
+        assert m['acquire_wait']['sum'] >= 0.09
+        assert m['in_use'] == 0
+        assert m['capacity'] == 2
+        assert m['waiting'] == 0
+        assert m['size'] <= 4
+
+
+async def test_pool_autoscaler():
+    dsn = f'postgresql://postgres@localhost/{DB_NAME}'
+    autoscaler = asyncpg.PoolAutoscaler(interval=0.01, sustained=1)
+    async with asyncpg.create_pool_b(dsn, min_size=1, max_size=4, autoscaler=autoscaler) as pool:
+        await asyncio.sleep(0.05)
+        assert pool.metrics()['capacity'] == 1
+        assert pool._autoscale_task is not None
+    assert pool._autoscale_task is None
+
+
+async def test_pool_autoscaler_min_size():
+    dsn = f'postgresql://postgres@localhost/{DB_NAME}'
+    with pytest.raises(ValueError, match='autoscaler requires min_size to be less than max_size'):
+        asyncpg.create_pool_b(dsn, autoscaler=asyncpg.PoolAutoscaler())
+
+
+async def test_pool_limits_options():
+    pool = asyncpg.create_pool_b(f'postgresql://postgres@localhost/{DB_NAME}', tag_limits={'reports': 2})
+    assert asyncpg._acquire_options.get() == (1, None)
+    with pool.limits(priority='low'):
+        assert asyncpg._acquire_options.get() == (2, None)
+        with pool.limits(tag='reports'):
+            assert asyncpg._acquire_options.get() == (2, 'reports')
+        with pool.limits(priority='high'):
+            assert asyncpg._acquire_options.get() == (0, None)
+    assert asyncpg._acquire_options.get() == (1, None)
+    with pytest.raises(ValueError, match='priority must be one of high, normal, low, not "urgent"'):
+        with pool.limits(priority='urgent'):
+            pass
+
+
+async def test_pool_tag_limits():
+    dsn = f'postgresql://postgres@localhost/{DB_NAME}'
+    report = 'SELECT pg_sleep(0.05)::text || :v'
+    async with asyncpg.create_pool_b(dsn, min_size=1, max_size=4, tag_limits={'slow': 1, report: 2}) as pool:
+        peak = {'slow': 0, report: 0}
+
+        async def query(tag=None):
+            r = await pool.fetchval_b(report, v='x', _tag=tag)
+            t = tag or report
+            peak[t] = max(peak[t], pool.tag_limiters[t].in_use)
+            return r
+
+        async def watch():
+            for _ in range(20):
+                for t, limiter in pool.tag_limiters.items():
+                    peak[t] = max(peak[t], limiter.in_use)
+                await asyncio.sleep(0.01)
+
+        results = await asyncio.gather(*[query() for _ in range(4)], query('slow'), query('slow'), watch())
+        assert results[:6] == ['x'] * 6
+        assert peak == {'slow': 1, report: 2}
+        assert pool.metrics()['tags'] == {
+            'slow': {'limit': 1, 'in_use': 0, 'waiting': 0},
+            report: {'limit': 2, 'in_use': 0, 'waiting': 0},
+        }
+
+
+async def test_pool_priority():
+    dsn = f'postgresql://postgres@localhost/{DB_NAME}'
+    async with asyncpg.create_pool_b(dsn, min_size=1, max_size=1) as pool:
+        order = []
+
+        async def query(name, priority):
+            await pool.fetchval_b('SELECT pg_sleep(0.02)', _priority=priority)
+            order.append(name)
+
+        first = asyncio.ensure_future(query('first', None))
+        await asyncio.sleep(0.005)
+        await asyncio.gather(first, query('low', 'low'), query('normal', None), query('high', 'high'))
+        assert order == ['first', 'high', 'normal', 'low']
+
+        async with pool.acquire():
+            with pool.limits(priority='low'):
+                task = asyncio.ensure_future(pool.fetchval_b('SELECT 1'))
+            await asyncio.sleep(0.005)
+            assert pool.metrics()['waiting_by_priority'] == {'high': 0, 'normal': 0, 'low': 1}
+        assert await task == 1
+
+
+async def test_deadline_timeout():
+    assert asyncpg.remaining_time() is None
+    assert asyncpg._deadline_timeout(5) == 5
+    with asyncpg.deadline(10):
+        assert 9 < asyncpg.remaining_time() <= 10
+        assert asyncpg._deadline_timeout(5) == 5
+        assert 9 < asyncpg._deadline_timeout(None) <= 10
+        assert 9 < asyncpg._deadline_timeout(20) <= 10
+        with asyncpg.deadline(1):
+            assert asyncpg.remaining_time() <= 1
+        with asyncpg.deadline(100):
+            # nested deadlines can't extend the outer one
+            assert asyncpg.remaining_time() <= 10
+    assert asyncpg.remaining_time() is None
+
+
+async def test_deadline_exceeded(conn):
+    with asyncpg.deadline(0):
+        assert asyncpg.remaining_time() == 0
+        with pytest.raises(asyncpg.DeadlineExceeded, match='query deadline exceeded'):
+            await conn.fetchval_b('SELECT 1')
+        with pytest.raises(asyncio.TimeoutError):
+            await conn.execute_b('SELECT 1')
+    assert await conn.fetchval_b('SELECT 1') == 1
+
+
+async def test_deadline_pool_no_acquire():
+    async with asyncpg.create_pool_b(f'postgresql://postgres@localhost/{DB_NAME}', min_size=1, max_size=2) as pool:
+        with asyncpg.deadline(0):
+            with pytest.raises(asyncpg.DeadlineExceeded):
+                await pool.fetch_b('SELECT 1')
+            with pytest.raises(asyncpg.DeadlineExceeded):
+                async for _ in pool.iter_b('SELECT 1'):
+                    pass
+        assert pool.metrics()['acquired'] == 0
+
+
+async def test_deadline_query_timeout(db):
+    # not using the conn fixture: a timeout inside its transaction would abort it
+    conn = await asyncpg.connect_b(f'postgresql://postgres@localhost/{DB_NAME}')
+    try:
+        with asyncpg.deadline(0.1):
+            with pytest.raises(asyncio.TimeoutError):
+                await conn.execute_b('SELECT pg_sleep(:s)', s=1)
+        assert await conn.fetchval_b('SELECT 1') == 1
+    finally:
+        await conn.close()
+
+
+async def test_deadline_statement_timeout(db):
+    # statement_timeout is only set when iter_b starts the transaction itself
+    conn = await asyncpg.connect_b(f'postgresql://postgres@localhost/{DB_NAME}')
+    try:
+        assert await conn.fetchval_b("SELECT current_setting('statement_timeout')") == '0'
+        with asyncpg.deadline(5):
+            rows = [r async for r in conn.iter_b("SELECT current_setting('statement_timeout') AS t")]
+        value = rows[0]['t']
+        assert value == '5s' or 4000 < int(value.rstrip('ms')) < 5000
+        # SET LOCAL only applies to the transaction
+        assert await conn.fetchval_b("SELECT current_setting('statement_timeout')") == '0'
+    finally:
+        await conn.close()
+
+
 async def test_pool_fetch():
     async with asyncpg.create_pool_b(f'postgresql://postgres@localhost/{DB_NAME}') as pool:
         v = await pool.fetchval_b('SELECT :v FROM users ORDER BY id LIMIT 1', v=funcs.right(V('first_name'), 3))
 
     assert v == 'red'
+
+
+async def test_fetch_columns(conn):
+    columns = await conn.fetch_columns_b(
+        'SELECT id, first_name, value, :v AS nullable FROM users ORDER BY id', v=funcs.cast(None, 'int'), _batch_size=2
+    )
+    assert list(columns) == ['id', 'first_name', 'value', 'nullable']
+    assert list(columns['id']) == [1, 2, 3]
+    assert columns['first_name'] == ['Fred', 'Franks', 'Joe']
+    assert list(columns['value']) == [-10, 44, 1000]
+    assert columns['nullable'] == [None, None, None]
+
+
+async def test_pool_fetch_columns():
+    async with asyncpg.create_pool_b(f'postgresql://postgres@localhost/{DB_NAME}') as pool:
+        columns = await pool.fetch_columns_b('SELECT value FROM users ORDER BY id')
+
+    assert list(columns['value']) == [-10, 44, 1000]
+
+
+async def test_iter(conn):
+    results = []
+    async for r in conn.iter_b('SELECT :s FROM users ORDER BY id', s=select_fields('first_name'), _batch_size=2):
+        results.append(r['first_name'])
+    assert results == ['Fred', 'Franks', 'Joe']
+
+
+async def test_iter_batches(conn):
+    batches = []
+    async for rows in conn.iter_b('SELECT id FROM users ORDER BY id', _batch_size=2, _batches=True):
+        batches.append([r[0] for r in rows])
+    assert batches == [[1, 2], [3]]
+
+
+async def test_pool_iter():
+    async with asyncpg.create_pool_b(f'postgresql://postgres@localhost/{DB_NAME}') as pool:
+        results = [r[0] async for r in pool.iter_b('SELECT id FROM users WHERE :w ORDER BY id', w=V('value') > 0)]
+
+    assert results == [2, 3]
+
+
+async def test_paginate(conn):
+    pages = []
+    q = 'SELECT id, first_name FROM users WHERE :keyset AND value < 5000 :order_by :limit'
+    async for page in conn.paginate_b(q, _order_by=clauses.OrderBy(V('users.first_name').desc(), 'id'), _page_size=2):
+        pages.append([r['first_name'] for r in page])
+    assert pages == [['Joe', 'Fred'], ['Franks']]
+
+
+async def test_paginate_nulls(conn):
+    rows = "VALUES (1, 'a'), (2, NULL), (3, 'b'), (4, NULL)"
+    q = f'SELECT id, name FROM ({rows}) AS t (id, name) WHERE :keyset :order_by :limit'
+    order_by = clauses.OrderBy('name', V('id').desc())
+    pages = [[r['id'] for r in page] async for page in conn.paginate_b(q, _order_by=order_by, _page_size=1)]
+    assert pages == [[1], [3], [4], [2]]
+
+
+async def test_update_from(conn):
+    values = MultipleValues(Values(id=1, value=10), Values(id=3, value=30))
+    await conn.execute_b(':u', u=clauses.UpdateFrom('users', values, types={'id': 'int', 'value': 'int'}))
+    assert [(1, 10), (2, 44), (3, 30)] == [
+        tuple(r) for r in await conn.fetch('SELECT id, value FROM users ORDER BY id')
+    ]
+
+
+async def test_update_from_unnest(conn):
+    values = UnnestValues.from_columns(id=[1, 2], value=[11, 22], types={'id': 'int', 'value': 'int'})
+    for update in clauses.UpdateFrom('users', values).chunks(1):
+        await conn.execute_b(':u', u=update)
+    assert [(1, 11), (2, 22), (3, 1000)] == [
+        tuple(r) for r in await conn.fetch('SELECT id, value FROM users ORDER BY id')
+    ]
+
+
+async def test_upsert_many(conn):
+    values = [Values(name='foobar', description='updated'), Values(name='new', description='inserted')]
+    count = await conn.upsert_many_b(
+        'companies', values, conflict=['name'], types={'name': 'text', 'description': 'text'}, chunk_size=1
+    )
+    assert count == 2
+    rows = await conn.fetch('SELECT name, description FROM companies ORDER BY id')
+    assert [tuple(r) for r in rows] == [
+        ('foobar', 'updated'),
+        ('egg plant', 'this is some more test data'),
+        ('new', 'inserted'),
+    ]
+
+
+async def test_upsert_many_conflict_str(conn):
+    values = [Values(name='foobar', description='updated')]
+    count = await conn.upsert_many_b(
+        'companies', values, conflict='name', types={'name': 'text', 'description': 'text'}
+    )
+    assert count == 1
+    assert await conn.fetchval("SELECT description FROM companies WHERE name='foobar'") == 'updated'
+
+
+async def test_upsert_many_empty(conn):
+    assert 0 == await conn.upsert_many_b('companies', [], conflict='name')
+    values = UnnestValues.from_columns(name=[], types={'name': 'text'})
+    assert 0 == await conn.upsert_many_b('companies', values, conflict='name')
+    assert 2 == await conn.fetchval('SELECT COUNT(*) FROM companies')
+
+
+async def test_upsert_many_do_nothing(conn):
+    values = UnnestValues.from_columns(name=['foobar', 'other'], types={'name': 'text'})
+    assert 1 == await conn.upsert_many_b('companies', values, conflict=['name'], update=[])
+    assert 3 == await conn.fetchval('SELECT COUNT(*) FROM companies')
+
+
+async def test_with(conn):
+    w = clauses.With(
+        render('SELECT id, first_name FROM new_user'),
+        new_company=render('INSERT INTO companies (name) VALUES (:name) RETURNING id', name='new co'),
+        new_user=render(
+            'INSERT INTO users (company, first_name) SELECT id, :first_name FROM new_company RETURNING *',
+            first_name='anne',
+        ),
+    )
+    row = await conn.fetchrow_b(':w', w=w)
+    assert row['first_name'] == 'anne'
+    assert 'new co' == await conn.fetchval(
+        'SELECT c.name FROM users u JOIN companies c ON u.company = c.id WHERE u.id = $1', row['id']
+    )
+
+
+async def test_custom_renderer():
+    class DedupRenderer(asyncpg._BuildPgMixin):
+        renderer = Renderer(dedup_values=True)
+
+    query, params = DedupRenderer().print_b('SELECT :a, :b', a=V('x') == 42, b=42, print_=False)
+    assert query == 'SELECT x = $1, $1'
+    assert params == [42]
+
+
+async def test_copy_out(conn):
+    output = BytesIO()
+    await conn.copy_out_b(
+        'SELECT first_name, value FROM users WHERE :where ORDER BY id',
+        where=(V('value') > 0) & (V('first_name') != "it's"),
+        output=output,
+        _copy_options={'format': 'csv', 'header': True},
+    )
+    assert output.getvalue().decode() == 'first_name,value\nFranks,44\nJoe,1000\n'
+
+
+async def test_pool_copy_out():
+    chunks = []
+
+    async def sink(chunk):
+        chunks.append(chunk)
+
+    async with asyncpg.create_pool_b(f'postgresql://postgres@localhost/{DB_NAME}') as pool:
+        await pool.copy_out_b('SELECT id FROM users WHERE id = :id', id=2, output=sink)
+
+    assert b''.join(chunks) == b'2\n'
+
+
+async def test_explain(conn):
+    summary = await conn.explain_b('SELECT * FROM users WHERE :where', where=V('first_name') == 'Fred')
+    assert summary.node_types == {'Seq Scan': 1}
+    assert summary.seq_scans == ['users']
+    assert summary.analyzed is False
+    assert summary.total_cost > 0
+
+
+async def test_explain_analyze_rolls_back(conn):
+    summary = await conn.explain_b('DELETE FROM users WHERE id = :id', id=1, _analyze=True, _buffers=True)
+    assert summary.analyzed is True
+    assert summary.execution_time is not None
+    assert await conn.fetchval('SELECT COUNT(*) FROM users WHERE id = 1') == 1
+
+
+async def test_routing_pool(db):
+    async with create_routing_pool_b(
+        f'postgresql://postgres@localhost/{DB_NAME}',
+        [f'postgresql://postgres@localhost/{name}' for name in REPLICA_DB_NAMES],
+        min_size=1,
+        max_size=2,
+    ) as pool:
+        query = 'SELECT current_database()'
+        assert [await pool.fetchval_b(query) for _ in range(3)] == [*REPLICA_DB_NAMES, REPLICA_DB_NAMES[0]]
+        assert await pool.fetchval_b(query, _primary=True) == DB_NAME
+        with pool.use_primary():
+            assert await pool.fetchrow_b(query) == (DB_NAME,)
+        assert await pool.execute_b('SELECT 1') == 'SELECT 1'
+        async with pool.acquire(readonly=True) as conn:
+            assert await conn.fetchval(query) == REPLICA_DB_NAMES[1]
+
+
+async def test_sharded_pool(db):
+    names = [DB_NAME, *REPLICA_DB_NAMES]
+    async with create_sharded_pool_b(
+        [f'postgresql://postgres@localhost/{name}' for name in names],
+        shard_key='tenant_id',
+        shard_map=RangeShardMap([100, 200]),
+        min_size=1,
+        max_size=2,
+    ) as pool:
+        assert await pool.fetchval_b('SELECT current_database(), :tenant_id::int', tenant_id=150) == REPLICA_DB_NAMES[0]
+        rows = await pool.scatter_fetch_b(
+            'SELECT current_database() AS name, :x::int AS x ORDER BY name DESC', x=1, _order_by=[V('name').desc()]
+        )
+        assert [tuple(r) for r in rows] == [(name, 1) for name in sorted(names, reverse=True)]
+
+
+async def test_filters(conn):
+    user_filters = filters.FilterSet({'first_name': 'u.first_name', 'value': 'u.value'})
+    where = user_filters({'first_name__in': ['Fred', 'Joe', 'Anne'], 'value__gte': 0})
+    assert await conn.fetchval_b('SELECT array_agg(u.first_name) FROM users u WHERE :where', where=where) == ['Joe']
+
+
+@dataclass
+class User:
+    __slots__ = 'id', 'first_name', 'value'
+    id: int
+    first_name: str
+    value: int
+
+
+class UserTuple(NamedTuple):
+    first_name: str
+    last_name: str = 'unknown'
+
+
+async def test_fetch_as(conn):
+    users = await conn.fetch_as_b(User, 'SELECT :fields FROM users WHERE value > :v ORDER BY id', v=0)
+    assert users == [User(2, 'Franks', 44), User(3, 'Joe', 1000)]
+    users = await conn.fetch_as_b(User, 'SELECT value, first_name, id FROM users ORDER BY id LIMIT 1')
+    assert users == [User(1, 'Fred', -10)]
+    assert await conn.fetch_as_b(User, 'SELECT :fields FROM users WHERE false') == []
+
+
+async def test_fetchrow_as(conn):
+    user = await conn.fetchrow_as_b(UserTuple, 'SELECT :fields FROM users WHERE id = :id', id=3)
+    assert user == UserTuple('Joe', None)
+    user = await conn.fetchrow_as_b(UserTuple, 'SELECT first_name, value FROM users WHERE id = :id', id=3)
+    assert user == UserTuple('Joe')
+    assert await conn.fetchrow_as_b(UserTuple, 'SELECT :fields FROM users WHERE id = -1') is None
+
+
+class FakeRecord(tuple):
+    def __new__(cls, **kwargs):
+        r = super().__new__(cls, kwargs.values())
+        r._keys = tuple(kwargs)
+        return r
+
+    def keys(self):
+        return iter(self._keys)
+
+
+async def test_fetch_as_constructor():
+    queries = []
+
+    class FakeConnection(asyncpg._BuildPgMixin):
+        async def fetch(self, query, *args, timeout=None):
+            queries.append(query)
+            return [FakeRecord(first_name='a', value=1, id=2), FakeRecord(first_name='b', value=3, id=4)]
+
+    users = await FakeConnection().fetch_as_b(User, 'SELECT :fields FROM users')
+    assert users == [User(2, 'a', 1), User(4, 'b', 3)]
+    assert queries == ['SELECT id, first_name, value FROM users']
+
+    with pytest.raises(TypeError, match='is not a dataclass or namedtuple'):
+        await FakeConnection().fetch_as_b(dict, 'SELECT 1')
+
+
+class FakeIngestPool:
+    ingest_b = asyncpg.BuildPgPool.ingest_b
+    _copy_batch = staticmethod(asyncpg.BuildPgPool._copy_batch)
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.limits = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_on = fail_on
+
+    @asynccontextmanager
+    async def _connection(self, priority=None, tag=None, query_template=None):
+        self.limits.add((priority, tag))
+        yield self
+
+    async def copy_records_to_table(self, table, *, records, columns, schema_name, timeout):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if records[0][0] == self.fail_on:
+                raise RuntimeError('copy failed')
+            self.batches.append((schema_name, table, columns, list(records)))
+        finally:
+            self.in_flight -= 1
+
+
+async def test_ingest_backpressure():
+    pool = FakeIngestPool()
+    produced = []
+
+    async def rows():
+        for i in range(25):
+            produced.append(i)
+            # the producer can get at most max_in_flight + 1 batches ahead of completed batches
+            assert len(produced) <= (len(pool.batches) + 3) * 5
+            yield i, f'name {i}'
+
+    count = await pool.ingest_b(
+        'public.users', ['id', 'name'], rows(), batch_size=5, max_in_flight=2, priority='low', tag='ingest'
+    )
+    assert count == 25
+    assert pool.limits == {('low', 'ingest')}
+    assert pool.max_in_flight == 2
+    assert sorted(r[0] for b in pool.batches for r in b[3]) == list(range(25))
+    assert {b[:3] for b in pool.batches} == {('public', 'users', ('id', 'name'))}
+
+
+async def test_ingest_error():
+    pool = FakeIngestPool(fail_on=10)
+    with pytest.raises(RuntimeError, match='copy failed'):
+        await pool.ingest_b('users', ['id'], [(i,) for i in range(100)], batch_size=5, max_in_flight=2)
+    assert len(pool.batches) < 19
+    assert pool.in_flight == 0
+
+
+async def test_ingest(db):
+    async with asyncpg.create_pool_b(f'postgresql://postgres@localhost/{DB_NAME}', min_size=2, max_size=4) as pool:
+        await pool.execute('DROP TABLE IF EXISTS ingest; CREATE TABLE ingest (id int, name text)')
+        try:
+
+            async def rows():
+                for i in range(1050):
+                    yield i, f'name {i}'
+
+            assert await pool.ingest_b('ingest', ['id', 'name'], rows(), batch_size=100) == 1050
+            assert await pool.ingest_b('ingest', ['id', 'name'], [(-1, 'x')], types={'id': 'int', 'name': 'text'}) == 1
+            assert await pool.fetchval('SELECT count(*) FROM ingest') == 1051
+            assert await pool.fetchval('SELECT name FROM ingest WHERE id = -1') == 'x'
+        finally:
+            await pool.execute('DROP TABLE ingest')
+
+
+def bulk_row(i):
+    return i, f'name {i}', [i, i * 2], None
+
+
+async def test_bulk_load(db):
+    async with asyncpg.create_pool_b(f'postgresql://postgres@localhost/{DB_NAME}', min_size=2, max_size=4) as pool:
+        await pool.execute('DROP TABLE IF EXISTS bulk; CREATE TABLE bulk (id int, name text, a int[], d date)')
+        try:
+            count = await pool.bulk_load_b('bulk', ['id', 'name', 'a', 'd'], range(1000), bulk_row, chunk_size=300)
+            assert count == 1000
+            assert await pool.fetchval('SELECT count(*) FROM bulk') == 1000
+            assert tuple(await pool.fetchrow('SELECT * FROM bulk WHERE id = 5')) == (5, 'name 5', [5, 10], None)
+        finally:
+            await pool.execute('DROP TABLE bulk')
+
+
+async def test_adaptive_batch_size():
+    batch_size = asyncpg.AdaptiveBatchSize(100, min_size=10, max_size=1000, target_latency=0.5)
+    # 1ms per row, ideal is 500 rows but size can only double
+    batch_size.record(100, 0.1)
+    assert batch_size.size == 200
+    batch_size.record(200, 0.2)
+    assert batch_size.size == 400
+    batch_size.record(400, 0.4)
+    assert batch_size.size == 500
+    # the server slows down to 10ms per row
+    batch_size.record(500, 5)
+    assert batch_size.size == 250
+    assert batch_size.metrics() == {
+        'size': 250,
+        'batches': 4,
+        'rows': 1200,
+        'last_latency': 5,
+        'rows_per_second': pytest.approx(1 / 0.0037),
+    }
+    for _ in range(10):
+        batch_size.record(batch_size.size, batch_size.size * 0.01)
+    assert batch_size.size == 50
+    batch_size.record(50, 50)
+    assert batch_size.size == 25
+    batch_size.record(25, 100)
+    assert batch_size.size == 12
+    batch_size.record(12, 100)
+    assert batch_size.size == 10
+    assert repr(batch_size).startswith('<AdaptiveBatchSize size=10 rows_per_second=')
+
+    with pytest.raises(ValueError, match='sizes must satisfy 1 <= min_size <= initial <= max_size'):
+        asyncpg.AdaptiveBatchSize(10, min_size=100)
+
+
+async def test_executemany_batches():
+    class FakeConnection(asyncpg._BuildPgMixin):
+        def __init__(self):
+            super().__init__()
+            self.batches = []
+
+        def is_in_transaction(self):
+            return True
+
+        async def executemany(self, query, args, *, timeout=None):
+            self.batches.append(len(args))
+
+    conn = FakeConnection()
+    rows = [Values(a=i) for i in range(100)]
+    await conn.executemany_b('INSERT INTO t (:values__names) VALUES :values', rows, batch_size=30)
+    assert conn.batches == [30, 30, 30, 10]
+
+    conn = FakeConnection()
+    batch_size = asyncpg.AdaptiveBatchSize(10, min_size=10, target_latency=60)
+    await conn.executemany_b('INSERT INTO t (:values__names) VALUES :values', rows, batch_size=batch_size)
+    assert conn.batches == [10, 20, 40, 30]
+    assert batch_size.metrics()['rows'] == 100
+    assert batch_size.metrics()['batches'] == 4
+
+
+async def test_chunks_adaptive():
+    batch_size = asyncpg.AdaptiveBatchSize(2, min_size=2, target_latency=1)
+    chunks = []
+    for chunk in MultipleValues(*[Values(i) for i in range(10)]).chunks(batch_size):
+        chunks.append(len(chunk.rows))
+        batch_size.record(len(chunk.rows), 0.01)
+    assert chunks == [2, 4, 4]
+    with pytest.raises(ValueError, match='chunk size must be at least 1'):
+        list(MultipleValues(Values(1)).chunks(0))
+
+
+async def test_upsert_many_adaptive(conn):
+    batch_size = asyncpg.AdaptiveBatchSize(10, min_size=10)
+    count = await conn.upsert_many_b(
+        'companies',
+        [Values(id=i, name=f'c {i}') for i in range(100, 200)],
+        conflict=['id'],
+        types={'id': 'int', 'name': 'text'},
+        chunk_size=batch_size,
+    )
+    assert count == 100
+    assert batch_size.rows == 100
+    assert batch_size.batches < 10
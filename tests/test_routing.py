@@ -0,0 +1,197 @@
+import asyncio
+
+import pytest
+
+from buildpg import V, asyncpg, clauses, render
+from buildpg.routing import HashShardMap, RangeShardMap, RoutingPool, ShardedPool
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakePool:
+    def __init__(self, name, rows=()):
+        self.name = name
+        self.rows = list(rows)
+        self.queries = []
+        self.closed = False
+
+    async def fetch_b(self, query_template, *, _timeout=None, _priority=None, _tag=None, print_=False, **kwargs):
+        query, args = render(query_template, **kwargs)
+        self.queries.append((query, tuple(args)))
+        self.timeout = _timeout
+        self.limits = _priority, _tag
+        return self.rows
+
+    async def fetchval_b(self, query_template, **kwargs):
+        self.queries.append(query_template)
+        await asyncio.sleep(kwargs.get('sleep', 0))
+        return self.name
+
+    async def execute_b(self, query_template, **kwargs):
+        self.queries.append(query_template)
+        return 'EXECUTE'
+
+    async def explain_b(self, query_template, *, _analyze=False, **kwargs):
+        self.queries.append(query_template)
+        return self.name, _analyze
+
+    async def iter_b(self, query_template, **kwargs):
+        self.queries.append(query_template)
+        for i in range(3):
+            yield self.name, i
+
+    async def _init(self):
+        return self
+
+    def __await__(self):
+        return self._init().__await__()
+
+    async def close(self):
+        self.closed = True
+
+
+def routing_pool(strategy='round_robin', replicas=2):
+    return RoutingPool(FakePool('primary'), [FakePool(f'r{i}') for i in range(replicas)], strategy=strategy)
+
+
+async def test_round_robin():
+    pool = routing_pool()
+    assert [await pool.fetchval_b('SELECT 1') for _ in range(5)] == ['r0', 'r1', 'r0', 'r1', 'r0']
+    assert await pool.execute_b('UPDATE x') == 'EXECUTE'
+    assert pool.primary.queries == ['UPDATE x']
+
+
+async def test_primary_override():
+    pool = routing_pool()
+    assert await pool.fetchval_b('SELECT 1', _primary=True) == 'primary'
+    with pool.use_primary():
+        assert await pool.fetchval_b('SELECT 1') == 'primary'
+    assert await pool.fetchval_b('SELECT 1') == 'r0'
+
+
+async def test_primary_override_per_pool():
+    pool_a, pool_b = routing_pool(), routing_pool()
+    with pool_a.use_primary():
+        assert await pool_a.fetchval_b('SELECT 1') == 'primary'
+        assert await pool_b.fetchval_b('SELECT 1') == 'r0'
+        with pool_b.use_primary():
+            assert await pool_a.fetchval_b('SELECT 1') == 'primary'
+            assert await pool_b.fetchval_b('SELECT 1') == 'primary'
+        assert await pool_a.fetchval_b('SELECT 1') == 'primary'
+        assert await pool_b.fetchval_b('SELECT 1') == 'r1'
+    assert await pool_a.fetchval_b('SELECT 1') == 'r0'
+
+
+async def test_explain():
+    pool = routing_pool()
+    assert await pool.explain_b('SELECT 1') == ('r0', False)
+    assert await pool.explain_b('SELECT 1', _primary=True) == ('primary', False)
+    assert await pool.explain_b('DELETE FROM x', _analyze=True) == ('primary', True)
+
+
+async def test_no_replicas():
+    pool = routing_pool(replicas=0)
+    assert await pool.fetchval_b('SELECT 1') == 'primary'
+
+
+async def test_least_busy():
+    pool = routing_pool('least_busy', replicas=3)
+    slow = asyncio.ensure_future(pool.fetchval_b('SELECT 1', sleep=0.05))
+    await asyncio.sleep(0)
+    assert pool._in_flight == [1, 0, 0]
+    assert [await pool.fetchval_b('SELECT 1') for _ in range(4)] == ['r1', 'r2', 'r1', 'r1']
+    assert await slow == 'r0'
+    assert pool._in_flight == [0, 0, 0]
+
+
+async def test_iter():
+    pool = routing_pool()
+    assert [r async for r in pool.iter_b('SELECT 1')] == [('r0', 0), ('r0', 1), ('r0', 2)]
+    gen = pool.iter_b('SELECT 1')
+    assert await gen.__anext__() == ('r1', 0)
+    assert pool._in_flight == [0, 1]
+    await gen.aclose()
+    assert pool._in_flight == [0, 0]
+
+
+async def test_close():
+    pool = routing_pool()
+    async with pool:
+        pass
+    assert all(p.closed for p in pool.pools)
+
+
+async def test_invalid_strategy():
+    with pytest.raises(ValueError, match='strategy must be one of round_robin, least_busy, not "random"'):
+        routing_pool('random')
+
+
+async def test_hash_shard_map():
+    shard_map = HashShardMap(3)
+    assert [shard_map(k) for k in (0, 1, 2, 3, 10)] == [0, 1, 2, 0, 1]
+    assert shard_map('foobar') == shard_map('foobar') == 2
+
+
+async def test_range_shard_map():
+    shard_map = RangeShardMap([1000, 2000])
+    assert [shard_map(k) for k in (0, 999, 1000, 1999, 2000, 10**9)] == [0, 0, 1, 1, 2, 2]
+    with pytest.raises(ValueError, match='bounds must be sorted'):
+        RangeShardMap([2, 1])
+
+
+async def test_sharded_routing():
+    pool = ShardedPool([FakePool('s0'), FakePool('s1')], shard_key='tenant_id')
+    assert await pool.fetchval_b('SELECT :tenant_id', tenant_id=3) == 's1'
+    assert await pool.fetchval_b('SELECT :tenant_id', tenant_id=4) == 's0'
+    assert await pool.fetchval_b('SELECT 1', _shard=5) == 's1'
+    assert pool.pool_for(6).name == 's0'
+    with pytest.raises(ValueError, match='shard key "tenant_id" not found in the render context'):
+        await pool.fetchval_b('SELECT 1')
+
+
+async def test_scatter_fetch():
+    pool = ShardedPool(
+        [FakePool('s0', [{'id': 1}, {'id': 4}]), FakePool('s1', [{'id': 2}]), FakePool('s2', [{'id': 3}])],
+        shard_key='tenant_id',
+    )
+    rows = await pool.scatter_fetch_b('SELECT id FROM t WHERE :where', where=V('x') == 4)
+    assert rows == [{'id': 1}, {'id': 4}, {'id': 2}, {'id': 3}]
+    assert all(p.queries == [('SELECT id FROM t WHERE x = $1', (4,))] for p in pool.pools)
+
+    rows = await pool.scatter_fetch_b('SELECT id FROM t ORDER BY id', _order_by=['id'])
+    assert rows == [{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4}]
+
+    rows = await pool.scatter_fetch_b('SELECT id FROM t ORDER BY id', _order_by=clauses.OrderBy('id'), _limit=2)
+    assert rows == [{'id': 1}, {'id': 2}]
+    assert all(p.limits == (None, None) for p in pool.pools)
+
+    await pool.scatter_fetch_b('SELECT 1', _priority='low', _tag='reports')
+    assert all(p.limits == ('low', 'reports') for p in pool.pools)
+
+
+async def test_scatter_fetch_deadline():
+    pool = ShardedPool([FakePool('s0'), FakePool('s1')], shard_key='tenant_id')
+    with asyncpg.deadline(5):
+        await pool.scatter_fetch_b('SELECT 1', _timeout=10)
+    assert all(4 < p.timeout <= 5 for p in pool.pools)
+
+    with asyncpg.deadline(0):
+        with pytest.raises(asyncpg.DeadlineExceeded):
+            await pool.scatter_fetch_b('SELECT 2')
+    assert all(p.queries == [('SELECT 1', ())] for p in pool.pools)
+
+
+async def test_scatter_fetch_mixed_order():
+    shard_rows = [
+        [{'a': 1, 'b': 'z'}, {'a': 1, 'b': None}, {'a': 2, 'b': 'x'}],
+        [{'a': 1, 'b': 'y'}, {'a': 2, 'b': None}, {'a': 3, 'b': 'a'}],
+    ]
+    pool = ShardedPool([FakePool(f's{i}', rows) for i, rows in enumerate(shard_rows)], shard_key='tenant_id')
+    rows = await pool.scatter_fetch_b('SELECT a, b FROM t', _order_by=['t.a', V('t.b').desc().nulls_last()])
+    assert [(r['a'], r['b']) for r in rows] == [(1, 'z'), (1, 'y'), (1, None), (2, 'x'), (2, None), (3, 'a')]
+
+    # nulls sort first by default with DESC
+    shard_rows = [[{'a': None}, {'a': 3}, {'a': 1}], [{'a': None}, {'a': 2}]]
+    pool = ShardedPool([FakePool(f's{i}', rows) for i, rows in enumerate(shard_rows)], shard_key='tenant_id')
+    rows = await pool.scatter_fetch_b('SELECT a FROM t', _order_by=[V('a').desc()])
+    assert [r['a'] for r in rows] == [None, None, 3, 2, 1]